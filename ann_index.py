@@ -0,0 +1,223 @@
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+from typing import Iterable, List, Optional, Set
+from scoring import normalize
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # Indices of the k largest scores, best first.
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def spherical_kmeans(
+    vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0
+) -> np.ndarray:
+    """Unit-norm centroids of L2-normalised vectors, clustered by cosine."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=n_clusters) == 0
+        # Re-seed empty clusters with random points so every list is used.
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVF_Index:
+    """Inverted-file index over L2-normalised item embeddings.
+
+    Items are clustered by spherical k-means into n_lists lists, stored
+    contiguously per list. A query scores the centroids, then only the
+    items of its nprobe closest lists, so query time grows with
+    nprobe * N / n_lists instead of N. Raising nprobe trades latency for
+    recall; nprobe = n_lists is an exact search.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        item_ids: np.ndarray,
+        vectors: np.ndarray,
+    ):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.item_ids = item_ids
+        self.vectors = vectors
+
+    @classmethod
+    def build(
+        cls,
+        item_ids: Iterable[int],
+        embeddings: np.ndarray,
+        n_lists: int = None,
+        n_iter: int = 10,
+        max_training_points: int = 256,
+        seed: int = 0,
+        dtype: str = "float32",
+    ) -> "IVF_Index":
+        item_ids = np.asarray(list(item_ids), dtype=np.int64)
+        vectors = normalize(embeddings)
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        # Train on a sample of at most max_training_points per list.
+        rng = np.random.default_rng(seed)
+        n_train = min(len(vectors), n_lists * max_training_points)
+        sample = vectors[rng.choice(len(vectors), n_train, replace=False)]
+        centroids = spherical_kmeans(sample, n_lists, n_iter, seed)
+
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+        return cls(
+            centroids.astype(np.float32),
+            offsets,
+            item_ids[order],
+            vectors[order].astype(dtype),
+        )
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: int = 8,
+        exclude: List[Set[int]] = None,
+    ) -> List[List[int]]:
+        """Top-k item IDs per query by cosine similarity, skipping each
+        query's excluded items."""
+        queries = normalize(np.atleast_2d(queries))
+        nprobe = max(1, min(nprobe, self.n_lists))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        results = []
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            rows = np.concatenate(
+                [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists]
+            )
+            skip = exclude[row] if exclude is not None else ()
+            scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+            neighbors = []
+            for index in _top_k(scores, k + len(skip)):
+                item = int(self.item_ids[rows[index]])
+                if item not in skip:
+                    neighbors.append(item)
+                    if len(neighbors) == k:
+                        break
+            results.append(neighbors)
+        return results
+
+    def save(self, directory: str, digest: str = "") -> None:
+        # `digest` identifies what the index was built from; exists() checks
+        # it so that a changed catalog or model rebuilds the index.
+        os.makedirs(directory, exist_ok=True)
+        for name in ("centroids", "offsets", "item_ids", "vectors"):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "digest.txt"), "w") as file:
+            file.write(digest)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "IVF_Index":
+        def column(name: str) -> np.ndarray:
+            path = os.path.join(directory, f"{name}.npy")
+            return np.load(path, mmap_mode=mmap_mode)
+
+        return cls(
+            np.load(os.path.join(directory, "centroids.npy")),
+            np.load(os.path.join(directory, "offsets.npy")),
+            column("item_ids"),
+            column("vectors"),
+        )
+
+    @staticmethod
+    def exists(directory: str, digest: str = None) -> bool:
+        if not os.path.exists(os.path.join(directory, "offsets.npy")):
+            return False
+        if digest is None:
+            return True
+        digest_path = os.path.join(directory, "digest.txt")
+        if not os.path.exists(digest_path):
+            return False
+        with open(digest_path) as file:
+            return file.read() == digest
+
+
+def catalog_digest(item_ids: Iterable[int], *options) -> str:
+    # Digest of the catalog and of whatever else decides the item vectors.
+    digest = hashlib.sha256(repr(options).encode("utf-8"))
+    digest.update(np.asarray(list(item_ids), dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure IVF recall and query latency against exact search"
+    )
+    parser.add_argument(
+        "embeddings_path",
+        help="Item embedding matrix (.npy), e.g. from an embedding store",
+    )
+    parser.add_argument(
+        "--n_lists", type=int, help="Number of lists (default sqrt(N))"
+    )
+    parser.add_argument("--k", type=int, default=20, help="Neighbors per query")
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="Lists probed per query",
+    )
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    args = parser.parse_args()
+
+    embeddings = np.load(args.embeddings_path, mmap_mode="r")
+    start = time.perf_counter()
+    index = IVF_Index.build(range(len(embeddings)), embeddings, args.n_lists)
+    print(
+        f"Built {index.n_lists} lists over {len(index)} items "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    rng = np.random.default_rng(0)
+    queries = normalize(embeddings[rng.choice(len(embeddings), args.queries)])
+    queries = normalize(queries + rng.normal(0, 0.05, queries.shape))
+    vectors = normalize(embeddings)
+    start = time.perf_counter()
+    exact = [set(_top_k(vectors @ query, args.k).tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"exact: {exact_ms:.2f} ms/query")
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        found = index.search(queries, args.k, nprobe)
+        query_ms = (time.perf_counter() - start) / len(queries) * 1000
+        recall = np.mean(
+            [len(expected & set(ids)) / args.k for expected, ids in zip(exact, found)]
+        )
+        print(
+            f"nprobe {nprobe}: recall@{args.k} {recall:.3f}, "
+            f"{query_ms:.2f} ms/query"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterator, List, Tuple
+from metrics import Metrics
+from transport import Transport
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+EMBEDDINGS = "/v1/embeddings"
+
+# OpenAI Batch API limits per input file.
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 200 * 1024 * 1024
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class Batch_Error(RuntimeError):
+    """A batch job returned no usable result."""
+
+
+class OpenAI_Batch_Backend:
+    """Uploads batch input files to the OpenAI Batch API and reads back the
+    output and error files of finished jobs."""
+
+    def __init__(
+        self, client, transport: Transport = None, completion_window: str = "24h"
+    ):
+        self.client = client
+        self.transport = transport or Transport()
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str, endpoint: str) -> str:
+        with open(input_path, "rb") as file:
+            content = file.read()
+        uploaded = self.transport.call(
+            self.client.files.create,
+            file=(os.path.basename(input_path), content),
+            purpose="batch",
+        )
+        batch = self.transport.call(
+            self.client.batches.create,
+            input_file_id=uploaded.id,
+            endpoint=endpoint,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.transport.call(self.client.batches.retrieve, batch_id).status
+
+    def results(self, batch_id: str) -> Iterator[Dict]:
+        # Expired jobs still carry the requests that finished in time.
+        batch = self.transport.call(self.client.batches.retrieve, batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.transport.call(self.client.files.content, file_id)
+            for line in content.text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Local_Batch_Backend:
+    """File-based stand-in for the Batch API.
+
+    Jobs are kept as files in `directory` and, like real jobs, move one
+    status per poll: validating, in_progress, finalizing, completed. The
+    requests run one at a time through `respond(endpoint, body)` when a job
+    leaves in_progress. Input and output lines use the Batch API format, so
+    the submit/poll/ingest flow can be exercised offline, also across
+    processes.
+    """
+
+    NEXT_STATUS = {
+        "validating": "in_progress",
+        "in_progress": "finalizing",
+        "finalizing": "completed",
+    }
+
+    def __init__(self, directory: str, respond: Callable[[str, Dict], Dict]):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.respond = respond
+
+    def _path(self, batch_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{suffix}")
+
+    def _read_state(self, batch_id: str) -> Dict:
+        with open(self._path(batch_id, "json")) as file:
+            return json.load(file)
+
+    def _write_state(self, batch_id: str, state: Dict) -> None:
+        tmp_path = self._path(batch_id, "json.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self._path(batch_id, "json"))
+
+    def submit(self, input_path: str, endpoint: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        shutil.copyfile(input_path, self._path(batch_id, "input.jsonl"))
+        self._write_state(batch_id, {"endpoint": endpoint, "status": "validating"})
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        state = self._read_state(batch_id)
+        if state["status"] not in TERMINAL_STATUSES:
+            if state["status"] == "in_progress":
+                self._run(batch_id)
+            state["status"] = self.NEXT_STATUS[state["status"]]
+            self._write_state(batch_id, state)
+        return state["status"]
+
+    def _run(self, batch_id: str) -> None:
+        tmp_path = self._path(batch_id, "output.jsonl.tmp")
+        with open(self._path(batch_id, "input.jsonl")) as requests, open(
+            tmp_path, "w"
+        ) as output:
+            for index, line in enumerate(requests):
+                request = json.loads(line)
+                record = {"id": f"batch_req_{index}", "custom_id": request["custom_id"]}
+                try:
+                    body = self.respond(request["url"], request["body"])
+                    record["response"] = {"status_code": 200, "body": body}
+                    record["error"] = None
+                except Exception as error:
+                    record["response"] = None
+                    record["error"] = {"code": "local_error", "message": str(error)}
+                output.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self._path(batch_id, "output.jsonl"))
+
+    def results(self, batch_id: str) -> Iterator[Dict]:
+        with open(self._path(batch_id, "output.jsonl")) as file:
+            for line in file:
+                yield json.loads(line)
+
+
+def openai_responder(
+    client, transport: Transport = None
+) -> Callable[[str, Dict], Dict]:
+    # Answers batch requests with interactive calls to an OpenAI-compatible
+    # API, e.g. for servers without a batch endpoint or the benchmark's
+    # local provider stand-in.
+    transport = transport or Transport()
+    endpoints = {
+        CHAT_COMPLETIONS: client.chat.completions.create,
+        EMBEDDINGS: client.embeddings.create,
+    }
+
+    def respond(endpoint: str, body: Dict) -> Dict:
+        return transport.call(endpoints[endpoint], **body).model_dump()
+
+    return respond
+
+
+class Batch_Runner:
+    """Runs many requests to one endpoint as batch jobs.
+
+    Requests are written to JSONL input files within the provider's size
+    limits, submitted, polled until every job has finished, and the
+    response bodies are returned by custom_id. Submitted jobs are recorded
+    in `directory` under a digest of their input file, so rerunning the
+    same command after an interruption waits for the jobs already
+    submitted instead of paying for them again.
+    """
+
+    def __init__(
+        self,
+        backend,
+        directory: str,
+        poll_interval: float = 30.0,
+        max_requests_per_file: int = MAX_REQUESTS_PER_FILE,
+        max_bytes_per_file: int = MAX_BYTES_PER_FILE,
+        metrics: Metrics = None,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.backend = backend
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.max_requests_per_file = max_requests_per_file
+        self.max_bytes_per_file = max_bytes_per_file
+        self.metrics = metrics or Metrics()
+        self.jobs_path = os.path.join(directory, "jobs.json")
+        # Blocks of users run concurrently and share the jobs file.
+        self._jobs_lock = threading.Lock()
+
+    def _load_jobs(self) -> Dict[str, str]:
+        if not os.path.exists(self.jobs_path):
+            return {}
+        with open(self.jobs_path) as file:
+            return json.load(file)
+
+    def _save_jobs(self, jobs: Dict[str, str]) -> None:
+        tmp_path = self.jobs_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(jobs, file, indent=2)
+        os.replace(tmp_path, self.jobs_path)
+
+    def _split(self, endpoint: str, requests: Dict[str, Dict]) -> List[List[str]]:
+        # Input file contents as lists of JSONL lines.
+        files, lines, size = [], [], 0
+        for custom_id, body in requests.items():
+            line = json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": endpoint,
+                    "body": body,
+                }
+            )
+            n_bytes = len(line.encode("utf-8")) + 1
+            if lines and (
+                len(lines) >= self.max_requests_per_file
+                or size + n_bytes > self.max_bytes_per_file
+            ):
+                files.append(lines)
+                lines, size = [], 0
+            lines.append(line)
+            size += n_bytes
+        if lines:
+            files.append(lines)
+        return files
+
+    def _write_input(self, endpoint: str, lines: List[str]) -> Tuple[str, str]:
+        content = "".join(line + "\n" for line in lines)
+        digest = hashlib.sha256(f"{endpoint}\n{content}".encode("utf-8")).hexdigest()
+        path = os.path.join(self.directory, f"input-{digest[:16]}.jsonl")
+        with open(path, "w") as file:
+            file.write(content)
+        return path, digest
+
+    def run(self, endpoint: str, requests: Dict[str, Dict]) -> Dict[str, Dict]:
+        if not requests:
+            return {}
+
+        batch_ids = []
+        for lines in self._split(endpoint, requests):
+            path, digest = self._write_input(endpoint, lines)
+            with self._jobs_lock:
+                jobs = self._load_jobs()
+                if digest in jobs:
+                    self.metrics.count("batch.resumed_jobs")
+                else:
+                    jobs[digest] = self.backend.submit(path, endpoint)
+                    self._save_jobs(jobs)
+                    self.metrics.count("batch.submitted_jobs")
+                    self.metrics.count("batch.submitted_requests", len(lines))
+            batch_ids.append((digest, jobs[digest]))
+        print(f"Waiting for {len(batch_ids)} batch job(s): {len(requests)} requests.")
+
+        with self.metrics.timer("batch.wait"):
+            pending = dict(batch_ids)
+            while True:
+                for digest, batch_id in list(pending.items()):
+                    status = self.backend.status(batch_id)
+                    if status not in TERMINAL_STATUSES:
+                        continue
+                    del pending[digest]
+                    if status != "completed":
+                        # Forget the job so the next run submits it again.
+                        print(f"Batch job {batch_id} ended with status {status}.")
+                        with self._jobs_lock:
+                            jobs = self._load_jobs()
+                            jobs.pop(digest, None)
+                            self._save_jobs(jobs)
+                if not pending:
+                    break
+                time.sleep(self.poll_interval)
+
+        responses = {}
+        for _, batch_id in batch_ids:
+            for record in self.backend.results(batch_id):
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    responses[record["custom_id"]] = response["body"]
+        self.metrics.count("batch.failed_requests", len(requests) - len(responses))
+        return responses
@@ -0,0 +1,512 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+# Reranker paths in main.py and the flags that select them.
+PATHS = {
+    "hf-similarity": ["--model_type", "discriminative", "--model_source", "huggingface"],
+    "openai-embeddings": ["--model_type", "discriminative", "--model_source", "openai"],
+    "hf-chat-stream": ["--model_type", "generative", "--model_source", "huggingface"],
+    "openai-chat": ["--model_type", "generative", "--model_source", "openai"],
+    "hf-local": [
+        "--model_type",
+        "discriminative",
+        "--model_source",
+        "huggingface",
+        "--hf_backend",
+        "local",
+    ],
+}
+DEFAULT_PATHS = ["hf-similarity", "openai-embeddings", "hf-chat-stream", "openai-chat"]
+
+CANDIDATES_PATTERN = re.compile(r"item_ids that you need to rerank: \[([^\]]*)\]")
+EMBEDDING_DIMENSIONS = 64
+
+
+def generate_dataset(
+    directory: str,
+    n_users: int = 1000,
+    n_items: int = 5000,
+    history_length: int = 20,
+    top_k: int = 20,
+    comments_per_user: int = 5,
+    seed: int = 0,
+) -> Dict[str, str]:
+    """Write MicroLens-shaped pairs, titles, comments and inference files.
+
+    Each user's newest interaction is the held-out true item, and is placed
+    in the candidate list of roughly half of the users so the metrics are
+    not degenerate.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        name: os.path.join(directory, file_name)
+        for name, file_name in [
+            ("pairs_path", "pairs.csv"),
+            ("titles_path", "titles.csv"),
+            ("comments_path", "comments.txt"),
+            ("inference_path", "inference.txt"),
+        ]
+    }
+    words = ["cat", "dance", "travel", "cooking", "game", "music", "news", "vlog"]
+
+    with open(paths["titles_path"], "w") as file:
+        for item in range(1, n_items + 1):
+            title = " ".join(rng.choice(words, size=4))
+            file.write(f'{item},"{title} {item}"\n')
+
+    with open(paths["pairs_path"], "w") as pairs, open(
+        paths["comments_path"], "w"
+    ) as comments, open(paths["inference_path"], "w") as inference:
+        pairs.write("user,item,timestamp\n")
+        for user in range(1, n_users + 1):
+            history = rng.choice(n_items, size=history_length, replace=False) + 1
+            timestamps = np.sort(rng.integers(0, 10**9, size=history_length))[::-1]
+            for item, timestamp in zip(history, timestamps):
+                pairs.write(f"{user},{item},{timestamp}\n")
+            for item in rng.choice(history, size=min(comments_per_user, history_length)):
+                comments.write(f"{user}\t{item}\tcomment on {item} by {user}\n")
+
+            candidates = rng.choice(n_items, size=top_k, replace=False) + 1
+            if rng.random() < 0.5 and history[0] not in candidates:
+                candidates[rng.integers(top_k)] = history[0]
+            inference.write(
+                f"User {user}: Top {top_k} recommended items: "
+                f"[{', '.join(map(str, candidates))}]\n"
+            )
+    return paths
+
+
+def _hash_floats(text: str, n: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(n).tolist()
+
+
+class Mock_Provider:
+    """Local HTTP stand-in for the HF and OpenAI endpoints main.py calls.
+
+    Serves HF inference (/models/<name>: captions for image bodies,
+    similarity scores for sentence-similarity payloads), HF chat streaming
+    and OpenAI chat (/v1/chat/completions, streamed as SSE when requested)
+    and OpenAI embeddings (/v1/embeddings). Every request waits for an
+    exponentially distributed latency and fails with 503 or 429 at the
+    configured error rate. Chat responses rank the candidates in reverse.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        error_rate: float = 0.0,
+        stream_chunk_delay: float = 0.002,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stream_chunk_delay = stream_chunk_delay
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "Mock_Provider":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+
+    def _draw(self):
+        # Latency and whether to fail, drawn under the lock for determinism.
+        with self._lock:
+            self.requests += 1
+            delay = self._random.expovariate(1 / self.latency) if self.latency else 0
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+                status = self._random.choice([429, 503])
+            else:
+                status = 200
+        return delay, status
+
+    def _make_handler(self):
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body, headers: Dict[str, str] = None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                delay, status = provider._draw()
+                time.sleep(delay)
+                if status != 200:
+                    self._send_json(
+                        status, {"error": "injected failure"}, {"Retry-After": "0"}
+                    )
+                    return
+
+                if self.path.startswith("/models/"):
+                    self._hf_inference(body)
+                elif self.path.endswith("/chat/completions"):
+                    self._chat(json.loads(body))
+                elif self.path.endswith("/embeddings"):
+                    self._embeddings(json.loads(body))
+                else:
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+
+            def _hf_inference(self, body: bytes):
+                try:
+                    inputs = json.loads(body)["inputs"]
+                except (ValueError, KeyError, TypeError):
+                    digest = hashlib.sha256(body).hexdigest()[:8]
+                    self._send_json(200, [{"generated_text": f"an image {digest}"}])
+                    return
+                source = np.array(_hash_floats(inputs["source_sentence"], 16))
+                scores = [
+                    float(np.dot(source, _hash_floats(sentence, 16)))
+                    for sentence in inputs["sentences"]
+                ]
+                self._send_json(200, scores)
+
+            def _embeddings(self, request: Dict):
+                texts = request["input"]
+                if isinstance(texts, str):
+                    texts = [texts]
+                self._send_json(
+                    200,
+                    {
+                        "object": "list",
+                        "model": request.get("model", ""),
+                        "data": [
+                            {
+                                "object": "embedding",
+                                "index": index,
+                                "embedding": _hash_floats(text, EMBEDDING_DIMENSIONS),
+                            }
+                            for index, text in enumerate(texts)
+                        ],
+                        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                    },
+                )
+
+            def _chat(self, request: Dict):
+                prompt = request["messages"][-1]["content"]
+                match = CANDIDATES_PATTERN.search(prompt)
+                ids = re.findall(r"\d+", match.group(1)) if match else []
+                text = ", ".join(reversed(ids))
+                model = request.get("model", "")
+                created = int(time.time())
+
+                if not request.get("stream"):
+                    self._send_json(
+                        200,
+                        {
+                            "id": "mock",
+                            "object": "chat.completion",
+                            "created": created,
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {"role": "assistant", "content": text},
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                            "usage": {
+                                "prompt_tokens": 0,
+                                "completion_tokens": 0,
+                                "total_tokens": 0,
+                            },
+                        },
+                    )
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                # One ID (plus separator) per chunk, like one or two tokens.
+                pieces = [f"{item}, " for item in reversed(ids)] + [None]
+                try:
+                    for piece in pieces:
+                        chunk = {
+                            "id": "mock",
+                            "object": "chat.completion.chunk",
+                            "created": created,
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": {"content": piece} if piece else {},
+                                    "finish_reason": None if piece else "stop",
+                                }
+                            ],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        time.sleep(provider.stream_chunk_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading once it had every ID.
+                    pass
+
+        return Handler
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_path(argv: List[str]) -> Dict:
+    """Rerank every user of one path in this process and measure it."""
+    from driver import run_concurrently
+    from main import build_data, build_model, build_parser, make_rerank_tasks
+    from metrics import Metrics
+    from recommendations import read_recommendations
+    from transport import Transport
+
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+    transport = Transport(
+        requests_per_second=args.requests_per_second,
+        max_retries=args.max_retries,
+        timeout=args.request_timeout,
+        pool_size=max(args.concurrency, 1),
+    )
+    metrics = Metrics()
+    data = build_data(args, transport, metrics)
+    model = build_model(args, data, transport, metrics=metrics)
+    setup_seconds = time.perf_counter() - start
+
+    # Every user in a task waits for the whole task, so a block's latency
+    # counts once per user in it.
+    latencies: List[float] = []
+    rerank, tasks = make_rerank_tasks(
+        args, model, read_recommendations(args.inference_path)
+    )
+
+    def timed_rerank(task):
+        task_start = time.perf_counter()
+        result = rerank(task)
+        latencies.extend([time.perf_counter() - task_start] * len(result))
+        return result
+
+    start = time.perf_counter()
+    results = run_concurrently(timed_rerank, tasks, args.concurrency)
+    elapsed = time.perf_counter() - start
+    transport.close()
+
+    users = sum(len(result) for result in results)
+    return {
+        "users": users,
+        "setup_seconds": setup_seconds,
+        "rerank_seconds": elapsed,
+        "users_per_second": users / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": metrics.summary(),
+    }
+
+
+def path_argv(path: str, dataset: Dict[str, str], server_url: str, args) -> List[str]:
+    model_name = {
+        "hf-similarity": "mock/sentence-similarity",
+        "openai-embeddings": "text-embedding-3-small",
+        "hf-chat-stream": "meta-llama/Meta-Llama-3-8B-Instruct",
+        "openai-chat": "gpt-4o-mini",
+        "hf-local": args.local_model_name,
+    }[path]
+    argv = PATHS[path] + [
+        "--model_name",
+        model_name,
+        "--inference_path",
+        dataset["inference_path"],
+        "--pairs_path",
+        dataset["pairs_path"],
+        "--titles_path",
+        dataset["titles_path"],
+        "--comments_path",
+        dataset["comments_path"],
+        "--hf_api_key",
+        "mock",
+        "--openai_api_key",
+        "mock",
+        "--hf_api_url",
+        f"{server_url}/models/",
+        "--hf_chat_base_url",
+        server_url,
+        "--openai_base_url",
+        f"{server_url}/v1",
+        "--concurrency",
+        str(args.concurrency),
+        "--requests_per_second",
+        str(args.requests_per_second),
+    ]
+    if args.include_comments:
+        argv.append("--include_comments")
+    return argv
+
+
+def main():
+    if sys.argv[1:2] == ["--run_path"]:
+        # Child process: one path, measured in isolation for peak RSS. The
+        # remaining arguments are main.py flags.
+        print(json.dumps(run_path(sys.argv[3:])))
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the reranker paths against local provider stand-ins"
+    )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        choices=list(PATHS),
+        default=DEFAULT_PATHS,
+        help="Reranker paths to benchmark (hf-local needs torch)",
+    )
+    parser.add_argument("--data_dir", help="Where to write the synthetic dataset")
+    parser.add_argument("--users", type=int, default=1000, help="Number of users")
+    parser.add_argument("--items", type=int, default=5000, help="Number of items")
+    parser.add_argument(
+        "--history_length", type=int, default=20, help="Interactions per user"
+    )
+    parser.add_argument("--top_k", type=int, default=20, help="Candidates per user")
+    parser.add_argument(
+        "--include_comments", action="store_true", help="Include comments in prompts"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Mean mock response latency in seconds",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of mock requests answered with 429/503",
+    )
+    parser.add_argument(
+        "--stream_chunk_delay",
+        type=float,
+        default=0.002,
+        help="Delay between streamed chat chunks in seconds",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Rerank requests in flight"
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=1000.0,
+        help="Client-side rate limit for the mock provider",
+    )
+    parser.add_argument(
+        "--local_model_name",
+        default="sentence-transformers/all-MiniLM-L6-v2",
+        help="Model for the hf-local path",
+    )
+    parser.add_argument("--output_json", help="Write the report as JSON here")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="rerank-benchmark-")
+    start = time.perf_counter()
+    dataset = generate_dataset(
+        data_dir,
+        n_users=args.users,
+        n_items=args.items,
+        history_length=args.history_length,
+        top_k=args.top_k,
+        seed=args.seed,
+    )
+    print(
+        f"Generated {args.users} users in {time.perf_counter() - start:.2f}s "
+        f"at {data_dir}"
+    )
+
+    provider = Mock_Provider(
+        args.latency, args.error_rate, args.stream_chunk_delay, args.seed
+    ).start()
+    report = {}
+    try:
+        for path in args.paths:
+            provider.reset_counters()
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run_path", path]
+                + path_argv(path, dataset, provider.url, args),
+                stdout=subprocess.PIPE,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            if completed.returncode != 0:
+                print(f"{path}: failed with exit code {completed.returncode}")
+                continue
+            result = json.loads(completed.stdout.decode().strip().splitlines()[-1])
+            result["requests"] = provider.requests
+            result["injected_errors"] = provider.errors
+            report[path] = result
+    finally:
+        provider.close()
+
+    print(
+        f"\n{'path':<20}{'users/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'peak RSS MB':>13}{'requests':>10}{'errors':>8}"
+    )
+    for path, result in report.items():
+        print(
+            f"{path:<20}{result['users_per_second']:>10.1f}"
+            f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['peak_rss_mb']:>13.1f}{result['requests']:>10}"
+            f"{result['injected_errors']:>8}"
+        )
+
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
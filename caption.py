@@ -0,0 +1,142 @@
+import argparse
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from tqdm import tqdm
+
+from caption_cache import Caption_Cache, save_captions
+from data import request_caption
+from transport import Transport
+
+IMAGE_NAME_PATTERN = re.compile(r"^(\d+)(?:-(\d+))?\.jpg$")
+
+
+def collect_images(
+    covers_path: Optional[str], frames_path: Optional[str]
+) -> List[Tuple[int, int, str]]:
+    # (item, frame, path) rows; covers are "<item>.jpg" and get frame 0,
+    # frames are "<item>-<i>.jpg".
+    images = []
+    for folder in (covers_path, frames_path):
+        if not folder:
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            match = IMAGE_NAME_PATTERN.match(file_name)
+            if not match:
+                continue
+            item, frame = match.groups()
+            images.append(
+                (int(item), int(frame or 0), os.path.join(folder, file_name))
+            )
+    return images
+
+
+def caption_corpus(
+    images: List[Tuple[int, int, str]],
+    model_name: str,
+    hf_api_key: str,
+    workers: int = 8,
+    caption_cache: Caption_Cache = None,
+    transport: Transport = None,
+) -> List[Tuple[int, int, str]]:
+    headers = {"Authorization": f"Bearer {hf_api_key}"}
+    session = transport or Transport(pool_size=workers)
+
+    def caption_one(image_path: str) -> str:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+
+        def compute() -> str:
+            return request_caption(
+                image_bytes, model_name, headers, image_path, session=session
+            )
+
+        if caption_cache is None:
+            return compute()
+        return caption_cache.get_or_compute(image_bytes, model_name, compute)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(caption_one, path): (item, frame, path)
+                for item, frame, path in images
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                item, frame, path = futures[future]
+                try:
+                    results.append((item, frame, future.result()))
+                except Exception as e:
+                    print(f"Error processing {path}: {e}")
+    finally:
+        if transport is None:
+            session.close()
+
+    results.sort(key=lambda row: (row[0], row[1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute captions for every cover and frame image"
+    )
+    parser.add_argument("--covers_path", help="Path to covers directory")
+    parser.add_argument("--frames_path", help="Path to frames directory")
+    parser.add_argument(
+        "--output_path", required=True, help="Path to the output .npz file"
+    )
+    parser.add_argument("--hf_api_key", help="HuggingFace API key")
+    parser.add_argument(
+        "--image_model_name",
+        default="Salesforce/blip-image-captioning-large",
+        help="HuggingFace image captioning model",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="Number of concurrent requests"
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=10.0,
+        help="Initial rate limit for captioning requests",
+    )
+    parser.add_argument(
+        "--caption_cache_path",
+        help="Path to a SQLite file caching image captions across runs",
+    )
+
+    args = parser.parse_args()
+    if not args.covers_path and not args.frames_path:
+        parser.error("at least one of --covers_path or --frames_path is required")
+
+    caption_cache = (
+        Caption_Cache(args.caption_cache_path) if args.caption_cache_path else None
+    )
+    transport = Transport(
+        requests_per_second=args.requests_per_second, pool_size=args.workers
+    )
+    images = collect_images(args.covers_path, args.frames_path)
+    results = caption_corpus(
+        images,
+        model_name=args.image_model_name,
+        hf_api_key=args.hf_api_key,
+        workers=args.workers,
+        caption_cache=caption_cache,
+        transport=transport,
+    )
+    transport.close()
+
+    items, frames, captions = zip(*results) if results else ((), (), ())
+    save_captions(args.output_path, list(items), list(frames), list(captions))
+    print(f"Captioned {len(results)} of {len(images)} images to {args.output_path}")
+
+    if caption_cache is not None:
+        stats = caption_cache.stats()
+        print(f"Caption cache: {stats['hits']} hits, {stats['misses']} misses")
+        caption_cache.close()
+
+
+if __name__ == "__main__":
+    main()
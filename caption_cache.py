@@ -0,0 +1,115 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def save_captions(
+    path: str, items: List[int], frames: List[int], captions: List[str]
+) -> None:
+    # Columnar layout: one row per image, frame 0 is the cover.
+    np.savez(
+        path,
+        item=np.asarray(items, dtype=np.int64),
+        frame=np.asarray(frames, dtype=np.int8),
+        caption=np.asarray(captions, dtype=np.str_),
+    )
+
+
+def load_captions(path: str) -> Dict[Tuple[int, int], str]:
+    with np.load(path) as columns:
+        return {
+            (int(item), int(frame)): str(caption)
+            for item, frame, caption in zip(
+                columns["item"], columns["frame"], columns["caption"]
+            )
+        }
+
+
+class Caption_Cache:
+    """Two-tier cache of image captions keyed by (image content hash, model).
+
+    An in-memory LRU sits in front of a SQLite table, so a caption is
+    computed once per corpus and survives across runs.
+    """
+
+    def __init__(self, path: str, max_memory_entries: int = 10000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            "digest TEXT NOT NULL, model TEXT NOT NULL, caption TEXT NOT NULL, "
+            "PRIMARY KEY (digest, model))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def _remember(self, key: Tuple[str, str], caption: str) -> None:
+        self._memory[key] = caption
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, digest: str, model: str) -> Optional[str]:
+        key = (digest, model)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT caption FROM captions WHERE digest = ? AND model = ?", key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, digest: str, model: str, caption: str) -> None:
+        key = (digest, model)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (digest, model, caption) "
+                "VALUES (?, ?, ?)",
+                (digest, model, caption),
+            )
+            self._conn.commit()
+            self._remember(key, caption)
+
+    def get_or_compute(
+        self, image_bytes: bytes, model: str, compute: Callable[[], str]
+    ) -> str:
+        digest = self.content_hash(image_bytes)
+        caption = self.get(digest, model)
+        if caption is None:
+            caption = compute()
+            self.put(digest, model, caption)
+        return caption
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.memory_hits + self.disk_hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,146 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from driver import batched, run_concurrently
+from eval import Evaluation
+from metrics import Metrics
+
+
+def top_k_agreement(ranked: List[int], baseline: List[int], k: int) -> float:
+    # Share of the reranked top k that the baseline also puts in its top k.
+    top = ranked[:k]
+    if not top:
+        return 1.0
+    return len(set(top) & set(baseline[:k])) / len(top)
+
+
+def boundary_margin(scores: List[float], k: int) -> float:
+    # Score gap across the top-k cut; a small gap means the cheap scorer
+    # barely decided which items make the top k.
+    if len(scores) <= k:
+        return float("inf")
+    return scores[k - 1] - scores[k]
+
+
+class Cascade_Policy:
+    """Chooses the users whose cheap ranking is worth an LLM call.
+
+    A user is uncertain when the cheap top k agrees with the baseline
+    (DSSM) top k less than min_agreement, or when its score margin at the
+    top-k cut is below min_margin. At most `fraction` of all users are
+    escalated, least agreement first, then smallest margin.
+    """
+
+    def __init__(
+        self,
+        fraction: float = 0.2,
+        k: int = 10,
+        min_agreement: float = 0.5,
+        min_margin: float = 0.01,
+    ):
+        if not 0.0 <= fraction <= 1.0:
+            raise ValueError(f"Escalation fraction {fraction} is not in [0, 1].")
+        if k < 1:
+            raise ValueError(f"Cascade k {k} is not at least 1.")
+        self.fraction = fraction
+        self.k = k
+        self.min_agreement = min_agreement
+        self.min_margin = min_margin
+
+    def signals(
+        self, ranked: List[int], scores: List[float], baseline: List[int]
+    ) -> Tuple[float, float]:
+        return (
+            top_k_agreement(ranked, baseline, self.k),
+            boundary_margin(scores, self.k),
+        )
+
+    def select(self, signals: Dict[int, Tuple[float, float]]) -> List[int]:
+        uncertain = [
+            user_id
+            for user_id, (agreement, margin) in signals.items()
+            if agreement < self.min_agreement or margin < self.min_margin
+        ]
+        uncertain.sort(key=lambda user_id: signals[user_id])
+        return uncertain[: int(self.fraction * len(signals))]
+
+
+def run_cascade(
+    pairs: Iterable[Tuple[int, List[int]]],
+    score_block: Callable[[Dict[int, List[int]]], Dict],
+    make_expensive_tasks: Callable[[Iterable[Tuple[int, List[int]]]], Tuple],
+    policy: Cascade_Policy,
+    block_size: int,
+    concurrency: int = 1,
+    on_result: Optional[Callable] = None,
+    metrics: Metrics = None,
+) -> Tuple[Dict[int, List[int]], Dict[int, List[int]], List[int]]:
+    """Rerank everyone with the cheap scorer, then escalate the users the
+    policy selects to the expensive reranker.
+
+    score_block maps a block of users to (ranked items, scores) per user,
+    and make_expensive_tasks turns (user, candidates) pairs into the
+    (rerank, tasks) of the expensive reranker. Returns the cheap lists,
+    the final lists and the escalated users in priority order.
+
+    on_result sees every final list once: escalated users' as the expensive
+    reranker finishes them, the others' only after the expensive pass. An
+    interrupted run therefore journals no cheap list of a user it had
+    escalated, and a resumed run selects again among every unfinished user.
+    """
+    metrics = metrics or Metrics()
+    baselines = {}
+
+    def cheap_task(block):
+        for user_id, items in block:
+            baselines[user_id] = items
+        return score_block(dict(block))
+
+    with metrics.timer("cascade.cheap"):
+        blocks = run_concurrently(cheap_task, batched(pairs, block_size), concurrency)
+    scored = {user_id: result for block in blocks for user_id, result in block.items()}
+    cheap = {user_id: ranked for user_id, (ranked, _) in scored.items()}
+
+    signals = {
+        user_id: policy.signals(ranked, scores, baselines[user_id])
+        for user_id, (ranked, scores) in scored.items()
+    }
+    escalated = policy.select(signals)
+    metrics.count("cascade.users", len(cheap))
+    metrics.count("cascade.escalated", len(escalated))
+
+    # The expensive reranker sees the same (possibly expanded) candidates,
+    # in the cheap order.
+    rerank, tasks = make_expensive_tasks(
+        (user_id, cheap[user_id]) for user_id in escalated
+    )
+    with metrics.timer("cascade.expensive"):
+        results = run_concurrently(rerank, tasks, concurrency, on_result=on_result)
+
+    escalated_set = set(escalated)
+    final = dict(cheap)
+    if on_result is not None:
+        for user_id, ranked in cheap.items():
+            if user_id not in escalated_set:
+                on_result(None, {user_id: ranked})
+    for result in results:
+        final.update(result)
+    return cheap, final, escalated
+
+
+def tradeoff_curve(
+    evaluation: Evaluation,
+    cheap: Dict[int, List[int]],
+    final: Dict[int, List[int]],
+    escalated: List[int],
+    n_list: List[int],
+    steps: int = 4,
+) -> List[Tuple[int, Dict[int, Dict[str, float]]]]:
+    # Metrics had only the first n escalated users been escalated, for
+    # evenly spaced n up to all of them. Every point reuses lists already
+    # computed, so the curve costs no extra model calls.
+    sizes = sorted({round(len(escalated) * step / steps) for step in range(steps + 1)})
+    curve = []
+    for size in sizes:
+        mixed = dict(cheap)
+        mixed.update((user_id, final[user_id]) for user_id in escalated[:size])
+        curve.append((size, evaluation.evaluate(mixed, n_list)))
+    return curve
@@ -1,58 +1,176 @@
 import os
-import re
+import threading
+import time
+import numpy as np
 import pandas as pd
 import requests
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from caption_cache import Caption_Cache, load_captions
+from metrics import Metrics
+from recommendations import Recommendation_Lists, iter_recommendations
+from snapshot import (
+    Comments,
+    load_comments,
+    load_pairs,
+    load_titles,
+    read_comments,
+    read_pairs,
+    read_titles,
+)
+from transport import Transport
+
+HF_INFERENCE_API_URL = "https://api-inference.huggingface.co/models/"
+
+
+def request_caption(
+    image_bytes: bytes,
+    model_name: str,
+    headers: Dict[str, str],
+    image_path: str = "",
+    session=None,
+    api_url: str = HF_INFERENCE_API_URL,
+) -> str:
+    response = (session or requests).post(
+        api_url + model_name, headers=headers, data=image_bytes
+    )
+    response_data = response.json()
+
+    if not response_data or "generated_text" not in response_data[0]:
+        raise ValueError(
+            f"Invalid response from image processing API for {image_path}."
+        )
+    return response_data[0]["generated_text"]
 
 
 class Data:
     def __init__(
         self,
-        pairs_path: str,
-        titles_path: str,
+        pairs_path: str = None,
+        titles_path: str = None,
         comments_path: str = None,
         covers_path: str = None,
         frames_path: str = None,
+        hf_api_key: str = None,
+        image_model_name: str = "Salesforce/blip-image-captioning-large",
+        caption_cache_path: str = None,
+        captions_path: str = None,
+        transport: Transport = None,
+        hf_api_url: str = HF_INFERENCE_API_URL,
+        metrics: Metrics = None,
+        snapshot_path: str = None,
+        include_comments: bool = True,
     ):
-        self.pairs = pd.read_csv(pairs_path)
-        self.titles = pd.read_csv(titles_path, header=None)
-        self.titles.columns = ["item", "title"]
-        self.comments = None
+        start = time.perf_counter()
+        self.metrics = metrics or Metrics()
+        if snapshot_path:
+            # Columns are memory-mapped from a snapshot written by snapshot.py.
+            self._pair_users, self._pair_items, self._pair_timestamps = load_pairs(
+                snapshot_path
+            )
+            title_items, self._title_pool = load_titles(snapshot_path)
+        elif pairs_path and titles_path:
+            self._pair_users, self._pair_items, self._pair_timestamps = read_pairs(
+                pairs_path
+            )
+            title_items, self._title_pool = read_titles(titles_path)
+        else:
+            raise ValueError(
+                "Either snapshot_path or pairs_path and titles_path are required."
+            )
+        self.snapshot_path = snapshot_path
+        self.comments_path = comments_path
+        self.include_comments = include_comments
+        self._comments = None
+        self._comments_lock = threading.Lock()
         self.covers_path = covers_path
         self.frames_path = frames_path
-
-        if comments_path:
-            self.comments = pd.read_csv(
-                comments_path,
-                sep="\t",
-                header=None,
-                names=["user_id", "item_id", "comment"],
-                dtype={"user_id": int, "item_id": int, "comment": str},
-            )
+        self.image_model_name = image_model_name
+        self.headers = {"Authorization": f"Bearer {hf_api_key}"}
+        self.hf_api_url = hf_api_url
+        self.transport = transport or Transport()
+        self.caption_cache = (
+            Caption_Cache(caption_cache_path) if caption_cache_path else None
+        )
+        self.captions: Dict[Tuple[int, int], str] = {}
+        if captions_path:
+            self.captions = load_captions(captions_path)
+        frames = {frame for _, frame in self.captions}
+        self._has_cover_captions = 0 in frames
+        self._has_frame_captions = bool(frames - {0})
+
+        self._build_item_index(title_items)
+        self._build_history_index()
+        self.metrics.observe("data.load", time.perf_counter() - start)
+
+    @property
+    def comments(self) -> Optional[Comments]:
+        # Comments are the largest input, so they are only read on first
+        # use, and never when include_comments is off.
+        if self._comments is None and self.include_comments:
+            with self._comments_lock:
+                if self._comments is None:
+                    with self.metrics.timer("data.load_comments"):
+                        if self.comments_path:
+                            self._comments = read_comments(self.comments_path)
+                        elif self.snapshot_path:
+                            self._comments = load_comments(self.snapshot_path)
+        return self._comments
+
+    def _build_history_index(self) -> None:
+        # CSR-style index: every user's interactions, newest first, are one
+        # contiguous slice of self._history_rows between two offsets. Users
+        # are interned to dense rows into the offsets, and the history holds
+        # int32 item rows rather than raw 64-bit item IDs.
+        users = self._pair_users
+        order = np.lexsort((-self._pair_timestamps, users))
+        sorted_users = users[order]
+
+        self._history_rows = np.searchsorted(
+            self._item_ids, self._pair_items[order]
+        ).astype(np.int32)
+        self._user_ids, starts = np.unique(sorted_users, return_index=True)
+        self._user_offsets = np.append(starts, len(sorted_users))
+        self._user_rows = {int(user): row for row, user in enumerate(self._user_ids)}
+
+    def _build_item_index(self, title_items: np.ndarray) -> None:
+        # Dense int32 rows for every item seen in pairs or titles; validity
+        # and title pool rows are arrays over those rows.
+        pair_items = self._pair_items
+        self._item_ids = np.union1d(pair_items, title_items)
+        if len(self._item_ids) > np.iinfo(np.int32).max:
+            raise ValueError(f"{len(self._item_ids)} items do not fit int32 rows.")
+        self._item_rows = {int(item): row for row, item in enumerate(self._item_ids)}
+
+        self._valid_item_mask = np.zeros(len(self._item_ids), dtype=bool)
+        self._valid_item_mask[np.searchsorted(self._item_ids, pair_items)] = True
+        self._valid_users = pd.unique(self._pair_users).tolist()
+        self._valid_items = pd.unique(pair_items).tolist()
+
+        self._title_rows = np.full(len(self._item_ids), -1, dtype=np.int32)
+        title_rows = np.searchsorted(self._item_ids, title_items)
+        # Assign in reverse so the first title row of a duplicated item wins.
+        self._title_rows[title_rows[::-1]] = np.arange(len(title_items))[::-1]
+
+    def _get_user_history(self, user_id: int) -> np.ndarray:
+        row = self._user_rows.get(user_id)
+        if row is None:
+            raise ValueError(f"No items found for user {user_id}.")
+        start, end = self._user_offsets[row], self._user_offsets[row + 1]
+        return self._item_ids[self._history_rows[start:end]]
 
     def parse_recommendations(self, file_path: str) -> Dict[int, List[int]]:
         try:
-            with open(file_path, "r") as file:
-                content = file.read()
-
-            pattern = re.compile(r"User (\d+): Top 20 recommended items: \[([^\]]+)\]")
-            data = pattern.findall(content)
-
-            recommendation_dict = {
-                int(user): list(map(int, items.split(", "))) for user, items in data
-            }
-            return recommendation_dict
-
+            return dict(iter_recommendations(file_path))
         except FileNotFoundError:
             print("File not found. Please provide a valid file path.")
         except Exception as e:
             print(f"An error occurred: {e}")
 
     def get_valid_users(self) -> List[int]:
-        return self.pairs["user"].unique().tolist()
+        return list(self._valid_users)
 
     def get_valid_items(self) -> List[int]:
-        return self.pairs["item"].unique().tolist()
+        return list(self._valid_items)
 
     def get_all_users(self) -> List[int]:
         return self.get_valid_users()
@@ -61,69 +179,77 @@ class Data:
         return self.get_valid_items()
 
     def is_valid_user(self, user_id: int) -> bool:
-        return user_id in self.get_all_users()
+        return user_id in self._user_rows
 
     def is_valid_item(self, item_id: int) -> bool:
-        return item_id in self.get_all_items()
+        row = self._item_rows.get(item_id)
+        return row is not None and bool(self._valid_item_mask[row])
 
     def get_true_item(self, user_id: int) -> int:
-        user_items = self.pairs[self.pairs["user"] == user_id]
-        if user_items.empty:
-            raise ValueError(f"No items found for user {user_id}.")
-
-        true_item = user_items.sort_values(by="timestamp", ascending=False)[
-            "item"
-        ].iloc[0]
-        return true_item
+        return int(self._get_user_history(user_id)[0])
 
     def get_N_latest_items(self, user_id: int, N: int) -> List[int]:
-        user_items = self.pairs[self.pairs["user"] == user_id]
-        if user_items.empty:
-            raise ValueError(f"No items found for user {user_id}.")
-
-        latest_items = (
-            user_items.sort_values(by="timestamp", ascending=False)["item"]
-            .head(N + 2)
-            .tolist()
-        )
-        return latest_items[2:]
+        return self._get_user_history(user_id)[2 : N + 2].tolist()
 
     def extract_comments(self, user_id: int, item_id: int) -> List[str]:
-        if self.comments is None:
+        comments = self.comments
+        if comments is None:
             raise ValueError("Comments data is not loaded.")
 
-        comments_list = self.comments[
-            (self.comments["user_id"] == user_id)
-            & (self.comments["item_id"] == item_id)
-        ]["comment"]
-        if comments_list.empty:
-            return []
-        return comments_list.tolist()
+        return comments.get(user_id, item_id)
 
     def extract_title(self, item_id: int) -> str:
         if item_id <= 0:
             raise ValueError(f"Item ID {item_id} is not valid.")
 
-        title_row = self.titles[self.titles["item"] == item_id]
-        if title_row.empty:
+        row = self._item_rows.get(item_id)
+        if row is None or self._title_rows[row] < 0:
             raise ValueError(f"No title found for Item ID {item_id}.")
-        return title_row["title"].iloc[0]
+        return self._title_pool[self._title_rows[row]]
 
     def image2text(self, image_path: str) -> str:
         with open(image_path, "rb") as f:
             data = f.read()
-        response = requests.post(Image_model_API_URL, headers=headers, data=data)
-        response_data = response.json()
 
-        if not response_data or "generated_text" not in response_data[0]:
-            raise ValueError(
-                f"Invalid response from image processing API for {image_path}."
+        if self.caption_cache is None:
+            return self._request_caption(image_path, data)
+        return self.caption_cache.get_or_compute(
+            data,
+            self.image_model_name,
+            lambda: self._request_caption(image_path, data),
+        )
+
+    def _request_caption(self, image_path: str, data: bytes) -> str:
+        self.metrics.count("caption.requests")
+        with self.metrics.timer("caption.request"):
+            return request_caption(
+                data,
+                self.image_model_name,
+                self.headers,
+                image_path,
+                session=self.transport,
+                api_url=self.hf_api_url,
             )
-        return response_data[0]["generated_text"]
+
+    @property
+    def has_covers(self) -> bool:
+        # Covers come from image files, precomputed captions, or both.
+        return bool(self.covers_path) or self._has_cover_captions
+
+    @property
+    def has_frames(self) -> bool:
+        return bool(self.frames_path) or self._has_frame_captions
 
     def process_cover(self, item_id: int) -> str:
+        if not self.has_covers:
+            raise ValueError("Neither covers folder path nor captions are provided.")
+
+        if (item_id, 0) in self.captions:
+            self.metrics.count("caption.precomputed")
+            return self.captions[(item_id, 0)]
         if not self.covers_path:
-            raise ValueError("Covers folder path is not provided.")
+            print(f"No precomputed cover caption for item_id {item_id}.")
+            return None
 
         file_name = f"{item_id}.jpg"
         file_path = os.path.join(self.covers_path, file_name)
@@ -131,16 +257,24 @@ class Data:
             try:
                 return self.image2text(file_path)
             except Exception as e:
+                self.metrics.count("caption.errors")
                 print(f"Error processing {file_name}: {e}")
         else:
             print(f"File {file_name} not found in {self.covers_path}")
 
     def process_frames(self, item_id: int) -> List[str]:
-        if not self.frames_path:
-            raise ValueError("Frames folder path is not provided.")
+        if not self.has_frames:
+            raise ValueError("Neither frames folder path nor captions are provided.")
 
         text_list = []
         for i in range(1, 6):
+            if (item_id, i) in self.captions:
+                self.metrics.count("caption.precomputed")
+                text_list.append(self.captions[(item_id, i)])
+                continue
+            if not self.frames_path:
+                continue
+
             file_name = f"{item_id}-{i}.jpg"
             file_path = os.path.join(self.frames_path, file_name)
 
@@ -149,6 +283,7 @@ class Data:
                     text = self.image2text(file_path)
                     text_list.append(text)
                 except Exception as e:
+                    self.metrics.count("caption.errors")
                     print(f"Error processing {file_name}: {e}")
             else:
                 print(f"File {file_name} not found in {self.frames_path}")
@@ -160,16 +295,51 @@ class Data:
     def filter_items(self, item_list: List[int]) -> List[int]:
         return [item for item in item_list if self.is_valid_item(item)]
 
+    def get_true_items(self, user_ids: np.ndarray) -> np.ndarray:
+        # Vectorised get_true_item; users without history get -1.
+        user_ids = np.asarray(user_ids)
+        if len(self._user_ids) == 0:
+            return np.full(user_ids.shape, -1, dtype=np.int64)
+        rows = np.searchsorted(self._user_ids, user_ids)
+        rows = np.minimum(rows, len(self._user_ids) - 1)
+        known = self._user_ids[rows] == user_ids
+        true_items = self._item_ids[self._history_rows[self._user_offsets[rows]]]
+        return np.where(known, true_items, -1)
+
+    def valid_item_mask(self, item_ids: np.ndarray) -> np.ndarray:
+        # Vectorised is_valid_item over an array of any shape.
+        item_ids = np.asarray(item_ids)
+        if len(self._item_ids) == 0:
+            return np.zeros(item_ids.shape, dtype=bool)
+        rows = np.searchsorted(self._item_ids, item_ids)
+        rows = np.minimum(rows, len(self._item_ids) - 1)
+        return (self._item_ids[rows] == item_ids) & self._valid_item_mask[rows]
+
+    def true_item_ranks(self, user_ids: np.ndarray, items: np.ndarray) -> np.ndarray:
+        # 0-based rank of each user's true item in their row of a users x K
+        # item matrix, counting only valid items as filter_items would, or -1.
+        items = np.asarray(items)
+        if items.size == 0:
+            return np.full(len(user_ids), -1, dtype=np.int64)
+
+        valid = self.valid_item_mask(items)
+        filtered_ranks = np.cumsum(valid, axis=1) - 1
+        hits = valid & (items == self.get_true_items(user_ids)[:, None])
+        first_hit = hits.argmax(axis=1)
+        return np.where(
+            hits.any(axis=1),
+            filtered_ranks[np.arange(len(items)), first_hit],
+            -1,
+        )
+
     def hit_rate(self, user_id_list: List[int], item_id_list: List[List[int]]) -> float:
-        hits = 0
-        for user_id, items in zip(user_id_list, item_id_list):
-            items = self.filter_items(items)
-            if not items:
-                continue
-            if self.get_true_item(user_id) in items:
-                hits += 1
-        return hits / len(user_id_list)
+        lists = Recommendation_Lists.from_pairs(zip(user_id_list, item_id_list))
+        ranks = self.true_item_ranks(lists.users, lists.items)
+        return float(np.mean(ranks >= 0)) if len(ranks) else 0.0
 
     def ndcg(self, user_id_list: List[int], item_id_list: List[List[int]]) -> float:
-        # NDCG calculation placeholder
-        pass
+        # Single relevant item per user, so the ideal DCG is 1.
+        lists = Recommendation_Lists.from_pairs(zip(user_id_list, item_id_list))
+        ranks = self.true_item_ranks(lists.users, lists.items)
+        gains = np.where(ranks >= 0, 1.0 / np.log2(np.maximum(ranks, 0) + 2), 0.0)
+        return float(gains.mean()) if len(ranks) else 0.0
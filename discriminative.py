@@ -1,70 +1,446 @@
+import os
+import re
+import threading
 import numpy as np
-from typing import List
-from data import Data
+from typing import Dict, List, Optional, Tuple
+from data import HF_INFERENCE_API_URL, Data
+from ann_index import IVF_Index, catalog_digest
+from batch_jobs import EMBEDDINGS, Batch_Error, Batch_Runner
+from embedding_batcher import Embedding_Batcher
+from embedding_store import Embedding_Store
+from local_encoder import Local_Sentence_Encoder
+from metrics import Metrics
+from profile_store import User_Profile_Store, pool_profiles
+from scoring import pad_candidates, rank_candidates
+from transport import Transport
 import openai
 import requests
 
 
 class Discriminative_Model:
     def __init__(
-        self, name: str, source: str, data: Data, hf_api_key: str, openai_api_key: str
+        self,
+        name: str,
+        source: str,
+        data: Data,
+        hf_api_key: str,
+        openai_api_key: str,
+        embedding_store_dir: str = None,
+        embedding_store_dtype: str = "float32",
+        transport: Transport = None,
+        hf_backend: str = "remote",
+        local_batch_size: int = 64,
+        quantize: bool = False,
+        hf_api_url: str = HF_INFERENCE_API_URL,
+        openai_base_url: str = None,
+        metrics: Metrics = None,
+        profile_store_dir: str = None,
+        profile_pooling: str = "joined",
+        ann_index_dir: str = None,
+        ann_lists: int = None,
+        batch_runner: Batch_Runner = None,
     ):
         self.name = name
         self.source = source
         self.data = data
         self.headers = {"Authorization": f"Bearer {hf_api_key}"}
-        self.openai_client = openai.Client(api_key=openai_api_key)
+        self.hf_api_url = hf_api_url
+        self.transport = transport or Transport()
+        # Retries and timeouts belong to the transport alone.
+        self.openai_client = openai.Client(
+            api_key=openai_api_key,
+            base_url=openai_base_url,
+            max_retries=0,
+            timeout=self.transport.timeout,
+        )
+        self.metrics = metrics or data.metrics
+        self.embedding_store_dir = embedding_store_dir
+        self.embedding_store_dtype = embedding_store_dtype
+        self._embedding_stores: Dict[tuple, Embedding_Store] = {}
+        self.hf_backend = hf_backend
+        self.local_batch_size = local_batch_size
+        self.quantize = quantize
+        self._local_encoders: Dict[str, Local_Sentence_Encoder] = {}
+        self._local_encoders_lock = threading.Lock()
+        self.profile_store_dir = profile_store_dir
+        self.profile_pooling = profile_pooling
+        self._profile_stores: Dict[str, User_Profile_Store] = {}
+        self._profile_stores_lock = threading.Lock()
+        self.ann_index_dir = ann_index_dir
+        self.ann_lists = ann_lists
+        self._ann_indexes: Dict[tuple, IVF_Index] = {}
+        self._ann_indexes_lock = threading.Lock()
+        self.batch_runner = batch_runner
 
-    def reranker_sentence_transformers(
+    def _build_items_info(
         self,
         user_id: int,
         item_list: List[int],
-        model_name: str,
         include_title=True,
         include_cover=False,
         include_frames=False,
         include_comments=False,
-    ) -> List[int]:
-        previous_item_info = ""
-        previous_item_list = self.data.get_N_latest_items(user_id, 10)
-
-        # Compile previous item information
-        for item in previous_item_list:
-            item_title = self.data.extract_title(item)
-            previous_item_info += f"{item_title}.\n"
-
-        # Filter valid items
-        item_list = self.data.filter_items(item_list)
-
-        # Prepare information for items
+    ) -> Dict[int, str]:
+        # Captioning is timed as its own stage, apart from the lookups.
         items_info = {item: "" for item in item_list}
 
         # Add title information
         if include_title:
-            for item in item_list:
-                title = self.data.extract_title(item)
-                items_info[item] += f"Title: {title}\n"
+            with self.metrics.timer("data.lookup"):
+                for item in item_list:
+                    title = self.data.extract_title(item)
+                    items_info[item] += f"Title: {title}\n"
 
         # Add cover information
-        if include_cover and self.data.covers_path:
-            for item in item_list:
-                cover_text = self.data.process_cover(item)
-                if cover_text:
-                    items_info[item] += f"Cover: {cover_text}\n"
+        if include_cover and self.data.has_covers:
+            with self.metrics.timer("data.caption"):
+                for item in item_list:
+                    cover_text = self.data.process_cover(item)
+                    if cover_text:
+                        items_info[item] += f"Cover: {cover_text}\n"
 
         # Add frames information
-        if include_frames and self.data.frames_path:
-            for item in item_list:
-                frames_text = self.data.process_frames(item)
-                for i, frame in enumerate(frames_text, start=1):
-                    items_info[item] += f"Frame_{i}: {frame}\n"
+        if include_frames and self.data.has_frames:
+            with self.metrics.timer("data.caption"):
+                for item in item_list:
+                    frames_text = self.data.process_frames(item)
+                    for i, frame in enumerate(frames_text, start=1):
+                        items_info[item] += f"Frame_{i}: {frame}\n"
 
         # Add comments information
         if include_comments and self.data.comments is not None:
-            for item in item_list:
-                comments = self.data.extract_comments(user_id, item)
-                for i, comment in enumerate(comments, start=1):
-                    items_info[item] += f"Comment_{i}: {comment}\n"
+            with self.metrics.timer("data.lookup"):
+                for item in item_list:
+                    comments = self.data.extract_comments(user_id, item)
+                    for i, comment in enumerate(comments, start=1):
+                        items_info[item] += f"Comment_{i}: {comment}\n"
+
+        return items_info
+
+    def _get_local_encoder(self, model_name: str) -> Local_Sentence_Encoder:
+        with self._local_encoders_lock:
+            if model_name not in self._local_encoders:
+                self._local_encoders[model_name] = Local_Sentence_Encoder(
+                    model_name, batch_size=self.local_batch_size, quantize=self.quantize
+                )
+            return self._local_encoders[model_name]
+
+    def _embed_texts(self, texts: List[str], model_name: str) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self.metrics.count("model.requests")
+        self.metrics.count("model.embedded_texts", len(texts))
+        with self.metrics.timer("model.call"):
+            response = self.transport.call(
+                self.openai_client.embeddings.create, input=texts, model=model_name
+            )
+        return np.array([entry.embedding for entry in response.data], dtype=np.float32)
+
+    def _embed_requests(
+        self, requests: List[List[str]], model_name: str
+    ) -> List[np.ndarray]:
+        # All embedding requests of a flush as one batch job. Rows of
+        # requests the job failed are NaN, so callers can tell which texts
+        # were not embedded.
+        bodies = {
+            f"texts-{index}": {"model": model_name, "input": texts}
+            for index, texts in enumerate(requests)
+        }
+        self.metrics.count("model.requests", len(bodies))
+        self.metrics.count("model.embedded_texts", sum(map(len, requests)))
+        responses = self.batch_runner.run(EMBEDDINGS, bodies)
+        rows = {
+            custom_id: np.array(
+                [
+                    entry["embedding"]
+                    for entry in sorted(
+                        responses[custom_id]["data"], key=lambda entry: entry["index"]
+                    )
+                ],
+                dtype=np.float32,
+            )
+            for custom_id in bodies
+            if custom_id in responses
+        }
+        if not rows:
+            raise Batch_Error(
+                f"Embedding batch returned no result for its {len(bodies)} requests."
+            )
+        if len(rows) < len(bodies):
+            print(
+                f"Embedding batch returned no result for {len(bodies) - len(rows)} "
+                f"of {len(bodies)} requests."
+            )
+        dim = next(iter(rows.values())).shape[1]
+        return [
+            rows.get(custom_id, np.full((len(texts), dim), np.nan, dtype=np.float32))
+            for custom_id, texts in zip(bodies, requests)
+        ]
+
+    @staticmethod
+    def _fallback(item_list: List[int], with_scores: bool):
+        # The incoming order, scored flat so a cascade treats it as unsure.
+        return (item_list, [0.0] * len(item_list)) if with_scores else item_list
+
+    def _embedding_batcher(self, model_name: str) -> Embedding_Batcher:
+        return Embedding_Batcher(
+            lambda texts: self._embed_texts(texts, model_name),
+            embed_requests=(
+                (lambda requests: self._embed_requests(requests, model_name))
+                if self.batch_runner is not None
+                else None
+            ),
+        )
+
+    def _get_embedding_store(
+        self, model_name: str, include_title, include_cover, include_frames
+    ) -> Embedding_Store:
+        key = (model_name, include_title, include_cover, include_frames)
+        if key not in self._embedding_stores:
+            self._embedding_stores[key] = Embedding_Store(
+                self.embedding_store_dir,
+                model_name,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                dtype=self.embedding_store_dtype,
+            )
+        return self._embedding_stores[key]
+
+    def _get_profile_store(self, model_name: str) -> Optional[User_Profile_Store]:
+        if not self.profile_store_dir:
+            return None
+        with self._profile_stores_lock:
+            if model_name not in self._profile_stores:
+                self._profile_stores[model_name] = User_Profile_Store(
+                    self.profile_store_dir,
+                    model_name,
+                    pooling=self.profile_pooling,
+                    dtype=self.embedding_store_dtype,
+                )
+            return self._profile_stores[model_name]
+
+    def _history_text(self, history: List[int]) -> str:
+        return "".join(f"{self.data.extract_title(item)}.\n" for item in history)
+
+    def _stale_profiles(
+        self, user_ids: List[int], model_name: str
+    ) -> Tuple[Dict[int, List[int]], List[int], List[str], List[int]]:
+        # Each user's history, the users whose profile must be (re)encoded,
+        # and the texts to encode for them with the count per user.
+        histories = {
+            user_id: self.data.get_N_latest_items(user_id, 10) for user_id in user_ids
+        }
+        store = self._get_profile_store(model_name)
+        stale = list(histories) if store is None else store.stale(histories)
+        self.metrics.count("profiles.encoded", len(stale))
+        self.metrics.count("profiles.reused", len(histories) - len(stale))
+
+        if self.profile_pooling == "mean":
+            texts = [
+                f"Title: {self.data.extract_title(item)}\n"
+                for user_id in stale
+                for item in histories[user_id]
+            ]
+            return histories, stale, texts, [len(histories[user]) for user in stale]
+        texts = [self._history_text(histories[user_id]) for user_id in stale]
+        return histories, stale, texts, [1] * len(stale)
+
+    def _user_profiles(
+        self,
+        user_ids: List[int],
+        model_name: str,
+        histories: Dict[int, List[int]],
+        stale: List[int],
+        embeddings: np.ndarray,
+        counts: List[int],
+    ) -> np.ndarray:
+        store = self._get_profile_store(model_name)
+        if store is None:
+            # Without a store every user is stale, in user_ids order.
+            return pool_profiles(embeddings, counts)
+        if stale:
+            profiles = pool_profiles(embeddings, counts)
+            store.update(stale, [histories[user_id] for user_id in stale], profiles)
+        return store.get(user_ids)
+
+    def _encode_texts(self, texts: List[str], model_name: str) -> np.ndarray:
+        # Embeddings from whichever embedding backend this model uses.
+        if self.source == "openai":
+            batcher = self._embedding_batcher(model_name)
+            batcher.add("texts", texts)
+            embeddings = batcher.flush()["texts"]
+            if not np.isfinite(embeddings).all():
+                raise Batch_Error("Embedding batch failed for some texts.")
+            return embeddings
+        if self.hf_backend == "local":
+            self.metrics.count("model.embedded_texts", len(texts))
+            with self.metrics.timer("model.encode"):
+                return self._get_local_encoder(model_name).encode(texts)
+        raise ValueError(
+            "Embeddings need the OpenAI source or the local HF backend; the "
+            "remote sentence-similarity API only returns scores."
+        )
+
+    def _get_ann_index(
+        self, model_name: str, include_title, include_cover, include_frames
+    ) -> IVF_Index:
+        key = (model_name, include_title, include_cover, include_frames)
+        with self._ann_indexes_lock:
+            if key in self._ann_indexes:
+                return self._ann_indexes[key]
+
+            directory = None
+            if self.ann_index_dir:
+                directory = os.path.join(
+                    self.ann_index_dir,
+                    "{}-t{:d}c{:d}f{:d}".format(
+                        re.sub(r"[^A-Za-z0-9_.-]", "_", model_name),
+                        include_title,
+                        include_cover,
+                        include_frames,
+                    ),
+                )
+            item_ids = self.data.get_valid_items()
+            digest = catalog_digest(
+                item_ids,
+                model_name,
+                include_title,
+                include_cover,
+                include_frames,
+                self.ann_lists,
+                self.embedding_store_dtype,
+            )
+            if directory and IVF_Index.exists(directory, digest):
+                index = IVF_Index.load(directory)
+            else:
+                with self.metrics.timer("ann.build"):
+
+                    def embed_items(items: List[int]) -> np.ndarray:
+                        items_info = self._build_items_info(
+                            None,
+                            items,
+                            include_title=include_title,
+                            include_cover=include_cover,
+                            include_frames=include_frames,
+                        )
+                        return self._encode_texts(
+                            [items_info[item] for item in items], model_name
+                        )
+
+                    if self.embedding_store_dir:
+                        embeddings = self._get_embedding_store(
+                            model_name, include_title, include_cover, include_frames
+                        ).get_or_build(item_ids, embed_items)
+                    else:
+                        embeddings = embed_items(item_ids)
+                    index = IVF_Index.build(
+                        item_ids,
+                        embeddings,
+                        n_lists=self.ann_lists,
+                        dtype=self.embedding_store_dtype,
+                    )
+                if directory:
+                    index.save(directory, digest)
+            self._ann_indexes[key] = index
+            return index
+
+    def expand_candidates(
+        self,
+        user_items: Dict[int, List[int]],
+        model_name: str,
+        n_neighbors: int,
+        nprobe: int = 8,
+        include_title=True,
+        include_cover=False,
+        include_frames=False,
+    ) -> Dict[int, List[int]]:
+        """Append each user's n_neighbors nearest catalog items to their
+        candidates, by cosine similarity to the user profile.
+
+        Items already among the candidates or in the history the profile
+        was built from are skipped.
+        """
+        if not user_items:
+            return {}
+        index = self._get_ann_index(
+            model_name, include_title, include_cover, include_frames
+        )
+
+        user_ids = list(user_items)
+        histories, stale, texts, counts = self._stale_profiles(user_ids, model_name)
+        if texts:
+            embeddings = self._encode_texts(texts, model_name)
+        else:
+            # Only empty histories are stale; they pool to zero profiles.
+            embeddings = np.zeros((0, index.vectors.shape[1]), dtype=np.float32)
+        profiles = self._user_profiles(
+            user_ids, model_name, histories, stale, embeddings, counts
+        )
+
+        # A user without history has no profile to search by.
+        searchable = [row for row, profile in enumerate(profiles) if np.any(profile)]
+        added = {user_id: [] for user_id in user_ids}
+        if searchable:
+            with self.metrics.timer("ann.search"):
+                neighbors = index.search(
+                    profiles[searchable],
+                    n_neighbors,
+                    nprobe,
+                    exclude=[
+                        set(user_items[user_ids[row]]) | set(histories[user_ids[row]])
+                        for row in searchable
+                    ],
+                )
+            for row, items in zip(searchable, neighbors):
+                added[user_ids[row]] = items
+        self.metrics.count("ann.added_candidates", sum(map(len, added.values())))
+        return {
+            user_id: list(user_items[user_id]) + added[user_id] for user_id in user_ids
+        }
+
+    def close(self) -> None:
+        for store in self._profile_stores.values():
+            store.flush()
+
+    def reranker_sentence_transformers(
+        self,
+        user_id: int,
+        item_list: List[int],
+        model_name: str,
+        include_title=True,
+        include_cover=False,
+        include_frames=False,
+        include_comments=False,
+    ) -> List[int]:
+        if self.hf_backend == "local":
+            return self.rerank_sentence_transformers_batch(
+                {user_id: item_list},
+                model_name,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                include_comments=include_comments,
+            )[user_id]
+
+        with self.metrics.timer("data.lookup"):
+            # Compile previous item information
+            previous_item_info = self._history_text(
+                self.data.get_N_latest_items(user_id, 10)
+            )
+
+            # Filter valid items
+            item_list = self.data.filter_items(item_list)
+
+        # Prepare information for items
+        items_info = self._build_items_info(
+            user_id,
+            item_list,
+            include_title=include_title,
+            include_cover=include_cover,
+            include_frames=include_frames,
+            include_comments=include_comments,
+        )
 
         # Prepare payload for the API
         payload = {
@@ -76,11 +452,13 @@ class Discriminative_Model:
 
         # Send request to model API
         try:
-            response = requests.post(
-                f"https://api-inference.huggingface.co/models/{model_name}",
-                headers=self.headers,
-                json=payload,
-            )
+            self.metrics.count("model.requests")
+            with self.metrics.timer("model.call"):
+                response = self.transport.post(
+                    self.hf_api_url + model_name,
+                    headers=self.headers,
+                    json=payload,
+                )
             response.raise_for_status()
             result = response.json()
 
@@ -99,6 +477,68 @@ class Discriminative_Model:
         except Exception as e:
             raise RuntimeError(f"Unexpected error: {e}")
 
+    def rerank_sentence_transformers_batch(
+        self,
+        user_items: Dict[int, List[int]],
+        model_name: str,
+        include_title=True,
+        include_cover=False,
+        include_frames=False,
+        include_comments=False,
+        with_scores=False,
+    ) -> Dict[int, List[int]]:
+        # With with_scores, each user maps to (ranked items, their scores).
+        if not user_items:
+            return {}
+
+        # Encode every stale profile and candidate text of the block
+        # in-process, in one length-bucketed pass.
+        user_ids = list(user_items.keys())
+        filtered_items = {}
+        with self.metrics.timer("data.lookup"):
+            histories, stale, texts, counts = self._stale_profiles(
+                user_ids, model_name
+            )
+            n_profile_texts = len(texts)
+            for user_id in user_ids:
+                filtered_items[user_id] = self.data.filter_items(user_items[user_id])
+        for user_id, item_list in filtered_items.items():
+            items_info = self._build_items_info(
+                user_id,
+                item_list,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                include_comments=include_comments,
+            )
+            texts.extend(items_info[item] for item in item_list)
+
+        encoder = self._get_local_encoder(model_name)
+        self.metrics.count("model.embedded_texts", len(texts))
+        with self.metrics.timer("model.encode"):
+            embeddings = encoder.encode(texts)
+
+        items, mask = pad_candidates([filtered_items[user_id] for user_id in user_ids])
+        user_embeddings = self._user_profiles(
+            user_ids,
+            model_name,
+            histories,
+            stale,
+            embeddings[:n_profile_texts],
+            counts,
+        )
+        candidate_embeddings = np.zeros(
+            mask.shape + (user_embeddings.shape[1],), dtype=np.float32
+        )
+        # Row-major order of the mask matches the flattened candidate texts
+        candidate_embeddings[mask] = embeddings[n_profile_texts:]
+
+        with self.metrics.timer("scoring"):
+            ranked = rank_candidates(
+                items, mask, user_embeddings, candidate_embeddings, with_scores
+            )
+        return dict(zip(user_ids, ranked))
+
     def reranker_text_embedding_model(
         self,
         user_id: int,
@@ -109,68 +549,175 @@ class Discriminative_Model:
         include_frames=False,
         include_comments=False,
     ) -> List[int]:
-        # Get previous item information
-        previous_item_list = self.data.get_N_latest_items(user_id, 10)
-        total_item_info = ""
+        return self.rerank_text_embedding_batch(
+            {user_id: item_list},
+            model_name,
+            include_title=include_title,
+            include_cover=include_cover,
+            include_frames=include_frames,
+            include_comments=include_comments,
+        )[user_id]
 
-        for item in previous_item_list:
-            item_title = self.data.extract_title(item)
-            total_item_info += item_title
+    def rerank_text_embedding_batch(
+        self,
+        user_items: Dict[int, List[int]],
+        model_name: str,
+        include_title=True,
+        include_cover=False,
+        include_frames=False,
+        include_comments=False,
+        with_scores=False,
+    ) -> Dict[int, List[int]]:
+        # With with_scores, each user maps to (ranked items, their scores).
+        if not user_items:
+            return {}
 
-        # Calculate average embedding for previous items
-        agg_previous_item_embedding = self.openai_client.Embedding.create(
-            input=[total_item_info], model=model_name
-        )["data"][0]["embedding"]
+        # Every text for every user goes through one batcher, so a block of
+        # users costs a handful of embedding requests instead of 21 per user.
+        batcher = self._embedding_batcher(model_name)
 
-        # Filter valid items
-        item_list = self.data.filter_items(item_list)
+        # Item text depends only on the item unless comments are included,
+        # so those embeddings are persisted in the embedding store.
+        store = None
+        if self.embedding_store_dir and not include_comments:
+            store = self._get_embedding_store(
+                model_name, include_title, include_cover, include_frames
+            )
 
-        # Prepare item information
-        items_info = {item: "" for item in item_list}
+        with self.metrics.timer("data.lookup"):
+            # Profiles of users whose history is unchanged come from the
+            # profile store; the rest are embedded with the candidates.
+            histories, stale, profile_texts, profile_counts = self._stale_profiles(
+                list(user_items), model_name
+            )
+            batcher.add("profiles", profile_texts)
 
-        if include_title:
-            for item in item_list:
-                title = self.data.extract_title(item)
-                items_info[item] += f"Title: {title}\n"
-
-        if include_cover and self.data.covers_path:
-            for item in item_list:
-                cover_text = self.data.process_cover(item)
-                if cover_text:
-                    items_info[item] += f"Cover: {cover_text}\n"
-
-        if include_frames and self.data.frames_path:
-            for item in item_list:
-                frames_text = self.data.process_frames(item)
-                for i, frame in enumerate(frames_text, start=1):
-                    items_info[item] += f"Frame_{i}: {frame}\n"
+            # Filter valid items
+            filtered_items = {
+                user_id: self.data.filter_items(item_list)
+                for user_id, item_list in user_items.items()
+            }
 
-        if include_comments and self.data.comments is not None:
-            for item in item_list:
-                comments = self.data.extract_comments(user_id, item)
-                for i, comment in enumerate(comments, start=1):
-                    items_info[item] += f"Comment_{i}: {comment}\n"
-
-        # Calculate embeddings for items
-        item_embeddings = {}
-        for item in item_list:
-            embedding = self.openai_client.Embedding.create(
-                input=[items_info[item]], model=model_name
-            )["data"][0]["embedding"]
-            item_embeddings[item] = embedding
-
-        # Calculate cosine similarity between average embedding and items
-        scores = {
-            item: np.dot(agg_previous_item_embedding, item_embeddings[item])
-            / (
-                np.linalg.norm(agg_previous_item_embedding)
-                * np.linalg.norm(item_embeddings[item])
-            )
-            for item in item_list
+            missing_items = []
+            if store is not None:
+                candidate_items = [
+                    item for item_list in filtered_items.values() for item in item_list
+                ]
+                missing_items = store.missing(candidate_items)
+                self.metrics.count("embedding_store.misses", len(missing_items))
+                self.metrics.count(
+                    "embedding_store.hits", len(candidate_items) - len(missing_items)
+                )
+
+        if store is None:
+            for user_id, item_list in filtered_items.items():
+                items_info = self._build_items_info(
+                    user_id,
+                    item_list,
+                    include_title=include_title,
+                    include_cover=include_cover,
+                    include_frames=include_frames,
+                    include_comments=include_comments,
+                )
+                batcher.add(("items", user_id), [items_info[i] for i in item_list])
+        else:
+            items_info = self._build_items_info(
+                None,
+                missing_items,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+            )
+            batcher.add("store", [items_info[item] for item in missing_items])
+
+        try:
+            embeddings = batcher.flush()
+        except Batch_Error as error:
+            print(f"{error} Keeping the original order of {len(user_items)} users.")
+            self.metrics.count("fallback.failed_embeddings", len(user_items))
+            return {
+                user_id: self._fallback(item_list, with_scores)
+                for user_id, item_list in filtered_items.items()
+            }
+
+        # Users with a text the batch job did not embed (NaN rows) keep their
+        # original order, as users with an unparseable chat response do.
+        failed = set()
+        profile_ok = np.isfinite(embeddings["profiles"]).all(axis=1)
+        profile_offsets = np.cumsum([0] + profile_counts)
+        for row, user_id in enumerate(stale):
+            start, end = profile_offsets[row], profile_offsets[row + 1]
+            if not profile_ok[start:end].all():
+                failed.add(user_id)
+        if store is not None:
+            if missing_items:
+                item_ok = np.isfinite(embeddings["store"]).all(axis=1)
+                store.add(
+                    [item for item, ok in zip(missing_items, item_ok) if ok],
+                    embeddings["store"][item_ok],
+                )
+                unembedded = {
+                    item for item, ok in zip(missing_items, item_ok) if not ok
+                }
+                failed.update(
+                    user_id
+                    for user_id, item_list in filtered_items.items()
+                    if unembedded.intersection(item_list)
+                )
+        else:
+            failed.update(
+                user_id
+                for user_id in filtered_items
+                if not np.isfinite(embeddings[("items", user_id)]).all()
+            )
+        if failed:
+            print(
+                f"Embedding batch failed for {len(failed)} users; keeping their "
+                "original order."
+            )
+            self.metrics.count("fallback.failed_embeddings", len(failed))
+
+        reranked = {
+            user_id: self._fallback(filtered_items[user_id], with_scores)
+            for user_id in failed
         }
+        user_ids = [user_id for user_id in filtered_items if user_id not in failed]
+        if not user_ids:
+            return {user_id: reranked[user_id] for user_id in filtered_items}
 
-        # Rank items by similarity score
-        ranked_items = [
-            item for item, _ in sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        ]
-        return ranked_items
+        # Score the whole block as one users x K x d operation
+        items, mask = pad_candidates([filtered_items[user_id] for user_id in user_ids])
+        kept_rows = np.repeat(
+            [user_id not in failed for user_id in stale], profile_counts
+        ).astype(bool)
+        user_embeddings = self._user_profiles(
+            user_ids,
+            model_name,
+            histories,
+            [user_id for user_id in stale if user_id not in failed],
+            embeddings["profiles"][kept_rows],
+            [
+                count
+                for user_id, count in zip(stale, profile_counts)
+                if user_id not in failed
+            ],
+        )
+        candidate_embeddings = np.zeros(
+            mask.shape + (user_embeddings.shape[1],), dtype=np.float32
+        )
+        if mask.any():
+            # Row-major order of the mask matches the flattened candidate lists
+            if store is not None:
+                candidate_embeddings[mask] = store.get(items[mask].tolist())
+            else:
+                candidate_embeddings[mask] = np.concatenate(
+                    [embeddings[("items", user_id)] for user_id in user_ids]
+                )
+
+        # Rank items by cosine similarity to the user history embedding
+        with self.metrics.timer("scoring"):
+            ranked = rank_candidates(
+                items, mask, user_embeddings, candidate_embeddings, with_scores
+            )
+        reranked.update(zip(user_ids, ranked))
+        return {user_id: reranked[user_id] for user_id in filtered_items}
@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(iterable)
+    while True:
+        block = list(islice(iterator, size))
+        if not block:
+            return
+        yield block
+
+
+async def _run_async(
+    fn: Callable[[T], R],
+    tasks: Iterable[T],
+    concurrency: int,
+    on_result: Optional[Callable[[T, R], None]],
+) -> List[R]:
+    loop = asyncio.get_running_loop()
+    task_iter = enumerate(tasks)
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def worker():
+            # Each worker pulls the next task, so at most `concurrency`
+            # requests are in flight and tasks can be produced lazily.
+            for index, task in task_iter:
+                result = await loop.run_in_executor(executor, fn, task)
+                results[index] = result
+                if on_result is not None:
+                    on_result(task, result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return [results[index] for index in range(len(results))]
+
+
+def run_concurrently(
+    fn: Callable[[T], R],
+    tasks: Iterable[T],
+    concurrency: int = 1,
+    on_result: Optional[Callable[[T, R], None]] = None,
+) -> List[R]:
+    """Apply fn to every task with at most `concurrency` calls in flight.
+
+    Results come back in task order regardless of completion order.
+    on_result is called from a single thread as each task completes.
+    """
+    if concurrency <= 1:
+        results = []
+        for task in tasks:
+            result = fn(task)
+            results.append(result)
+            if on_result is not None:
+                on_result(task, result)
+        return results
+    return asyncio.run(_run_async(fn, tasks, concurrency, on_result))
@@ -0,0 +1,87 @@
+import numpy as np
+from typing import Callable, Dict, Hashable, List, Tuple
+
+# OpenAI embedding endpoint limits.
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+MAX_TOKENS_PER_INPUT = 8191
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text.
+    return len(text) // 4 + 1
+
+
+class Embedding_Batcher:
+    """Packs texts from many owners into as few embedding requests as the
+    provider limits allow and hands each owner back its rows in order.
+
+    With `embed_requests`, all requests of a flush are handed over at once
+    (e.g. to run them as one batch job) instead of one by one.
+    """
+
+    def __init__(
+        self,
+        embed_texts: Callable[[List[str]], np.ndarray],
+        max_inputs: int = MAX_INPUTS_PER_REQUEST,
+        max_tokens: int = MAX_TOKENS_PER_REQUEST,
+        max_tokens_per_input: int = MAX_TOKENS_PER_INPUT,
+        embed_requests: Callable[[List[List[str]]], List[np.ndarray]] = None,
+    ):
+        self.embed_texts = embed_texts
+        self.embed_requests = embed_requests
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.max_tokens_per_input = max_tokens_per_input
+        self.requests_sent = 0
+        self._pending: List[Tuple[Hashable, List[str]]] = []
+        self._owners = set()
+
+    def add(self, owner: Hashable, texts: List[str]) -> None:
+        if owner in self._owners:
+            raise ValueError(f"Owner {owner} already has pending texts.")
+        self._owners.add(owner)
+        self._pending.append((owner, list(texts)))
+
+    def _truncate(self, text: str) -> str:
+        if estimate_tokens(text) <= self.max_tokens_per_input:
+            return text
+        return text[: (self.max_tokens_per_input - 1) * 4]
+
+    def _pack(self, texts: List[str]) -> List[Tuple[int, int]]:
+        # Contiguous [start, end) slices of texts, one per request.
+        batches = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            n_tokens = estimate_tokens(text)
+            if i > start and (
+                i - start >= self.max_inputs or tokens + n_tokens > self.max_tokens
+            ):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += n_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def flush(self) -> Dict[Hashable, np.ndarray]:
+        pending, self._pending = self._pending, []
+        self._owners = set()
+        texts = [
+            self._truncate(text) for _, owner_texts in pending for text in owner_texts
+        ]
+
+        requests = [texts[start:end] for start, end in self._pack(texts)]
+        if self.embed_requests is not None and requests:
+            embeddings = [np.asarray(rows) for rows in self.embed_requests(requests)]
+        else:
+            embeddings = [np.asarray(self.embed_texts(request)) for request in requests]
+        self.requests_sent += len(requests)
+        matrix = np.concatenate(embeddings) if embeddings else np.empty((0, 0))
+
+        results = {}
+        offset = 0
+        for owner, owner_texts in pending:
+            results[owner] = matrix[offset : offset + len(owner_texts)]
+            offset += len(owner_texts)
+        return results
@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+import numpy as np
+from typing import Callable, List
+
+
+class Embedding_Store:
+    """Persistent item embedding matrix, memory-mapped from disk.
+
+    The matrix file has spare rows that new embeddings are written into in
+    place; when it is full, it is copied once into a file of twice the
+    capacity. The ids file is replaced atomically after each append and
+    says how many rows are valid, so rows are only ever appended and any
+    process holding an older mapping still sees valid rows. Build the store
+    from a single process and let reranking workers share the read-only
+    mapping.
+    """
+
+    MIN_CAPACITY = 1024
+
+    def __init__(
+        self,
+        directory: str,
+        model_name: str,
+        include_title: bool = True,
+        include_cover: bool = False,
+        include_frames: bool = False,
+        dtype: str = "float32",
+    ):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding dtype {dtype}.")
+
+        os.makedirs(directory, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        key = "{}-t{:d}c{:d}f{:d}-{}".format(
+            re.sub(r"[^A-Za-z0-9_.-]", "_", model_name),
+            include_title,
+            include_cover,
+            include_frames,
+            dtype,
+        )
+        self.matrix_path = os.path.join(directory, f"{key}.npy")
+        self.ids_path = os.path.join(directory, f"{key}.ids.npy")
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        self._matrix = None
+        self._ids = np.empty(0, dtype=np.int64)
+        if os.path.exists(self.matrix_path) and os.path.exists(self.ids_path):
+            self._matrix = np.load(self.matrix_path, mmap_mode="r")
+            ids = np.load(self.ids_path)
+            self._ids = ids[: min(len(ids), len(self._matrix))]
+        self._rows = {int(item): row for row, item in enumerate(self._ids)}
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._matrix is None else len(self._matrix)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._rows
+
+    def missing(self, item_list: List[int]) -> List[int]:
+        return [item for item in dict.fromkeys(item_list) if item not in self._rows]
+
+    def get(self, item_list: List[int]) -> np.ndarray:
+        if not item_list:
+            return np.empty((0, 0), dtype=np.float32)
+        missing = self.missing(item_list)
+        if missing:
+            raise KeyError(f"No stored embedding for items {missing}.")
+        rows = [self._rows[item] for item in item_list]
+        return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def add(self, item_list: List[int], embeddings: np.ndarray) -> None:
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        if len(item_list) != len(embeddings):
+            raise ValueError("Number of items and embeddings do not match.")
+
+        with self._lock:
+            # Another thread may have stored some of these items meanwhile.
+            new_rows = [i for i, item in enumerate(item_list) if item not in self._rows]
+            if new_rows:
+                self._append([item_list[i] for i in new_rows], embeddings[new_rows])
+
+    def _append(self, item_list: List[int], embeddings: np.ndarray) -> None:
+        n_old = len(self._ids)
+        dim = embeddings.shape[1]
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            raise ValueError(
+                f"Embedding dimension {dim} does not match store "
+                f"dimension {self._matrix.shape[1]}."
+            )
+
+        n_new = n_old + len(item_list)
+        if n_new > self.capacity:
+            # Copy the valid rows into a file with room to spare and swap it
+            # in; readers of the old file keep their mapping. Doubling keeps
+            # the total copying linear in the number of rows.
+            capacity = max(n_new, 2 * self.capacity, self.MIN_CAPACITY)
+            tmp_matrix_path = self.matrix_path + ".tmp.npy"
+            matrix = np.lib.format.open_memmap(
+                tmp_matrix_path, mode="w+", dtype=self.dtype, shape=(capacity, dim)
+            )
+            if n_old:
+                matrix[:n_old] = self._matrix[:n_old]
+            matrix.flush()
+            del matrix
+            os.replace(tmp_matrix_path, self.matrix_path)
+            self._matrix = np.load(self.matrix_path, mmap_mode="r")
+
+        # Rows past the published count are invisible to readers until the
+        # ids file below is replaced.
+        matrix = np.load(self.matrix_path, mmap_mode="r+")
+        matrix[n_old:n_new] = embeddings
+        matrix.flush()
+        del matrix
+
+        ids = np.concatenate([self._ids, np.asarray(item_list, dtype=np.int64)])
+        tmp_ids_path = self.ids_path + ".tmp.npy"
+        np.save(tmp_ids_path, ids)
+        os.replace(tmp_ids_path, self.ids_path)
+        self._ids = ids
+        self._rows.update((int(item), n_old + i) for i, item in enumerate(item_list))
+
+    def get_or_build(
+        self,
+        item_list: List[int],
+        embed_items: Callable[[List[int]], np.ndarray],
+    ) -> np.ndarray:
+        missing = self.missing(item_list)
+        if missing:
+            self.add(missing, embed_items(missing))
+        return self.get(item_list)
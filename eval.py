@@ -1,5 +1,7 @@
-from typing import List, Dict
+import numpy as np
+from typing import List, Dict, Union
 from data import Data
+from recommendations import Recommendation_Lists, iter_recommendations
 
 
 class Evaluation:
@@ -8,30 +10,54 @@ class Evaluation:
 
     def parse_recommendations(self, file_path: str) -> Dict[int, List[int]]:
         try:
-            with open(file_path, "r") as file:
-                content = file.read()
-
-            pattern = re.compile(r"User (\d+): Top 20 recommended items: \[([^\]]+)\]")
-            data = pattern.findall(content)
-
-            recommendation_dict = {
-                int(user): list(map(int, items.split(", "))) for user, items in data
-            }
-            return recommendation_dict
+            return dict(iter_recommendations(file_path))
         except FileNotFoundError:
             print("File not found. Please provide a valid file path.")
         except Exception as e:
             print(f"An error occurred: {e}")
             return {}
 
+    def load_recommendations(self, path: str) -> Recommendation_Lists:
+        return Recommendation_Lists.load(path)
+
+    def true_item_ranks(
+        self, recommendations: Union[Dict[int, List[int]], Recommendation_Lists]
+    ) -> np.ndarray:
+        if not isinstance(recommendations, Recommendation_Lists):
+            recommendations = Recommendation_Lists.from_dict(recommendations)
+        return self.data.true_item_ranks(recommendations.users, recommendations.items)
+
+    def evaluate(
+        self,
+        recommendations: Union[Dict[int, List[int]], Recommendation_Lists],
+        N_list: List[int],
+    ) -> Dict[int, Dict[str, float]]:
+        # Every metric at every N derives from one rank vector.
+        ranks = self.true_item_ranks(recommendations)
+        if len(ranks) == 0:
+            return {N: {"hit_rate": 0.0, "ndcg": 0.0, "mrr": 0.0} for N in N_list}
+
+        found = ranks >= 0
+        safe_ranks = np.maximum(ranks, 0)
+        dcg = np.where(found, 1.0 / np.log2(safe_ranks + 2), 0.0)
+        reciprocal_ranks = np.where(found, 1.0 / (safe_ranks + 1), 0.0)
+
+        metrics = {}
+        for N in N_list:
+            hit = found & (ranks < N)
+            metrics[N] = {
+                "hit_rate": float(hit.mean()),
+                "ndcg": float(np.where(hit, dcg, 0.0).mean()),
+                "mrr": float(np.where(hit, reciprocal_ranks, 0.0).mean()),
+            }
+        return metrics
+
     def evaluate_hit_rate(
-        self, user_recommendations: Dict[int, List[int]], N: int
+        self,
+        user_recommendations: Union[Dict[int, List[int]], Recommendation_Lists],
+        N: int,
     ) -> float:
-        user_ids = list(user_recommendations.keys())
-        recommendations = list(user_recommendations.values())
-
-        hit_rate = self.data.hit_rate(user_ids, recommendations[:N])
-        return hit_rate
+        return self.evaluate(user_recommendations, [N])[N]["hit_rate"]
 
     def get_improvement(
         self,
@@ -39,20 +65,15 @@ class Evaluation:
         new_dict: Dict[int, List[int]],
         N_list: List[int],
     ) -> Dict[int, float]:
-        baseline_hit_rates = {}
-
-        new_hit_rates = {}
-
         # Calculate hit rates for each N
-        for N in N_list:
-            baseline_hit_rates[N] = self.calculate_hit_rate(baseline_dict, N)
-            new_hit_rates[N] = self.calculate_hit_rate(new_dict, N)
+        baseline_metrics = self.evaluate(baseline_dict, N_list)
+        new_metrics = self.evaluate(new_dict, N_list)
 
         # Calculate improvement
         improvement = {}
         for N in N_list:
-            baseline_hr = baseline_hit_rates.get(N, 0)
-            new_hr = new_hit_rates.get(N, 0)
+            baseline_hr = baseline_metrics[N]["hit_rate"]
+            new_hr = new_metrics[N]["hit_rate"]
 
             if baseline_hr == 0:
                 improvement[N] = float("inf")  # Avoid division by zero
@@ -1,7 +1,15 @@
-import re
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+from batch_jobs import CHAT_COMPLETIONS, Batch_Runner
 from data import Data
 from huggingface_hub import InferenceClient
+from metrics import Metrics
+from prompt_builder import Prompt_Builder
+from response_cache import Response_Cache
+from stream_parser import Incremental_ID_Parser, max_tokens_for
+from transport import Transport
+from windowing import windowed_rerank
 import openai
 
 
@@ -13,12 +21,131 @@ class Generative_Model:
         data: Data,
         hf_api_token: str = None,
         openai_api_key: str = None,
+        transport: Transport = None,
+        response_cache: Response_Cache = None,
+        max_prompt_tokens: int = None,
+        tokenizer_name: str = None,
+        hf_chat_base_url: str = None,
+        openai_base_url: str = None,
+        metrics: Metrics = None,
+        window_size: int = None,
+        window_stride: int = None,
+        window_concurrency: int = 4,
+        batch_runner: Batch_Runner = None,
     ):
         self.name = name
         self.source = source
         self.data = data
-        self.hf_client = InferenceClient(api_key=hf_api_token) if hf_api_token else None
-        self.openai_client = openai if openai_api_key else None
+        self.transport = transport or Transport()
+        # The transport is the only retry and rate-control layer, so the
+        # clients do not retry on their own.
+        self.hf_client = (
+            InferenceClient(
+                base_url=hf_chat_base_url,
+                api_key=hf_api_token,
+                timeout=self.transport.timeout,
+            )
+            if hf_api_token
+            else None
+        )
+        self.openai_client = (
+            openai.OpenAI(
+                api_key=openai_api_key,
+                base_url=openai_base_url,
+                max_retries=0,
+                timeout=self.transport.timeout,
+            )
+            if openai_api_key
+            else None
+        )
+        self.response_cache = response_cache
+        self.metrics = metrics or data.metrics
+        self.prompt_builder = Prompt_Builder(
+            data, max_prompt_tokens, tokenizer_name, self.metrics
+        )
+        self.window_size = window_size
+        self.window_stride = window_stride or (
+            max(1, window_size // 2) if window_size else None
+        )
+        if window_size and not 1 <= self.window_stride <= window_size:
+            raise ValueError(
+                f"Window stride {self.window_stride} is not between 1 and "
+                f"{window_size}."
+            )
+        self.window_concurrency = window_concurrency
+        self._window_executor = None
+        self._window_executor_lock = threading.Lock()
+        self.batch_runner = batch_runner
+
+    def _windowed(
+        self, reranker: Callable, user_id: int, item_list: List[int], **kwargs
+    ) -> List[int]:
+        # Long lists are reranked window by window; each window call goes
+        # back through `reranker` with a list that fits in one window.
+        with self._window_executor_lock:
+            if self._window_executor is None:
+                self._window_executor = ThreadPoolExecutor(self.window_concurrency)
+
+        def rerank_window(window: List[int]) -> List[int]:
+            self.metrics.count("windows.calls")
+            return reranker(user_id, window, **kwargs)
+
+        return windowed_rerank(
+            self.data.filter_items(item_list),
+            rerank_window,
+            self.window_size,
+            self.window_stride,
+            self._window_executor,
+        )
+
+    def close(self) -> None:
+        if self._window_executor is not None:
+            self._window_executor.shutdown()
+
+    def _cached_ranking(
+        self,
+        model_name: str,
+        prompt: str,
+        params: Dict,
+        complete: Callable[[], str],
+        item_list: List[int],
+        label: str,
+    ) -> List[int]:
+        response = None
+        if self.response_cache is not None:
+            response = self.response_cache.get(model_name, prompt, params)
+            self.metrics.count(
+                "response_cache.misses" if response is None else "response_cache.hits"
+            )
+        if response is not None:
+            return self._or_fallback(
+                self._parse_ids(response, item_list), item_list, label
+            )
+
+        response = complete()
+        ranking = self._parse_ids(response, item_list)
+        # A response without a ranking is a failure; caching it would replay
+        # the fallback order on every later run.
+        if ranking and self.response_cache is not None:
+            self.response_cache.put(model_name, prompt, response, params)
+        return self._or_fallback(ranking, item_list, label)
+
+    def _parse_ids(self, text: str, item_list: List[int]) -> List[int]:
+        # The ranking in a response, or [] when it names no candidate.
+        with self.metrics.timer("parse"):
+            parser = Incremental_ID_Parser(item_list)
+            parser.feed(text)
+            parser.close()
+        return parser.ranked_items() if parser.ids else []
+
+    def _or_fallback(
+        self, ranking: List[int], item_list: List[int], label: str
+    ) -> List[int]:
+        if ranking:
+            return ranking
+        self.metrics.count("fallback.invalid_response")
+        print(f"{label} failed to produce a valid response.")
+        return item_list
 
     def reranker_llama_stream(
         self,
@@ -30,67 +157,74 @@ class Generative_Model:
         include_frames=False,
         include_comments=False,
     ) -> List[int]:
-        prompt = "You are an expert in recommending items to users.\n"
-        previous_item_list = self.data.get_N_latest_items(user_id, 10)
-
-        # Build prompt
-        for item in previous_item_list:
-            item_title = self.data.extract_title(item)
-            prompt += f"User has previously interacted with this item with title: {item_title}.\n"
-
-        prompt += f"These are the item_ids that you need to rerank: {item_list}.\n"
-        prompt += "Below is the information of these items.\n"
-
-        item_list = self.data.filter_items(item_list)
-
-        if include_title:
-            for item in item_list:
-                title = self.data.extract_title(item)
-                prompt += f"Item_Id: {item}. Title: {title}\n"
-
-        if include_cover and self.data.covers_path:
-            for item in item_list:
-                cover = self.data.process_cover(item)
-                prompt += f"Item_Id: {item}. Cover: {cover}\n"
-
-        if include_frames and self.data.frames_path:
-            for item in item_list:
-                frames = self.data.process_frames(item)
-                for i, frame in enumerate(frames, start=1):
-                    prompt += f"Item_Id: {item}. Frame_{i}: {frame}\n"
-
-        if include_comments and self.data.comments is not None:
-            for item in item_list:
-                comments = self.data.extract_comments(user_id, item)
-                for i, comment in enumerate(comments, start=1):
-                    prompt += f"Item_Id: {item}. Comment_{i}: {comment}\n"
-
-        prompt += (
-            "\nPlease rerank these items for the user based on their relevance.\n"
-            "Make sure to include ALL given item IDs in your response, without omitting any.\n"
-            "Output ONLY the reranked list of item IDs, separated by commas, in the exact order of ranking.\n"
-            "Example output: 123, 456, 789\n"
-        )
+        if self.window_size and len(item_list) > self.window_size:
+            return self._windowed(
+                self.reranker_llama_stream,
+                user_id,
+                item_list,
+                model_name=model_name,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                include_comments=include_comments,
+            )
 
-        # Stream response from Hugging Face Llama model
-        stream = self.hf_client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=5000,
-            stream=True,
-        )
+        with self.metrics.timer("prompt.build"):
+            prompt, item_list = self.prompt_builder.build(
+                user_id,
+                item_list,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                include_comments=include_comments,
+            )
+
+        # Stream response from Hugging Face Llama model, stopping as soon as
+        # every candidate ID has been emitted.
+        max_tokens = max_tokens_for(len(item_list))
 
-        result_string = ""
-        for chunk in stream:
-            result_string += chunk.choices[0].delta.content
+        def complete() -> str:
+            self.metrics.count("model.requests")
+            with self.metrics.timer("model.call"):
+                stream = self.transport.call(
+                    self.hf_client.chat.completions.create,
+                    model=model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
 
-        match = re.search(r"(?:\d+\s*,\s*)+\d+\b", result_string)
-        if match:
-            reranked_items = list(map(int, match.group().split(",")))
-            return reranked_items
-        else:
-            print("Llama stream failed to produce a valid response.")
-            return item_list
+                parser = Incremental_ID_Parser(item_list)
+                chunks = 0
+                try:
+                    for chunk in stream:
+                        chunks += 1
+                        if parser.feed(chunk.choices[0].delta.content):
+                            self.metrics.count("model.early_stops")
+                            break
+                finally:
+                    if hasattr(stream, "close"):
+                        stream.close()
+            # Streamed chat completions carry one token per chunk.
+            self.metrics.count("model.completion_tokens", chunks)
+            return parser.text
+
+        return self._cached_ranking(
+            model_name,
+            prompt,
+            {"max_tokens": max_tokens},
+            complete,
+            item_list,
+            "Llama stream",
+        )
+
+    def _gpt_prompt(
+        self, user_id: int, item_list: List[int], **include
+    ) -> Tuple[str, List[int]]:
+        with self.metrics.timer("prompt.build"):
+            return self.prompt_builder.build(
+                user_id, item_list, user_label=f"User {user_id}", **include
+            )
 
     def reranker_gpt(
         self,
@@ -104,58 +238,99 @@ class Generative_Model:
     ) -> List[int]:
         if not self.openai_client:
             raise ValueError("OpenAI API client is not configured.")
+        if self.window_size and len(item_list) > self.window_size:
+            return self._windowed(
+                self.reranker_gpt,
+                user_id,
+                item_list,
+                model_name=model_name,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                include_comments=include_comments,
+            )
 
-        prompt = "You are an expert in recommending items to users.\n"
-        previous_item_list = self.data.get_N_latest_items(user_id, 10)
-
-        # Build prompt
-        for item in previous_item_list:
-            item_title = self.data.extract_title(item)
-            prompt += f"User {user_id} has previously interacted with this item with title: {item_title}.\n"
-
-        prompt += f"These are the item_ids that you need to rerank: {item_list}.\n"
-        prompt += "Below is the information of these items.\n"
-
-        item_list = self.data.filter_items(item_list)
-
-        if include_title:
-            for item in item_list:
-                title = self.data.extract_title(item)
-                prompt += f"Item_Id: {item}. Title: {title}\n"
-
-        if include_cover and self.data.covers_path:
-            for item in item_list:
-                cover = self.data.process_cover(item)
-                prompt += f"Item_Id: {item}. Cover: {cover}\n"
-
-        if include_frames and self.data.frames_path:
-            for item in item_list:
-                frames = self.data.process_frames(item)
-                for i, frame in enumerate(frames, start=1):
-                    prompt += f"Item_Id: {item}. Frame_{i}: {frame}\n"
-
-        if include_comments and self.data.comments is not None:
-            for item in item_list:
-                comments = self.data.extract_comments(user_id, item)
-                for i, comment in enumerate(comments, start=1):
-                    prompt += f"Item_Id: {item}. Comment_{i}: {comment}\n"
-
-        prompt += (
-            "\nPlease rerank these items for the user based on their relevance.\n"
-            "Make sure to include ALL given item IDs in your response, without omitting any.\n"
-            "Output ONLY the reranked list of item IDs, separated by commas, in the exact order of ranking.\n"
-            "Example output: 123, 456, 789\n"
+        prompt, item_list = self._gpt_prompt(
+            user_id,
+            item_list,
+            include_title=include_title,
+            include_cover=include_cover,
+            include_frames=include_frames,
+            include_comments=include_comments,
         )
 
-        response = self.openai_client.ChatCompletion.create(
-            messages=[{"role": "user", "content": prompt}],
-            model=model_name,
-        )
+        def complete() -> str:
+            self.metrics.count("model.requests")
+            with self.metrics.timer("model.call"):
+                response = self.transport.call(
+                    self.openai_client.chat.completions.create,
+                    messages=[{"role": "user", "content": prompt}],
+                    model=model_name,
+                )
+            if getattr(response, "usage", None) is not None:
+                self.metrics.count(
+                    "model.completion_tokens", response.usage.completion_tokens
+                )
+            return response.choices[0].message.content
+
+        return self._cached_ranking(model_name, prompt, {}, complete, item_list, "GPT")
+
+    def rerank_gpt_batch(
+        self,
+        user_items: Dict[int, List[int]],
+        model_name: str,
+        include_title=True,
+        include_cover=False,
+        include_frames=False,
+        include_comments=False,
+    ) -> Dict[int, List[int]]:
+        # Every user's chat request goes into one batch job instead of an
+        # interactive call; cached responses are not sent again.
+        if not self.openai_client:
+            raise ValueError("OpenAI API client is not configured.")
+        if self.batch_runner is None:
+            raise ValueError("Batch mode is not configured.")
+
+        prompts, requests, responses = {}, {}, {}
+        for user_id, item_list in user_items.items():
+            prompt, item_list = self._gpt_prompt(
+                user_id,
+                item_list,
+                include_title=include_title,
+                include_cover=include_cover,
+                include_frames=include_frames,
+                include_comments=include_comments,
+            )
+            prompts[user_id] = (prompt, item_list)
+            cached = None
+            if self.response_cache is not None:
+                cached = self.response_cache.get(model_name, prompt, {})
+                self.metrics.count(
+                    "response_cache.misses" if cached is None else "response_cache.hits"
+                )
+            if cached is None:
+                requests[f"user-{user_id}"] = {
+                    "model": model_name,
+                    "messages": [{"role": "user", "content": prompt}],
+                }
+            else:
+                responses[user_id] = cached
 
-        result_content = response.choices[0].message["content"]
-        try:
-            ranked_items = list(map(int, result_content.split(",")))
-            return ranked_items
-        except ValueError:
-            print("GPT failed to produce a valid response.")
-            return item_list
+        self.metrics.count("model.requests", len(requests))
+        bodies = self.batch_runner.run(CHAT_COMPLETIONS, requests)
+        rankings = {}
+        for user_id, (prompt, item_list) in prompts.items():
+            body = bodies.get(f"user-{user_id}")
+            if body is not None:
+                responses[user_id] = body["choices"][0]["message"]["content"] or ""
+                if body.get("usage"):
+                    self.metrics.count(
+                        "model.completion_tokens", body["usage"]["completion_tokens"]
+                    )
+            ranking = self._parse_ids(responses.get(user_id, ""), item_list)
+            # Only fresh responses that hold a ranking are worth caching.
+            if body is not None and ranking and self.response_cache is not None:
+                self.response_cache.put(model_name, prompt, responses[user_id], {})
+            # Users whose request failed keep their original order.
+            rankings[user_id] = self._or_fallback(ranking, item_list, "GPT batch")
+        return rankings
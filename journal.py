@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+
+class Results_Journal:
+    """Append-only JSONL log of reranked lists, one line per user.
+
+    Lines are flushed as they are written; fsync is batched every
+    `fsync_every` records or `fsync_interval` seconds, whichever comes
+    first, so durability does not cost one disk sync per user.
+    """
+
+    def __init__(
+        self, path: str, fsync_every: int = 100, fsync_interval: float = 5.0
+    ):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Terminate a torn final line so the next record starts cleanly.
+        torn = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                torn = file.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if torn:
+            self._file.write("\n")
+
+    @staticmethod
+    def load(path: str) -> Dict[int, List[int]]:
+        completed = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a torn final line; that user is redone.
+                    continue
+                completed[int(record["user"])] = [
+                    int(item) for item in record["items"]
+                ]
+        return completed
+
+    def append(self, user_id: int, items: List[int]) -> None:
+        line = json.dumps({"user": int(user_id), "items": [int(i) for i in items]})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            self._sync()
+            self._file.close()
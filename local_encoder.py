@@ -0,0 +1,78 @@
+import numpy as np
+from typing import List
+
+
+class Local_Sentence_Encoder:
+    """Runs a sentence-transformers model in-process on CPU.
+
+    Texts are deduplicated, sorted by token length and encoded in padded
+    batches, so each batch pads to a similar length. Embeddings are mean
+    pooled over the attention mask and L2-normalised, matching the
+    sentence-similarity scores the HF inference API returns.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 64,
+        max_length: int = 256,
+        quantize: bool = False,
+        num_threads: int = None,
+    ):
+        # torch is only needed for the local backend.
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.torch = torch
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        with self.torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = self.torch.nn.functional.normalize(pooled, p=2, dim=1)
+        return pooled.numpy().astype(np.float32)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        unique_texts = list(dict.fromkeys(texts))
+        if not unique_texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Length bucketing: neighbours in token length share a batch.
+        lengths = [
+            len(ids)
+            for ids in self.tokenizer(
+                unique_texts, truncation=True, max_length=self.max_length
+            )["input_ids"]
+        ]
+        order = np.argsort(lengths, kind="stable")
+
+        embeddings = None
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start : start + self.batch_size]
+            batch = self._encode_batch([unique_texts[row] for row in rows])
+            if embeddings is None:
+                embeddings = np.empty((len(unique_texts), batch.shape[1]), np.float32)
+            embeddings[rows] = batch
+
+        index = {text: row for row, text in enumerate(unique_texts)}
+        return embeddings[[index[text] for text in texts]]
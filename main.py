@@ -1,21 +1,60 @@
 import argparse
-from data import Data
+import os
+from typing import Callable, Dict, Iterable, List, Tuple
+from batch_jobs import (
+    Batch_Runner,
+    Local_Batch_Backend,
+    OpenAI_Batch_Backend,
+    openai_responder,
+)
+from cascade import Cascade_Policy, run_cascade, tradeoff_curve
+from data import HF_INFERENCE_API_URL, Data
 from generative import Generative_Model
 from discriminative import Discriminative_Model
 from eval import Evaluation
+from driver import batched, run_concurrently
+from journal import Results_Journal
+from metrics import Metrics
+from recommendations import read_recommendations, write_recommendations
+from response_cache import Response_Cache
+from transport import Transport
+import openai
 
 
-def main():
-    # Parse command-line arguments
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Recommendation Model CLI")
     parser.add_argument(
-        "--inference_path", required=True, help="Path to inference file"
+        "--inference_path",
+        required=True,
+        help="Path to inference file (text, binary .npz or binary directory)",
+    )
+    parser.add_argument(
+        "--output_path",
+        help="Where to write reranked lists (text, binary .npz or directory; "
+        "a new directory needs a trailing /)",
     )
-    parser.add_argument("--pairs_path", required=True, help="Path to pairs CSV file")
-    parser.add_argument("--titles_path", required=True, help="Path to titles CSV file")
+    parser.add_argument("--pairs_path", help="Path to pairs CSV file")
+    parser.add_argument("--titles_path", help="Path to titles CSV file")
     parser.add_argument("--comments_path", help="Path to comments TXT file")
+    parser.add_argument(
+        "--snapshot_path",
+        help="Columnar snapshot from snapshot.py, used instead of the CSV files",
+    )
     parser.add_argument("--covers_path", help="Path to covers directory")
     parser.add_argument("--frames_path", help="Path to frames directory")
+    parser.add_argument(
+        "--image_model_name",
+        default="Salesforce/blip-image-captioning-large",
+        help="HuggingFace image captioning model for covers and frames",
+    )
+    parser.add_argument(
+        "--captions_path",
+        help="Path to precomputed captions from caption.py (.npz)",
+    )
+    parser.add_argument(
+        "--caption_cache_path",
+        help="Path to a SQLite file caching image captions across runs",
+    )
     parser.add_argument(
         "--model_type",
         required=True,
@@ -31,6 +70,18 @@ def main():
     parser.add_argument("--model_name", required=True, help="Model name")
     parser.add_argument("--hf_api_key", help="HuggingFace API key")
     parser.add_argument("--openai_api_key", help="OpenAI API key")
+    parser.add_argument(
+        "--hf_api_url",
+        default=HF_INFERENCE_API_URL,
+        help="Base URL of the HuggingFace inference API (captioning, similarity)",
+    )
+    parser.add_argument(
+        "--hf_chat_base_url",
+        help="Base URL of an HF-compatible chat completion endpoint",
+    )
+    parser.add_argument(
+        "--openai_base_url", help="Base URL of an OpenAI-compatible API"
+    )
     parser.add_argument(
         "--include_title",
         action="store_true",
@@ -46,6 +97,225 @@ def main():
     parser.add_argument(
         "--include_comments", action="store_true", help="Include comments information"
     )
+    parser.add_argument(
+        "--embedding_store_dir",
+        help="Directory of persistent item embeddings for the embedding reranker",
+    )
+    parser.add_argument(
+        "--embedding_store_dtype",
+        choices=["float32", "float16"],
+        default="float32",
+        help="Storage precision of persisted item embeddings",
+    )
+    parser.add_argument(
+        "--profile_store_dir",
+        help="Directory of persistent user-profile embeddings, refreshed only "
+        "for users whose history changed",
+    )
+    parser.add_argument(
+        "--profile_pooling",
+        choices=["joined", "mean"],
+        default="joined",
+        help="Build profiles by encoding the joined history titles, or as the "
+        "mean of per-item embeddings",
+    )
+    parser.add_argument(
+        "--expand_candidates",
+        type=int,
+        default=0,
+        help="Add this many nearest catalog items per user profile to the "
+        "candidates before reranking",
+    )
+    parser.add_argument(
+        "--expansion_model_source",
+        choices=["huggingface", "openai"],
+        help="Embedding source for candidate expansion (default --model_source; "
+        "huggingface runs in-process)",
+    )
+    parser.add_argument(
+        "--expansion_model_name",
+        help="Embedding model for candidate expansion (default --model_name)",
+    )
+    parser.add_argument(
+        "--ann_index_dir",
+        help="Directory persisting the item ANN index used for expansion",
+    )
+    parser.add_argument(
+        "--ann_lists",
+        type=int,
+        help="Number of IVF lists in the ANN index (default sqrt of catalog size)",
+    )
+    parser.add_argument(
+        "--ann_nprobe",
+        type=int,
+        default=8,
+        help="IVF lists searched per user; higher is slower with better recall",
+    )
+    parser.add_argument(
+        "--embedding_batch_users",
+        type=int,
+        default=64,
+        help="Users per block for the batched discriminative rerankers",
+    )
+    parser.add_argument(
+        "--hf_backend",
+        choices=["remote", "local"],
+        default="remote",
+        help="Run HuggingFace sentence transformers remotely or in-process",
+    )
+    parser.add_argument(
+        "--local_batch_size",
+        type=int,
+        default=64,
+        help="Texts per padded batch for the local sentence-transformer backend",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Apply dynamic int8 quantization to the local backend",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Maximum number of rerank requests in flight",
+    )
+    parser.add_argument(
+        "--max_prompt_tokens",
+        type=int,
+        help="Token budget for generative prompts; lowest-value lines are cut first",
+    )
+    parser.add_argument(
+        "--tokenizer_name",
+        help="HuggingFace tokenizer used to count prompt tokens",
+    )
+    parser.add_argument(
+        "--window_size",
+        type=int,
+        help="Rerank longer generative candidate lists in windows of this size",
+    )
+    parser.add_argument(
+        "--window_stride",
+        type=int,
+        help="Items of each window eliminated per round; the remaining "
+        "window_size - stride advance (default half the window size)",
+    )
+    parser.add_argument(
+        "--window_concurrency",
+        type=int,
+        default=4,
+        help="Windows of one user reranked concurrently",
+    )
+    parser.add_argument(
+        "--response_cache_path",
+        help="Path to a SQLite file caching generative model responses",
+    )
+    parser.add_argument(
+        "--response_cache_size",
+        type=int,
+        default=100000,
+        help="Maximum number of cached generative responses",
+    )
+    parser.add_argument(
+        "--cascade_model_name",
+        help="Embedding model that reranks every user first; only users it is "
+        "unsure about are escalated to the generative model",
+    )
+    parser.add_argument(
+        "--cascade_model_source",
+        choices=["huggingface", "openai"],
+        default="huggingface",
+        help="Source of the cascade model (huggingface runs in-process)",
+    )
+    parser.add_argument(
+        "--cascade_fraction",
+        type=float,
+        default=0.2,
+        help="Maximum fraction of users escalated to the generative model",
+    )
+    parser.add_argument(
+        "--cascade_k",
+        type=int,
+        default=10,
+        help="Top-k compared with the baseline and used for score margins",
+    )
+    parser.add_argument(
+        "--cascade_min_agreement",
+        type=float,
+        default=0.5,
+        help="Escalate users whose top-k overlaps the baseline top-k less",
+    )
+    parser.add_argument(
+        "--cascade_min_margin",
+        type=float,
+        default=0.01,
+        help="Escalate users whose score gap at the top-k cut is smaller",
+    )
+    parser.add_argument(
+        "--batch_mode",
+        action="store_true",
+        help="Send the OpenAI chat or embedding requests of all users as "
+        "batch jobs and wait for them instead of calling the API per user",
+    )
+    parser.add_argument(
+        "--batch_backend",
+        choices=["openai", "local"],
+        default="openai",
+        help="Submit to the OpenAI Batch API, or run the batch files locally "
+        "against --openai_base_url",
+    )
+    parser.add_argument(
+        "--batch_dir",
+        default="batches",
+        help="Directory of batch input files and submitted job IDs",
+    )
+    parser.add_argument(
+        "--batch_users",
+        type=int,
+        default=5000,
+        help="Users per batch job; each job's results are journaled as it lands",
+    )
+    parser.add_argument(
+        "--batch_poll_interval",
+        type=float,
+        default=30.0,
+        help="Seconds between batch job status polls",
+    )
+    parser.add_argument(
+        "--journal_path",
+        help="Append-only JSONL journal of reranked lists, written per user",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip users already present in --journal_path",
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=10.0,
+        help="Initial rate limit shared by all remote calls",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=5,
+        help="Retries per remote call on 429/5xx or connection errors",
+    )
+    parser.add_argument(
+        "--request_timeout",
+        type=float,
+        default=60.0,
+        help="Timeout in seconds for each HTTP request",
+    )
+    parser.add_argument(
+        "--metrics_path",
+        help="Write a JSON summary of per-stage timings and counters here",
+    )
+    parser.add_argument(
+        "--prometheus_path",
+        help="Also write the metrics in Prometheus text format here",
+    )
     parser.add_argument(
         "--n_list",
         type=int,
@@ -54,87 +324,409 @@ def main():
         help="List of N values for hit rate",
     )
 
-    args = parser.parse_args()
+    return parser
 
-    # Load data
-    data = Data(
+
+def build_data(
+    args: argparse.Namespace, transport: Transport, metrics: Metrics = None
+) -> Data:
+    return Data(
         pairs_path=args.pairs_path,
         titles_path=args.titles_path,
         comments_path=args.comments_path,
         covers_path=args.covers_path,
         frames_path=args.frames_path,
+        hf_api_key=args.hf_api_key,
+        image_model_name=args.image_model_name,
+        caption_cache_path=args.caption_cache_path,
+        captions_path=args.captions_path,
+        transport=transport,
+        hf_api_url=args.hf_api_url,
+        metrics=metrics,
+        snapshot_path=args.snapshot_path,
+        include_comments=args.include_comments,
     )
 
-    model = None
+
+def build_batch_runner(
+    args: argparse.Namespace, transport: Transport, metrics: Metrics = None
+) -> Batch_Runner:
+    # Retries and timeouts belong to the transport alone.
+    client = openai.OpenAI(
+        api_key=args.openai_api_key,
+        base_url=args.openai_base_url,
+        max_retries=0,
+        timeout=transport.timeout,
+    )
+    if args.batch_backend == "local":
+        backend = Local_Batch_Backend(
+            os.path.join(args.batch_dir, "local"), openai_responder(client, transport)
+        )
+    else:
+        backend = OpenAI_Batch_Backend(client, transport)
+    return Batch_Runner(
+        backend, args.batch_dir, poll_interval=args.batch_poll_interval, metrics=metrics
+    )
+
+
+def build_model(
+    args: argparse.Namespace,
+    data: Data,
+    transport: Transport,
+    response_cache: Response_Cache = None,
+    metrics: Metrics = None,
+    batch_runner: Batch_Runner = None,
+):
     if args.model_type == "generative":
-        model = Generative_Model(
+        return Generative_Model(
             name=args.model_name,
             source=args.model_source,
             data=data,
             hf_api_token=args.hf_api_key,
             openai_api_key=args.openai_api_key,
+            transport=transport,
+            response_cache=response_cache,
+            max_prompt_tokens=args.max_prompt_tokens,
+            tokenizer_name=args.tokenizer_name,
+            hf_chat_base_url=args.hf_chat_base_url,
+            openai_base_url=args.openai_base_url,
+            metrics=metrics,
+            window_size=args.window_size,
+            window_stride=args.window_stride,
+            window_concurrency=args.window_concurrency,
+            batch_runner=batch_runner,
         )
-    elif args.model_type == "discriminative":
-        model = Discriminative_Model(
-            name=args.model_name,
-            source=args.model_source,
-            data=data,
-            hf_api_key=args.hf_api_key,
-            openai_api_key=args.openai_api_key,
+    return Discriminative_Model(
+        name=args.model_name,
+        source=args.model_source,
+        data=data,
+        hf_api_key=args.hf_api_key,
+        openai_api_key=args.openai_api_key,
+        embedding_store_dir=args.embedding_store_dir,
+        embedding_store_dtype=args.embedding_store_dtype,
+        transport=transport,
+        hf_backend=args.hf_backend,
+        local_batch_size=args.local_batch_size,
+        quantize=args.quantize,
+        hf_api_url=args.hf_api_url,
+        openai_base_url=args.openai_base_url,
+        metrics=metrics,
+        profile_store_dir=args.profile_store_dir,
+        profile_pooling=args.profile_pooling,
+        ann_index_dir=args.ann_index_dir,
+        ann_lists=args.ann_lists,
+        batch_runner=batch_runner,
+    )
+
+
+def build_embedding_model(
+    args: argparse.Namespace,
+    data: Data,
+    transport: Transport,
+    source: str,
+    model_name: str,
+    metrics: Metrics = None,
+) -> Discriminative_Model:
+    # A batch embedding model next to the reranker; HuggingFace models run
+    # in-process.
+    return Discriminative_Model(
+        name=model_name,
+        source=source,
+        data=data,
+        hf_api_key=args.hf_api_key,
+        openai_api_key=args.openai_api_key,
+        embedding_store_dir=args.embedding_store_dir,
+        embedding_store_dtype=args.embedding_store_dtype,
+        transport=transport,
+        hf_backend="local",
+        local_batch_size=args.local_batch_size,
+        quantize=args.quantize,
+        openai_base_url=args.openai_base_url,
+        metrics=metrics,
+        profile_store_dir=args.profile_store_dir,
+        profile_pooling=args.profile_pooling,
+        ann_index_dir=args.ann_index_dir,
+        ann_lists=args.ann_lists,
+    )
+
+
+def build_expander(
+    args: argparse.Namespace,
+    data: Data,
+    transport: Transport,
+    model,
+    metrics: Metrics = None,
+) -> Discriminative_Model:
+    # The embedding model behind candidate expansion: the reranker itself
+    # when it is an embedding model, otherwise a dedicated one.
+    source = args.expansion_model_source or args.model_source
+    model_name = args.expansion_model_name or args.model_name
+    if (
+        args.model_type == "discriminative"
+        and source == args.model_source
+        and model_name == args.model_name
+        and (source == "openai" or args.hf_backend == "local")
+    ):
+        return model
+    return build_embedding_model(args, data, transport, source, model_name, metrics)
+
+
+def make_expand(
+    args: argparse.Namespace, expander: Discriminative_Model = None
+) -> Callable[[Dict[int, List[int]]], Dict[int, List[int]]]:
+    # Merges ANN neighbors into a block's candidates when expanding.
+    def expand(user_items: Dict[int, List[int]]) -> Dict[int, List[int]]:
+        if expander is None:
+            return user_items
+        return expander.expand_candidates(
+            user_items,
+            args.expansion_model_name or args.model_name,
+            args.expand_candidates,
+            nprobe=args.ann_nprobe,
+            include_title=args.include_title,
+            include_cover=args.include_cover,
+            include_frames=args.include_frames,
         )
 
+    return expand
+
+
+def make_rerank_tasks(
+    args: argparse.Namespace,
+    model,
+    pairs: Iterable[Tuple[int, List[int]]],
+    expander: Discriminative_Model = None,
+) -> Tuple[Callable, Iterable]:
+    # The rerank callable for the selected reranker and the tasks it takes.
+    # Every task result is a {user_id: reranked_items} dict. With an
+    # expander, ANN neighbors are merged into the candidates first.
+    expand = make_expand(args, expander)
+
+    rerank_kwargs = dict(
+        model_name=args.model_name,
+        include_title=args.include_title,
+        include_cover=args.include_cover,
+        include_frames=args.include_frames,
+        include_comments=args.include_comments,
+    )
+
+    if args.batch_mode:
+        # Each block of users is one set of batch jobs; --concurrency blocks
+        # are in flight at once and each is journaled when it is ingested.
+        if args.model_type == "generative":
+            batch_reranker = model.rerank_gpt_batch
+        else:
+            batch_reranker = model.rerank_text_embedding_batch
+
+        def rerank(block):
+            return batch_reranker(expand(dict(block)), **rerank_kwargs)
+
+        return rerank, batched(pairs, args.batch_users)
+
+    if args.model_type == "discriminative" and (
+        args.model_source == "openai" or args.hf_backend == "local"
+    ):
+        # Embeddings are computed for a block of users at a time.
+        if args.model_source == "openai":
+            batch_reranker = model.rerank_text_embedding_batch
+        else:
+            batch_reranker = model.rerank_sentence_transformers_batch
+
+        def rerank(block):
+            return batch_reranker(expand(dict(block)), **rerank_kwargs)
+
+        return rerank, batched(pairs, args.embedding_batch_users)
+
+    if args.model_type == "generative":
+        if args.model_source == "huggingface":
+            reranker = model.reranker_llama_stream
+        else:
+            reranker = model.reranker_gpt
+    else:
+        reranker = model.reranker_sentence_transformers
+
+    def rerank(task):
+        user_id, items = task
+        items = expand({user_id: items})[user_id]
+        return {user_id: reranker(user_id, items, **rerank_kwargs)}
+
+    return rerank, pairs
+
+
+def main(argv: List[str] = None):
+    # Parse command-line arguments
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.resume and not args.journal_path:
+        parser.error("--resume requires --journal_path")
+    if not args.snapshot_path and not (args.pairs_path and args.titles_path):
+        parser.error(
+            "--pairs_path and --titles_path are required without --snapshot_path"
+        )
+    if args.batch_mode and args.model_source != "openai":
+        parser.error("--batch_mode requires --model_source openai")
+    if args.cascade_model_name and args.model_type != "generative":
+        parser.error("--cascade_model_name requires --model_type generative")
+    if args.window_size is not None and args.window_size < 1:
+        parser.error("--window_size must be at least 1")
+    if args.window_stride is not None and not (
+        args.window_size and 1 <= args.window_stride <= args.window_size
+    ):
+        parser.error("--window_stride must be between 1 and --window_size")
+    if args.batch_users < 1:
+        parser.error("--batch_users must be at least 1")
+    if args.cascade_k < 1:
+        parser.error("--cascade_k must be at least 1")
+    if args.batch_mode and args.window_size:
+        parser.error("--batch_mode cannot be combined with --window_size")
+
+    transport = Transport(
+        requests_per_second=args.requests_per_second,
+        max_retries=args.max_retries,
+        timeout=args.request_timeout,
+        pool_size=max(args.concurrency, 1),
+    )
+
+    metrics = Metrics()
+
+    # Load data
+    data = build_data(args, transport, metrics)
+
+    response_cache = (
+        Response_Cache(args.response_cache_path, args.response_cache_size)
+        if args.response_cache_path
+        else None
+    )
+    batch_runner = (
+        build_batch_runner(args, transport, metrics) if args.batch_mode else None
+    )
+    model = build_model(args, data, transport, response_cache, metrics, batch_runner)
+
     evaluation = Evaluation(data)
-    original_recommendations = evaluation.parse_recommendations(args.inference_path)
 
     new_recommendations = {}
-    for user_id, items in original_recommendations.items():
-        if args.model_type == "generative":
-            if args.model_source == "huggingface":
-                new_recommendations[user_id] = model.reranker_llama_stream(
-                    user_id,
-                    items,
-                    model_name=args.model_name,
-                    include_title=args.include_title,
-                    include_cover=args.include_cover,
-                    include_frames=args.include_frames,
-                    include_comments=args.include_comments,
-                )
-            elif args.model_source == "openai":
-                new_recommendations[user_id] = model.reranker_gpt(
-                    user_id,
-                    items,
-                    model_name=args.model_name,
-                    include_title=args.include_title,
-                    include_cover=args.include_cover,
-                    include_frames=args.include_frames,
-                    include_comments=args.include_comments,
-                )
-        elif args.model_type == "discriminative":
-            if args.model_source == "huggingface":
-                new_recommendations[user_id] = model.reranker_sentence_transformers(
-                    user_id,
-                    items,
-                    model_name=args.model_name,
-                    include_title=args.include_title,
-                    include_cover=args.include_cover,
-                    include_frames=args.include_frames,
-                    include_comments=args.include_comments,
+    journal = None
+    n_resumed = 0
+    if args.journal_path:
+        if args.resume:
+            new_recommendations = Results_Journal.load(args.journal_path)
+            n_resumed = len(new_recommendations)
+            print(f"Resuming: {len(new_recommendations)} users already reranked.")
+            metrics.count("users.resumed", len(new_recommendations))
+        journal = Results_Journal(args.journal_path)
+
+    # The inference file is parsed lazily as the driver pulls work, so
+    # reranking starts before the whole file has been read.
+    original_recommendations = {}
+
+    def pending_recommendations():
+        for user_id, items in read_recommendations(args.inference_path):
+            original_recommendations[user_id] = items
+            if user_id not in new_recommendations:
+                yield user_id, items
+
+    expander = None
+    if args.expand_candidates > 0:
+        expander = build_expander(args, data, transport, model, metrics)
+    cascade_model = None
+    if args.cascade_model_name:
+        cascade_model = build_embedding_model(
+            args,
+            data,
+            transport,
+            args.cascade_model_source,
+            args.cascade_model_name,
+            metrics,
+        )
+    else:
+        rerank, tasks = make_rerank_tasks(
+            args, model, pending_recommendations(), expander
+        )
+
+    def timed_rerank(task):
+        with metrics.timer("rerank.task"):
+            result = rerank(task)
+        metrics.count("users.reranked", len(result))
+        return result
+
+    def record(task, result):
+        for user_id, items in result.items():
+            journal.append(user_id, items)
+
+    expand = make_expand(args, expander)
+
+    def score_block(user_items):
+        # The cascade's cheap pass: cosine ranking plus scores per user.
+        if args.cascade_model_source == "openai":
+            batch_reranker = cascade_model.rerank_text_embedding_batch
+        else:
+            batch_reranker = cascade_model.rerank_sentence_transformers_batch
+        return batch_reranker(
+            expand(user_items),
+            model_name=args.cascade_model_name,
+            include_title=args.include_title,
+            include_cover=args.include_cover,
+            include_frames=args.include_frames,
+            include_comments=args.include_comments,
+            with_scores=True,
+        )
+
+    try:
+        with metrics.timer("rerank.total"):
+            if cascade_model is None:
+                results = run_concurrently(
+                    timed_rerank,
+                    tasks,
+                    args.concurrency,
+                    on_result=record if journal else None,
                 )
-            elif args.model_source == "openai":
-                new_recommendations[user_id] = model.reranker_text_embedding_model(
-                    user_id,
-                    items,
-                    model_name=args.model_name,
-                    include_title=args.include_title,
-                    include_cover=args.include_cover,
-                    include_frames=args.include_frames,
-                    include_comments=args.include_comments,
+            else:
+                cheap_recommendations, cascade_recommendations, escalated = (
+                    run_cascade(
+                        pending_recommendations(),
+                        score_block,
+                        lambda pairs: make_rerank_tasks(args, model, pairs),
+                        Cascade_Policy(
+                            args.cascade_fraction,
+                            args.cascade_k,
+                            args.cascade_min_agreement,
+                            args.cascade_min_margin,
+                        ),
+                        args.embedding_batch_users,
+                        args.concurrency,
+                        on_result=record if journal else None,
+                        metrics=metrics,
+                    )
                 )
+                results = [cascade_recommendations]
+    finally:
+        if journal is not None:
+            journal.close()
+        model.close()
+        if expander is not None and expander is not model:
+            expander.close()
+        if cascade_model is not None:
+            cascade_model.close()
+    for result in results:
+        new_recommendations.update(result)
+    # Keep the inference file's user order, including resumed users.
+    new_recommendations = {
+        user_id: new_recommendations[user_id]
+        for user_id in original_recommendations
+        if user_id in new_recommendations
+    }
+
+    if args.output_path:
+        write_recommendations(args.output_path, new_recommendations.items())
+
+    with metrics.timer("evaluate"):
+        baseline_metrics = evaluation.evaluate(original_recommendations, args.n_list)
+        new_metrics = evaluation.evaluate(new_recommendations, args.n_list)
 
     improvements = {}
     for N in args.n_list:
-        baseline_hit_rate = evaluation.evaluate_hit_rate(original_recommendations, N)
-        new_hit_rate = evaluation.evaluate_hit_rate(new_recommendations, N)
+        baseline_hit_rate = baseline_metrics[N]["hit_rate"]
+        new_hit_rate = new_metrics[N]["hit_rate"]
 
         improvement = (
             ((new_hit_rate - baseline_hit_rate) / baseline_hit_rate * 100)
@@ -152,6 +744,78 @@ def main():
         print(f"  Baseline Hit Rate: {result['baseline_hit_rate']:.4f}")
         print(f"  New Hit Rate: {result['new_hit_rate']:.4f}")
         print(f"  Hit Rate Improvement: {result['improvement']:.2f}%")
+        print(
+            f"  Baseline NDCG: {baseline_metrics[N]['ndcg']:.4f}, "
+            f"New NDCG: {new_metrics[N]['ndcg']:.4f}"
+        )
+        print(
+            f"  Baseline MRR: {baseline_metrics[N]['mrr']:.4f}, "
+            f"New MRR: {new_metrics[N]['mrr']:.4f}"
+        )
+
+    if cascade_model is not None and cheap_recommendations:
+        # Accuracy against LLM cost had fewer of the selected users been
+        # escalated, from the lists this run already produced.
+        n_users = len(cheap_recommendations)
+        print(
+            f"\nCascade: escalated {len(escalated)} of {n_users} users "
+            f"({len(escalated) / n_users:.1%}) from {args.cascade_model_name} "
+            f"to {args.model_name}"
+        )
+        if n_resumed:
+            # The journal keeps final lists only, not the cheap lists or
+            # escalation choices of earlier runs.
+            print(
+                f"  Covers only the users reranked in this run; the "
+                f"{n_resumed} resumed users are not included."
+            )
+        token_counts = model.prompt_builder.token_counts
+        for size, curve_metrics in tradeoff_curve(
+            evaluation,
+            cheap_recommendations,
+            cascade_recommendations,
+            escalated,
+            args.n_list,
+        ):
+            tokens = sum(token_counts.get(user_id, 0) for user_id in escalated[:size])
+            scores = ", ".join(
+                f"HR@{N} {curve_metrics[N]['hit_rate']:.4f} "
+                f"NDCG@{N} {curve_metrics[N]['ndcg']:.4f}"
+                for N in args.n_list
+            )
+            print(
+                f"  {size:>6} escalated ({size / n_users:6.1%}), "
+                f"{tokens:>9} prompt tokens: {scores}"
+            )
+
+    if args.model_type == "generative" and model.prompt_builder.token_counts:
+        token_counts = list(model.prompt_builder.token_counts.values())
+        mean_tokens = sum(token_counts) / len(token_counts)
+        print(
+            f"\nPrompt tokens per user: mean {mean_tokens:.1f}, "
+            f"max {max(token_counts)}, total {sum(token_counts)}"
+        )
+
+    if data.caption_cache is not None:
+        stats = data.caption_cache.stats()
+        print(
+            f"\nCaption cache: {stats['hits']} hits "
+            f"({stats['memory_hits']} memory, {stats['disk_hits']} disk), "
+            f"{stats['misses']} misses"
+        )
+        for name, value in stats.items():
+            metrics.count(f"caption_cache.{name}", value)
+        data.caption_cache.close()
+    if response_cache is not None:
+        stats = response_cache.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses")
+        response_cache.close()
+    transport.close()
+
+    if args.metrics_path:
+        metrics.write_json(args.metrics_path)
+    if args.prometheus_path:
+        metrics.write_prometheus(args.prometheus_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, Sequence
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; quantiles are interpolated within
+    the bucket they fall in."""
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = list(bounds)
+        # The last bucket collects everything above the largest bound.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                # Observed extremes narrow the outermost buckets.
+                lower = max(self.bounds[bucket - 1] if bucket else 0.0, self.min)
+                upper = min(
+                    self.bounds[bucket] if bucket < len(self.bounds) else self.max,
+                    self.max,
+                )
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class Metrics:
+    """Thread-safe counters and per-stage timers for one pipeline run.
+
+    Stages nest: a timer around prompt building also covers the data
+    lookups and captioning it triggers, which have timers of their own.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters: Dict[str, float] = {}
+        self.timers: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            if name not in self.timers:
+                self.timers[name] = Histogram(self.buckets)
+            self.timers[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "timers": {
+                    name: {
+                        "count": histogram.count,
+                        "total_seconds": histogram.sum,
+                        "mean_ms": histogram.sum / histogram.count * 1000,
+                        "p50_ms": histogram.quantile(0.5) * 1000,
+                        "p99_ms": histogram.quantile(0.99) * 1000,
+                        "max_ms": histogram.max * 1000,
+                    }
+                    for name, histogram in sorted(self.timers.items())
+                },
+            }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def write_prometheus(self, path: str, prefix: str = "rerank") -> None:
+        # Prometheus text exposition format, e.g. for the node exporter's
+        # textfile collector.
+        def metric_name(name: str) -> str:
+            return f"{prefix}_{name}".replace(".", "_").replace("-", "_")
+
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = metric_name(name) + "_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            for name, histogram in sorted(self.timers.items()):
+                metric = metric_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines += [
+                    f'{metric}_bucket{{le="+Inf"}} {histogram.count}',
+                    f"{metric}_sum {histogram.sum}",
+                    f"{metric}_count {histogram.count}",
+                ]
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import re
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+POOLING_MODES = ("joined", "mean")
+
+
+def history_fingerprint(history: List[int]) -> int:
+    # Signed 64-bit digest of the exact history a profile was built from.
+    digest = hashlib.blake2b(
+        np.asarray(history, dtype=np.int64).tobytes(), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def pool_profiles(embeddings: np.ndarray, counts: List[int]) -> np.ndarray:
+    # Mean of the L2-normalised embeddings of each user's consecutive run of
+    # `counts` rows; users without rows get a zero profile.
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    counts = np.asarray(counts, dtype=np.int64)
+    profiles = np.zeros((len(counts), embeddings.shape[1]), dtype=np.float32)
+    present = counts > 0
+    if present.any():
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+        profiles[present] = (
+            np.add.reduceat(embeddings, starts, axis=0) / counts[present, None]
+        )
+    return profiles
+
+
+class User_Profile_Store:
+    """One history embedding per user, persisted and refreshed incrementally.
+
+    Each profile is stored with a fingerprint of the history it was built
+    from, so after new pairs are appended only users whose latest history
+    changed are re-encoded. Updates are buffered in memory and written out
+    every flush_every users and on flush(), by rewriting the files and
+    swapping them in so older memory maps stay valid.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        model_name: str,
+        pooling: str = "joined",
+        dtype: str = "float32",
+        flush_every: int = 10000,
+    ):
+        if pooling not in POOLING_MODES:
+            raise ValueError(f"Unsupported profile pooling {pooling}.")
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding dtype {dtype}.")
+
+        os.makedirs(directory, exist_ok=True)
+        self.pooling = pooling
+        self.dtype = np.dtype(dtype)
+        self.flush_every = flush_every
+        key = "{}-profiles-{}-{}".format(
+            re.sub(r"[^A-Za-z0-9_.-]", "_", model_name), pooling, dtype
+        )
+        self.matrix_path = os.path.join(directory, f"{key}.npy")
+        self.users_path = os.path.join(directory, f"{key}.users.npy")
+        self.fingerprints_path = os.path.join(directory, f"{key}.fingerprints.npy")
+        # user -> (fingerprint, embedding) not yet written to disk
+        self._pending: Dict[int, Tuple[int, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        self._matrix = None
+        self._users = np.empty(0, dtype=np.int64)
+        self._fingerprints = np.empty(0, dtype=np.int64)
+        if all(
+            os.path.exists(path)
+            for path in (self.matrix_path, self.users_path, self.fingerprints_path)
+        ):
+            self._matrix = np.load(self.matrix_path, mmap_mode="r")
+            self._users = np.load(self.users_path)
+            self._fingerprints = np.load(self.fingerprints_path)
+        self._rows = {int(user): row for row, user in enumerate(self._users)}
+
+    def __len__(self) -> int:
+        return len(self._users) + sum(
+            user not in self._rows for user in self._pending
+        )
+
+    def _fingerprint(self, user: int) -> Optional[int]:
+        if user in self._pending:
+            return self._pending[user][0]
+        row = self._rows.get(user)
+        return None if row is None else int(self._fingerprints[row])
+
+    def stale(self, histories: Dict[int, List[int]]) -> List[int]:
+        # Users without a profile or whose history has changed since.
+        with self._lock:
+            return [
+                user
+                for user, history in histories.items()
+                if self._fingerprint(user) != history_fingerprint(history)
+            ]
+
+    def get(self, user_ids: List[int]) -> np.ndarray:
+        with self._lock:
+            missing = [
+                user
+                for user in user_ids
+                if user not in self._pending and user not in self._rows
+            ]
+            if missing:
+                raise KeyError(f"No stored profile for users {missing}.")
+            return np.stack(
+                [
+                    self._pending[user][1]
+                    if user in self._pending
+                    else np.asarray(self._matrix[self._rows[user]])
+                    for user in user_ids
+                ]
+            ).astype(np.float32)
+
+    def update(
+        self,
+        user_ids: List[int],
+        histories: List[List[int]],
+        embeddings: np.ndarray,
+    ) -> None:
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        if not (len(user_ids) == len(histories) == len(embeddings)):
+            raise ValueError(
+                "Number of users, histories and embeddings do not match."
+            )
+        if not user_ids:
+            return
+
+        with self._lock:
+            dim = embeddings.shape[1]
+            if self._matrix is not None and self._matrix.shape[1] != dim:
+                raise ValueError(
+                    f"Embedding dimension {dim} does not match store "
+                    f"dimension {self._matrix.shape[1]}."
+                )
+            for user, history, embedding in zip(user_ids, histories, embeddings):
+                self._pending[int(user)] = (history_fingerprint(history), embedding)
+            if len(self._pending) >= self.flush_every:
+                self._write()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def _write(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        dim = next(iter(pending.values()))[1].shape[0]
+
+        new_users = [user for user in pending if user not in self._rows]
+        n_old = len(self._users)
+        users = np.concatenate([self._users, np.asarray(new_users, dtype=np.int64)])
+        rows = dict(self._rows)
+        rows.update((user, n_old + i) for i, user in enumerate(new_users))
+        fingerprints = np.concatenate(
+            [self._fingerprints, np.zeros(len(new_users), dtype=np.int64)]
+        )
+
+        tmp_matrix_path = self.matrix_path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(
+            tmp_matrix_path, mode="w+", dtype=self.dtype, shape=(len(users), dim)
+        )
+        if n_old:
+            matrix[:n_old] = self._matrix
+        for user, (fingerprint, embedding) in pending.items():
+            matrix[rows[user]] = embedding
+            fingerprints[rows[user]] = fingerprint
+        matrix.flush()
+        del matrix
+
+        tmp_users_path = self.users_path + ".tmp.npy"
+        tmp_fingerprints_path = self.fingerprints_path + ".tmp.npy"
+        np.save(tmp_users_path, users)
+        np.save(tmp_fingerprints_path, fingerprints)
+        os.replace(tmp_matrix_path, self.matrix_path)
+        os.replace(tmp_users_path, self.users_path)
+        os.replace(tmp_fingerprints_path, self.fingerprints_path)
+        self._load()
@@ -0,0 +1,194 @@
+import re
+import threading
+from typing import Callable, Dict, List, Tuple
+from data import Data
+from metrics import Metrics
+
+# Sections in the order they are truncated when a prompt is over budget.
+TRUNCATION_ORDER = ["comments", "frames", "cover", "history", "titles"]
+
+INSTRUCTIONS = (
+    "\nPlease rerank these items for the user based on their relevance.\n"
+    "Make sure to include ALL given item IDs in your response, without omitting any.\n"
+    "Output ONLY the reranked list of item IDs, separated by commas, in the exact order of ranking.\n"
+    "Example output: 123, 456, 789\n"
+)
+
+
+def make_token_counter(tokenizer_name: str = None) -> Callable[[str], int]:
+    if tokenizer_name:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+    # Without a model tokenizer, count words and punctuation marks, which
+    # tracks BPE token counts closely enough for budgeting.
+    pattern = re.compile(r"\w+|[^\w\s]")
+    return lambda text: len(pattern.findall(text))
+
+
+class Prompt_Builder:
+    """Assembles the listwise rerank prompt shared by the generative models.
+
+    Lines are collected per section and joined once. When max_tokens is
+    set, the lowest-value lines (later comments and frames first) are
+    dropped until the prompt fits; candidate IDs and instructions are
+    always kept.
+    """
+
+    def __init__(
+        self,
+        data: Data,
+        max_tokens: int = None,
+        tokenizer_name: str = None,
+        metrics: Metrics = None,
+    ):
+        self.data = data
+        self.metrics = metrics or data.metrics
+        self.max_tokens = max_tokens
+        self.count_tokens = make_token_counter(tokenizer_name)
+        # Prompt tokens per user, summed over every prompt built for them
+        # (a windowed rerank builds one per window).
+        self.token_counts: Dict[int, int] = {}
+        self._token_counts_lock = threading.Lock()
+
+    def _item_sections(
+        self,
+        user_id: int,
+        item_list: List[int],
+        include_title: bool,
+        include_cover: bool,
+        include_frames: bool,
+        include_comments: bool,
+    ) -> Dict[str, List[Tuple[int, str]]]:
+        # Each line carries its index within the item (Frame_3 -> 3), so
+        # truncation removes the third frame of every item before the second.
+        # Captioning is timed as its own stage, apart from the lookups.
+        sections = {"titles": [], "cover": [], "frames": [], "comments": []}
+
+        if include_title:
+            with self.metrics.timer("data.lookup"):
+                for item in item_list:
+                    title = self.data.extract_title(item)
+                    sections["titles"].append((0, f"Item_Id: {item}. Title: {title}"))
+
+        if include_cover and self.data.has_covers:
+            with self.metrics.timer("data.caption"):
+                for item in item_list:
+                    cover = self.data.process_cover(item)
+                    if cover:
+                        sections["cover"].append(
+                            (0, f"Item_Id: {item}. Cover: {cover}")
+                        )
+
+        if include_frames and self.data.has_frames:
+            with self.metrics.timer("data.caption"):
+                for item in item_list:
+                    frames = self.data.process_frames(item)
+                    for i, frame in enumerate(frames, start=1):
+                        sections["frames"].append(
+                            (i, f"Item_Id: {item}. Frame_{i}: {frame}")
+                        )
+
+        if include_comments and self.data.comments is not None:
+            with self.metrics.timer("data.lookup"):
+                for item in item_list:
+                    comments = self.data.extract_comments(user_id, item)
+                    for i, comment in enumerate(comments, start=1):
+                        sections["comments"].append(
+                            (i, f"Item_Id: {item}. Comment_{i}: {comment}")
+                        )
+
+        return sections
+
+    def _truncate(
+        self, sections: Dict[str, List[Tuple[int, str]]], fixed_tokens: int
+    ) -> None:
+        line_tokens = {
+            name: [self.count_tokens(line) + 1 for _, line in lines]
+            for name, lines in sections.items()
+        }
+        total = fixed_tokens + sum(sum(tokens) for tokens in line_tokens.values())
+
+        for name in TRUNCATION_ORDER:
+            if total <= self.max_tokens:
+                return
+            lines = sections[name]
+            # Highest per-item index first, later items first within an index
+            drop_order = sorted(
+                range(len(lines)), key=lambda row: (lines[row][0], row), reverse=True
+            )
+            dropped = set()
+            for row in drop_order:
+                if total <= self.max_tokens:
+                    break
+                dropped.add(row)
+                total -= line_tokens[name][row]
+            sections[name] = [
+                line for row, line in enumerate(lines) if row not in dropped
+            ]
+
+    def build(
+        self,
+        user_id: int,
+        item_list: List[int],
+        include_title=True,
+        include_cover=False,
+        include_frames=False,
+        include_comments=False,
+        user_label: str = "User",
+    ) -> Tuple[str, List[int]]:
+        header = ["You are an expert in recommending items to users."]
+        candidates = [
+            f"These are the item_ids that you need to rerank: {item_list}.",
+            "Below is the information of these items.",
+        ]
+
+        with self.metrics.timer("data.lookup"):
+            # Repeated history titles add tokens but no information.
+            history_titles = dict.fromkeys(
+                self.data.extract_title(item)
+                for item in self.data.get_N_latest_items(user_id, 10)
+            )
+            item_list = self.data.filter_items(item_list)
+        sections = self._item_sections(
+            user_id,
+            item_list,
+            include_title,
+            include_cover,
+            include_frames,
+            include_comments,
+        )
+        sections["history"] = [
+            (
+                0,
+                f"{user_label} has previously interacted with this item "
+                f"with title: {title}.",
+            )
+            for title in history_titles
+        ]
+
+        if self.max_tokens is not None:
+            fixed_tokens = self.count_tokens(
+                "\n".join(header + candidates) + INSTRUCTIONS
+            )
+            self._truncate(sections, fixed_tokens)
+
+        lines = (
+            header
+            + [line for _, line in sections["history"]]
+            + candidates
+            + [
+                line
+                for name in ("titles", "cover", "frames", "comments")
+                for _, line in sections[name]
+            ]
+        )
+        prompt = "\n".join(lines) + "\n" + INSTRUCTIONS
+
+        n_tokens = self.count_tokens(prompt)
+        with self._token_counts_lock:
+            self.token_counts[user_id] = self.token_counts.get(user_id, 0) + n_tokens
+        self.metrics.count("prompt.tokens", n_tokens)
+        return prompt, item_list
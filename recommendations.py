@@ -0,0 +1,141 @@
+import argparse
+import mmap
+import os
+import re
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+RECOMMENDATION_PATTERN = re.compile(
+    rb"User (\d+): Top (\d+) recommended items: \[([^\]]*)\]"
+)
+
+
+def iter_recommendations(file_path: str) -> Iterator[Tuple[int, List[int]]]:
+    """Yield (user, items) pairs from an inference file for any top-K.
+
+    The file is scanned through a read-only memory map, so pairs are
+    produced as they are found and peak memory does not grow with file
+    size. Entries may wrap across lines.
+    """
+    with open(file_path, "rb") as file:
+        try:
+            content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be memory-mapped.
+            return
+        # The map is released with the generator; closing it explicitly
+        # would fail while the regex scanner still holds its buffer.
+        for match in RECOMMENDATION_PATTERN.finditer(content):
+            user, _, items = match.groups()
+            yield int(user), [
+                int(item) for item in items.split(b",") if item.strip()
+            ]
+
+
+class Recommendation_Lists:
+    """Users x K recommendation matrix in compact int32 form.
+
+    Rows shorter than K are padded with -1. Saved as an uncompressed .npz
+    (users, items), or as a directory holding users.npy and items.npy,
+    which is loaded memory-mapped.
+    """
+
+    def __init__(self, users: np.ndarray, items: np.ndarray):
+        if items.ndim != 2 or len(users) != len(items):
+            raise ValueError("Expected a users vector and a users x K item matrix.")
+        self.users = users
+        self.items = items
+
+    @classmethod
+    def from_pairs(
+        cls, pairs: Iterable[Tuple[int, List[int]]]
+    ) -> "Recommendation_Lists":
+        users, rows = [], []
+        for user, items in pairs:
+            users.append(user)
+            rows.append(items)
+
+        K = max((len(items) for items in rows), default=0)
+        matrix = np.full((len(rows), K), -1, dtype=np.int32)
+        for row, items in enumerate(rows):
+            matrix[row, : len(items)] = items
+        return cls(np.asarray(users, dtype=np.int32), matrix)
+
+    @classmethod
+    def from_dict(
+        cls, recommendations: Dict[int, List[int]]
+    ) -> "Recommendation_Lists":
+        return cls.from_pairs(recommendations.items())
+
+    @classmethod
+    def load(
+        cls, path: str, mmap_mode: Optional[str] = "r"
+    ) -> "Recommendation_Lists":
+        if os.path.isdir(path):
+            return cls(
+                np.load(os.path.join(path, "users.npy"), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, "items.npy"), mmap_mode=mmap_mode),
+            )
+        with np.load(path) as arrays:
+            return cls(arrays["users"], arrays["items"])
+
+    def save(self, path: str) -> None:
+        if path.endswith(".npz"):
+            np.savez(path, users=self.users, items=self.items)
+            return
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "users.npy"), self.users)
+        np.save(os.path.join(path, "items.npy"), self.items)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __iter__(self) -> Iterator[Tuple[int, List[int]]]:
+        for user, row in zip(self.users.tolist(), self.items):
+            yield user, row[row >= 0].tolist()
+
+    def to_dict(self) -> Dict[int, List[int]]:
+        return dict(self)
+
+
+def is_binary_recommendations(path: str) -> bool:
+    # A path ending in a separator names a directory even before it exists;
+    # without one, a new path is a text file.
+    separators = tuple(sep for sep in (os.sep, os.altsep) if sep)
+    return os.path.isdir(path) or path.endswith((".npz",) + separators)
+
+
+def read_recommendations(path: str) -> Iterator[Tuple[int, List[int]]]:
+    if is_binary_recommendations(path):
+        return iter(Recommendation_Lists.load(path))
+    return iter_recommendations(path)
+
+
+def write_recommendations(path: str, pairs: Iterable[Tuple[int, List[int]]]) -> None:
+    if is_binary_recommendations(path):
+        Recommendation_Lists.from_pairs(pairs).save(path)
+        return
+    with open(path, "w") as file:
+        for user, items in pairs:
+            file.write(
+                f"User {user}: Top {len(items)} recommended items: "
+                f"[{', '.join(map(str, items))}]\n"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert recommendation lists between text and binary formats"
+    )
+    parser.add_argument("input_path", help="Inference text file, .npz or directory")
+    parser.add_argument(
+        "output_path",
+        help="Output text file, .npz or directory (new directories need a trailing /)",
+    )
+    args = parser.parse_args()
+
+    write_recommendations(args.output_path, read_recommendations(args.input_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class Response_Cache:
+    """SQLite cache of LLM completions keyed by (model, prompt hash, sampling
+    parameters), evicting least recently used entries beyond max_entries."""
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self._conn.commit()
+        # Row count kept up to date by put and _evict, so eviction checks do
+        # not scan the table.
+        (self._count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM responses"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, params: Dict = None) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        payload = json.dumps([model, prompt_hash, params or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str, params: Dict = None) -> Optional[str]:
+        key = self.make_key(model, prompt, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(
+        self, model: str, prompt: str, response: str, params: Dict = None
+    ) -> None:
+        key = self.make_key(model, prompt, params)
+        with self._lock:
+            now = time.time()
+            updated = self._conn.execute(
+                "UPDATE responses SET model = ?, response = ?, last_used = ? "
+                "WHERE key = ?",
+                (model, response, now, key),
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT INTO responses (key, model, response, last_used) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, model, response, now),
+                )
+                self._count += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self._count <= self.max_entries:
+            return
+        # Drop a little more than the overflow so eviction is not run per put.
+        excess = self._count - self.max_entries + max(1, self.max_entries // 100)
+        self._count -= self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+            (excess,),
+        ).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
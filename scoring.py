@@ -0,0 +1,64 @@
+import numpy as np
+from typing import List, Tuple
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def pad_candidates(item_lists: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    # Ragged candidate lists as a users x K item matrix padded with -1, plus
+    # the mask of real entries.
+    K = max((len(items) for items in item_lists), default=0)
+    items = np.full((len(item_lists), K), -1, dtype=np.int64)
+    mask = np.zeros((len(item_lists), K), dtype=bool)
+    for row, item_list in enumerate(item_lists):
+        items[row, : len(item_list)] = item_list
+        mask[row, : len(item_list)] = True
+    return items, mask
+
+
+def cosine_scores(
+    user_embeddings: np.ndarray,
+    candidate_embeddings: np.ndarray,
+    mask: np.ndarray = None,
+    normalized: bool = False,
+) -> np.ndarray:
+    # users x d against users x K x d in one batched product; padded
+    # candidates score -inf so they sort last.
+    if not normalized:
+        user_embeddings = normalize(user_embeddings)
+        candidate_embeddings = normalize(candidate_embeddings)
+    scores = np.einsum("ud,ukd->uk", user_embeddings, candidate_embeddings)
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    return scores
+
+
+def rank_by_scores(scores: np.ndarray) -> np.ndarray:
+    # Stable, so ties keep the incoming candidate order.
+    return np.argsort(-scores, axis=1, kind="stable")
+
+
+def rank_candidates(
+    items: np.ndarray,
+    mask: np.ndarray,
+    user_embeddings: np.ndarray,
+    candidate_embeddings: np.ndarray,
+    with_scores: bool = False,
+) -> List:
+    # Ranked item lists, or (ranked items, descending scores) pairs.
+    scores = cosine_scores(user_embeddings, candidate_embeddings, mask)
+    order = rank_by_scores(scores)
+    ranked = np.take_along_axis(items, order, axis=1)
+    lengths = mask.sum(axis=1)
+    ranked_lists = [row[:n].tolist() for row, n in zip(ranked, lengths)]
+    if not with_scores:
+        return ranked_lists
+    ranked_scores = np.take_along_axis(scores, order, axis=1)
+    return [
+        (item_list, row[:n].tolist())
+        for item_list, row, n in zip(ranked_lists, ranked_scores, lengths)
+    ]
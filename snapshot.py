@@ -0,0 +1,175 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Optional, Tuple
+
+PAIR_COLUMNS = ("user", "item", "timestamp")
+
+
+class String_Pool:
+    """Strings stored as one UTF-8 byte buffer and an offsets array.
+
+    String i is data[offsets[i]:offsets[i + 1]]. Both arrays can be
+    memory-mapped, so a pool costs no Python objects until it is read.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "String_Pool":
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+
+class Comments:
+    """Comments grouped by (user, item), found by binary search.
+
+    Rows are sorted by a packed (user << 32 | item) key, keeping file
+    order within a key.
+    """
+
+    def __init__(self, keys: np.ndarray, pool: String_Pool):
+        self.keys = keys
+        self.pool = pool
+
+    @staticmethod
+    def pack(users, items) -> np.ndarray:
+        return (np.asarray(users, dtype=np.int64) << 32) | np.asarray(
+            items, dtype=np.int64
+        )
+
+    @classmethod
+    def from_columns(
+        cls, users: np.ndarray, items: np.ndarray, texts: List[str]
+    ) -> "Comments":
+        keys = cls.pack(users, items)
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], String_Pool.from_strings(texts[row] for row in order))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get(self, user_id: int, item_id: int) -> List[str]:
+        key = (int(user_id) << 32) | int(item_id)
+        start = np.searchsorted(self.keys, key, side="left")
+        end = np.searchsorted(self.keys, key, side="right")
+        return [self.pool[row] for row in range(start, end)]
+
+
+def read_pairs(pairs_path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    pairs = pd.read_csv(pairs_path, usecols=list(PAIR_COLUMNS))
+    return tuple(pairs[column].to_numpy(dtype=np.int64) for column in PAIR_COLUMNS)
+
+
+def read_titles(titles_path: str) -> Tuple[np.ndarray, String_Pool]:
+    titles = pd.read_csv(
+        titles_path,
+        header=None,
+        names=["item", "title"],
+        dtype={"item": np.int64, "title": str},
+        keep_default_na=False,
+    )
+    return titles["item"].to_numpy(), String_Pool.from_strings(titles["title"])
+
+
+def read_comments(comments_path: str) -> Comments:
+    comments = pd.read_csv(
+        comments_path,
+        sep="\t",
+        header=None,
+        names=["user_id", "item_id", "comment"],
+        dtype={"user_id": np.int64, "item_id": np.int64, "comment": str},
+        keep_default_na=False,
+    )
+    return Comments.from_columns(
+        comments["user_id"].to_numpy(),
+        comments["item_id"].to_numpy(),
+        comments["comment"].tolist(),
+    )
+
+
+def _path(directory: str, name: str) -> str:
+    return os.path.join(directory, f"{name}.npy")
+
+
+def save_snapshot(
+    directory: str, pairs_path: str, titles_path: str, comments_path: str = None
+) -> None:
+    """Convert the pairs, titles and comments files into a directory of .npy
+    columns that Data memory-maps on startup."""
+    os.makedirs(directory, exist_ok=True)
+    for column, values in zip(PAIR_COLUMNS, read_pairs(pairs_path)):
+        np.save(_path(directory, f"pairs_{column}"), values)
+
+    title_items, title_pool = read_titles(titles_path)
+    np.save(_path(directory, "title_items"), title_items)
+    np.save(_path(directory, "title_offsets"), title_pool.offsets)
+    np.save(_path(directory, "title_bytes"), title_pool.data)
+
+    if comments_path:
+        comments = read_comments(comments_path)
+        np.save(_path(directory, "comment_keys"), comments.keys)
+        np.save(_path(directory, "comment_offsets"), comments.pool.offsets)
+        np.save(_path(directory, "comment_bytes"), comments.pool.data)
+
+
+def load_pairs(directory: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return tuple(
+        np.load(_path(directory, f"pairs_{column}"), mmap_mode="r")
+        for column in PAIR_COLUMNS
+    )
+
+
+def load_titles(directory: str) -> Tuple[np.ndarray, String_Pool]:
+    return np.load(_path(directory, "title_items"), mmap_mode="r"), String_Pool(
+        np.load(_path(directory, "title_offsets"), mmap_mode="r"),
+        np.load(_path(directory, "title_bytes"), mmap_mode="r"),
+    )
+
+
+def has_comments(directory: str) -> bool:
+    return os.path.exists(_path(directory, "comment_keys"))
+
+
+def load_comments(directory: str) -> Optional[Comments]:
+    if not has_comments(directory):
+        return None
+    return Comments(
+        np.load(_path(directory, "comment_keys"), mmap_mode="r"),
+        String_Pool(
+            np.load(_path(directory, "comment_offsets"), mmap_mode="r"),
+            np.load(_path(directory, "comment_bytes"), mmap_mode="r"),
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert pairs, titles and comments to a columnar snapshot"
+    )
+    parser.add_argument("--pairs_path", required=True, help="Path to pairs CSV file")
+    parser.add_argument("--titles_path", required=True, help="Path to titles CSV file")
+    parser.add_argument("--comments_path", help="Path to comments TXT file")
+    parser.add_argument(
+        "--output_path", required=True, help="Directory to write the snapshot to"
+    )
+    args = parser.parse_args()
+
+    save_snapshot(args.output_path, args.pairs_path, args.titles_path, args.comments_path)
+    print(f"Wrote snapshot to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import re
+from typing import Iterable, List, Optional
+
+# A number plus the whitespace after it; what follows decides whether the
+# number is a list entry.
+NUMBER = re.compile(r"(\d+)\s*")
+
+
+def max_tokens_for(n_candidates: int) -> int:
+    # An ID plus its ", " separator is at most a handful of tokens; the
+    # slack covers a short preamble the model may emit before the list.
+    return n_candidates * 6 + 64
+
+
+class Incremental_ID_Parser:
+    """Extracts candidate item IDs from LLM output as it streams in.
+
+    Numbers that are not candidates, repeated IDs and numbers followed by
+    a word (counts in a preamble such as "Here are 3 items") are ignored.
+    The parser is done as soon as every candidate has been emitted and
+    delimited, so the caller can stop reading the stream.
+    """
+
+    def __init__(self, candidates: Iterable[int]):
+        self.candidates = list(dict.fromkeys(candidates))
+        self._candidate_set = set(self.candidates)
+        self._candidate_strings = [str(item) for item in self.candidates]
+        self.ids: List[int] = []
+        self._seen = set()
+        self._pending = ""
+        self._text_parts: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        return bool(self.candidates) and len(self._seen) == len(self._candidate_set)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._text_parts)
+
+    def _accept(self, token: str) -> None:
+        item = int(token)
+        if item in self._candidate_set and item not in self._seen:
+            self._seen.add(item)
+            self.ids.append(item)
+
+    @staticmethod
+    def _is_label(next_char: str) -> bool:
+        # "3 items", "5th" or "top 3:" count something rather than list an ID.
+        return next_char.isalpha() or next_char == ":"
+
+    def feed(self, delta: Optional[str]) -> bool:
+        if not delta:
+            return self.done
+        self._text_parts.append(delta)
+
+        # A number is only accepted once the character after it has arrived:
+        # until then it may still grow ("123" -> "1234") or turn out to be a
+        # count in a preamble.
+        buffer = self._pending + delta
+        self._pending = ""
+        for match in NUMBER.finditer(buffer):
+            if match.end() == len(buffer):
+                self._pending = match.group()
+                break
+            if not self._is_label(buffer[match.end()]):
+                self._accept(match.group(1))
+        return self.done
+
+    def close(self) -> None:
+        if self._pending:
+            self._accept(self._pending.strip())
+            self._pending = ""
+
+    def ranked_items(self) -> List[int]:
+        # Candidates the model left out keep their incoming order at the end.
+        return self.ids + [item for item in self.candidates if item not in self._seen]
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+# The modules live at the repository root rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def data_paths(tmp_path):
+    # Three users with short histories over items 1-9; every item is titled.
+    pairs = tmp_path / "pairs.csv"
+    pairs.write_text(
+        "user,item,timestamp\n"
+        "1,1,10\n1,2,20\n1,3,30\n"
+        "2,4,10\n2,5,20\n"
+        "3,6,10\n3,7,20\n3,8,30\n3,9,40\n"
+    )
+    titles = tmp_path / "titles.csv"
+    titles.write_text("".join(f'{item},"title {item}"\n' for item in range(1, 10)))
+    return {"pairs_path": str(pairs), "titles_path": str(titles)}
+
+
+@pytest.fixture
+def server():
+    # Answers each request with the next (status, headers) of `replies`,
+    # then with 200 once they run out.
+    replies = []
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self.rfile.read(length)
+            received.append(self.path)
+            status, headers = replies.pop(0) if replies else (200, {})
+            body = b"ok" if status == 200 else b"error"
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_POST = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(
+        target=httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    httpd.replies = replies
+    httpd.received = received
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from batch_jobs import EMBEDDINGS, Batch_Runner, Local_Batch_Backend
+
+
+def respond(endpoint, body):
+    if body["input"] == "bad":
+        raise ValueError("cannot embed")
+    return {"endpoint": endpoint, "echo": body["input"]}
+
+
+class Counting_Backend(Local_Batch_Backend):
+    def __init__(self, directory, respond, fail_status=None):
+        super().__init__(directory, respond)
+        self.submitted = 0
+        self.polls = 0
+        self.fail_status = fail_status
+
+    def submit(self, input_path, endpoint):
+        self.submitted += 1
+        return super().submit(input_path, endpoint)
+
+    def status(self, batch_id):
+        self.polls += 1
+        if self.fail_status:
+            return self.fail_status
+        return super().status(batch_id)
+
+
+def requests_for(*inputs):
+    return {f"r{index}": {"input": text} for index, text in enumerate(inputs)}
+
+
+def test_local_job_moves_one_status_per_poll(tmp_path):
+    backend = Local_Batch_Backend(str(tmp_path / "local"), respond)
+    input_path = tmp_path / "input.jsonl"
+    request = {"custom_id": "a", "method": "POST", "url": EMBEDDINGS}
+    request["body"] = {"input": "x"}
+    input_path.write_text(json.dumps(request) + "\n")
+    batch_id = backend.submit(str(input_path), EMBEDDINGS)
+    statuses = [backend.status(batch_id) for _ in range(4)]
+    assert statuses == ["in_progress", "finalizing", "completed", "completed"]
+    [record] = backend.results(batch_id)
+    assert record["custom_id"] == "a"
+    assert record["response"] == {
+        "status_code": 200,
+        "body": {"endpoint": EMBEDDINGS, "echo": "x"},
+    }
+
+
+def test_runner_submits_polls_and_ingests(tmp_path):
+    backend = Counting_Backend(str(tmp_path / "local"), respond)
+    runner = Batch_Runner(backend, str(tmp_path), poll_interval=0)
+    responses = runner.run(EMBEDDINGS, requests_for("a", "bad", "c"))
+
+    assert responses == {
+        "r0": {"endpoint": EMBEDDINGS, "echo": "a"},
+        "r2": {"endpoint": EMBEDDINGS, "echo": "c"},
+    }
+    assert backend.submitted == 1
+    assert backend.polls == 3
+    assert runner.metrics.counters["batch.failed_requests"] == 1
+
+
+def test_requests_are_split_across_input_files(tmp_path):
+    backend = Counting_Backend(str(tmp_path / "local"), respond)
+    runner = Batch_Runner(
+        backend, str(tmp_path), poll_interval=0, max_requests_per_file=2
+    )
+    responses = runner.run(EMBEDDINGS, requests_for("a", "b", "c", "d", "e"))
+    assert sorted(responses) == ["r0", "r1", "r2", "r3", "r4"]
+    assert backend.submitted == 3
+
+
+def test_rerun_resumes_submitted_jobs_by_digest(tmp_path):
+    class Interrupted(Exception):
+        pass
+
+    class Interrupted_Backend(Counting_Backend):
+        def status(self, batch_id):
+            raise Interrupted()
+
+    directory = str(tmp_path)
+    local = str(tmp_path / "local")
+    with pytest.raises(Interrupted):
+        Batch_Runner(Interrupted_Backend(local, respond), directory).run(
+            EMBEDDINGS, requests_for("a", "b")
+        )
+
+    backend = Counting_Backend(local, respond)
+    runner = Batch_Runner(backend, directory, poll_interval=0)
+    responses = runner.run(EMBEDDINGS, requests_for("a", "b"))
+    assert sorted(responses) == ["r0", "r1"]
+    assert backend.submitted == 0
+    assert runner.metrics.counters["batch.resumed_jobs"] == 1
+
+    # Different requests are a different input file, and a new job.
+    runner.run(EMBEDDINGS, requests_for("a", "c"))
+    assert backend.submitted == 1
+
+
+def test_failed_job_is_submitted_again_on_the_next_run(tmp_path):
+    directory = str(tmp_path)
+    local = str(tmp_path / "local")
+    failing = Counting_Backend(local, respond, fail_status="expired")
+    with pytest.raises(FileNotFoundError):
+        # An expired job that never ran has no output to ingest.
+        Batch_Runner(failing, directory, poll_interval=0).run(
+            EMBEDDINGS, requests_for("a")
+        )
+
+    backend = Counting_Backend(local, respond)
+    responses = Batch_Runner(backend, directory, poll_interval=0).run(
+        EMBEDDINGS, requests_for("a")
+    )
+    assert backend.submitted == 1
+    assert list(responses) == ["r0"]
@@ -0,0 +1,99 @@
+import pytest
+
+from cascade import (
+    Cascade_Policy,
+    boundary_margin,
+    run_cascade,
+    top_k_agreement,
+    tradeoff_curve,
+)
+
+
+def test_signals():
+    assert top_k_agreement([1, 2, 3], [2, 1, 4], 2) == 1.0
+    assert top_k_agreement([1, 2, 3], [2, 4, 1], 2) == 0.5
+    assert top_k_agreement([], [1], 2) == 1.0
+    assert boundary_margin([0.9, 0.5, 0.4], 1) == pytest.approx(0.4)
+    assert boundary_margin([0.9, 0.5], 2) == float("inf")
+
+
+def test_select_escalates_uncertain_users_least_agreement_first():
+    policy = Cascade_Policy(fraction=0.5, k=2, min_agreement=0.5, min_margin=0.1)
+    signals = {
+        1: (1.0, 0.5),  # certain
+        2: (0.0, 0.5),  # disagrees with the baseline
+        3: (1.0, 0.05),  # small margin
+        4: (0.0, 0.01),  # both
+        5: (1.0, 0.2),  # certain
+        6: (0.5, 0.2),  # certain: agreement is not below the minimum
+    }
+    assert policy.select(signals) == [4, 2, 3]
+    assert Cascade_Policy(fraction=0.34, k=2, min_margin=0.1).select(signals) == [4, 2]
+    assert Cascade_Policy(fraction=1.0, k=2, min_margin=0.1).select(signals) == [
+        4,
+        2,
+        3,
+    ]
+    assert Cascade_Policy(fraction=0.0, k=2).select(signals) == []
+
+
+@pytest.mark.parametrize("kwargs", [{"fraction": 1.5}, {"fraction": -0.1}, {"k": 0}])
+def test_policy_rejects_invalid_settings(kwargs):
+    with pytest.raises(ValueError):
+        Cascade_Policy(**kwargs)
+
+
+class Recording_Evaluation:
+    def evaluate(self, recommendations, n_list):
+        return {N: dict(recommendations) for N in n_list}
+
+
+def test_tradeoff_curve_mixes_escalated_prefixes_into_the_cheap_lists():
+    cheap = {1: [1], 2: [2], 3: [3], 4: [4]}
+    final = {1: [1], 2: [20], 3: [30], 4: [40]}
+    curve = tradeoff_curve(Recording_Evaluation(), cheap, final, [3, 2], [5], steps=4)
+    assert [size for size, _ in curve] == [0, 1, 2]
+    assert curve[0][1][5] == cheap
+    assert curve[1][1][5] == {1: [1], 2: [2], 3: [30], 4: [4]}
+    assert curve[2][1][5] == {1: [1], 2: [20], 3: [30], 4: [4]}
+
+
+def test_run_cascade_journals_cheap_lists_after_the_expensive_pass():
+    pairs = [(user_id, [1, 2, 3]) for user_id in range(1, 5)]
+    events = []
+
+    def score_block(user_items):
+        # Users 3 and 4 disagree with the baseline.
+        return {
+            user_id: (items[::-1] if user_id >= 3 else items, [3.0, 2.0, 1.0])
+            for user_id, items in user_items.items()
+        }
+
+    def make_expensive_tasks(pairs):
+        def rerank(task):
+            user_id, items = task
+            events.append(("rerank", user_id))
+            return {user_id: sorted(items)}
+
+        return rerank, list(pairs)
+
+    def on_result(task, result):
+        events.extend(("journal", user_id) for user_id in result)
+
+    cheap, final, escalated = run_cascade(
+        pairs,
+        score_block,
+        make_expensive_tasks,
+        Cascade_Policy(fraction=0.5, k=1, min_agreement=1.0, min_margin=0.0),
+        block_size=3,
+        on_result=on_result,
+    )
+
+    assert sorted(escalated) == [3, 4]
+    assert cheap[3] == [3, 2, 1] and final[3] == [1, 2, 3]
+    assert final[1] == cheap[1] == [1, 2, 3]
+    journaled = [user_id for kind, user_id in events if kind == "journal"]
+    assert sorted(journaled) == [1, 2, 3, 4]
+    last_rerank = max(i for i, (kind, _) in enumerate(events) if kind == "rerank")
+    for kind, user_id in events[:last_rerank]:
+        assert kind == "rerank" or user_id in escalated
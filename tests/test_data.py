@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from data import Data
+from eval import Evaluation
+from prompt_builder import Prompt_Builder
+
+
+def test_interned_history_and_items(data_paths):
+    data = Data(**data_paths)
+    assert data._history_rows.dtype.name == "int32"
+    assert data._title_rows.dtype.name == "int32"
+    assert data.get_true_item(3) == 9
+    assert data.get_N_latest_items(3, 10) == [7, 6]
+    assert data.get_N_latest_items(2, 10) == []
+    assert data.extract_title(5) == "title 5"
+    assert data.is_valid_item(5) and not data.is_valid_item(10)
+    assert data.is_valid_user(1) and not data.is_valid_user(4)
+    with pytest.raises(ValueError):
+        data.get_true_item(4)
+
+
+def test_precomputed_captions_need_no_image_folders(data_paths, tmp_path):
+    captions_path = str(tmp_path / "captions.npz")
+    np.savez(
+        captions_path,
+        item=np.array([5, 5, 5]),
+        frame=np.array([0, 1, 2]),
+        caption=np.array(["a cover", "frame one", "frame two"]),
+    )
+    data = Data(captions_path=captions_path, **data_paths)
+    assert data.has_covers and data.has_frames
+    assert data.process_cover(5) == "a cover"
+    assert data.process_frames(5) == ["frame one", "frame two"]
+    assert data.process_cover(6) is None
+    assert data.process_frames(6) == []
+
+    prompt, _ = Prompt_Builder(data).build(
+        3, [5, 6], include_cover=True, include_frames=True
+    )
+    assert "Item_Id: 5. Cover: a cover" in prompt
+    assert "Item_Id: 5. Frame_2: frame two" in prompt
+
+
+def test_captions_without_any_source_are_an_error(data_paths):
+    data = Data(**data_paths)
+    assert not data.has_covers and not data.has_frames
+    with pytest.raises(ValueError):
+        data.process_cover(5)
+    with pytest.raises(ValueError):
+        data.process_frames(5)
+
+
+def test_evaluate_reads_true_items_through_interned_rows(data_paths):
+    # True items are each user's newest interaction: 3, 5 and 9.
+    evaluation = Evaluation(Data(**data_paths))
+    metrics = evaluation.evaluate({1: [3, 1], 2: [4, 5], 3: [1, 2]}, [1, 2])
+    assert metrics[1]["hit_rate"] == pytest.approx(1 / 3)
+    assert metrics[2]["hit_rate"] == pytest.approx(2 / 3)
@@ -0,0 +1,124 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from data import Data
+from discriminative import Discriminative_Model
+
+
+def fake_embedding(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(8).tolist()
+
+
+class Fake_Batch_Runner:
+    """Answers embedding batch jobs in-process, failing every request whose
+    input mentions `failing_text`."""
+
+    def __init__(self, failing_text=None):
+        self.failing_text = failing_text
+
+    def run(self, endpoint, requests):
+        return {
+            custom_id: {
+                "data": [
+                    {"index": index, "embedding": fake_embedding(text)}
+                    for index, text in enumerate(body["input"])
+                ]
+            }
+            for custom_id, body in requests.items()
+            if not (
+                self.failing_text
+                and any(self.failing_text in text for text in body["input"])
+            )
+        }
+
+
+class One_Text_Per_Request_Model(Discriminative_Model):
+    def _embedding_batcher(self, model_name):
+        batcher = super()._embedding_batcher(model_name)
+        batcher.max_inputs = 1
+        return batcher
+
+
+def make_model(data_paths, runner, **kwargs):
+    return One_Text_Per_Request_Model(
+        name="emb",
+        source="openai",
+        data=Data(**data_paths),
+        hf_api_key=None,
+        openai_api_key="unused",
+        batch_runner=runner,
+        **kwargs,
+    )
+
+
+USER_ITEMS = {1: [4, 5, 6], 2: [8, 7, 1], 3: [1, 2, 5]}
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+def test_failed_embedding_requests_keep_the_original_order(
+    data_paths, tmp_path, use_store
+):
+    store_dir = str(tmp_path / "store") if use_store else None
+    model = make_model(
+        data_paths, Fake_Batch_Runner("title 7"), embedding_store_dir=store_dir
+    )
+    reranked = model.rerank_text_embedding_batch(USER_ITEMS, "emb")
+
+    # User 2 has item 7 as a candidate and user 3 has it in their history.
+    assert reranked[2] == [8, 7, 1]
+    assert reranked[3] == [1, 2, 5]
+    assert sorted(reranked[1]) == [4, 5, 6]
+    assert model.metrics.counters["fallback.failed_embeddings"] == 2
+
+    healthy = make_model(data_paths, Fake_Batch_Runner(), embedding_store_dir=store_dir)
+    assert reranked[1] == healthy.rerank_text_embedding_batch(USER_ITEMS, "emb")[1]
+    if use_store:
+        # Failed rows are not persisted, so the healthy run embeds item 7.
+        assert healthy.metrics.counters["embedding_store.misses"] == 1
+
+
+def test_batch_without_any_result_keeps_every_order(data_paths):
+    model = make_model(data_paths, Fake_Batch_Runner("title"))
+    reranked = model.rerank_text_embedding_batch(USER_ITEMS, "emb", with_scores=True)
+    assert reranked == {
+        user_id: (items, [0.0] * len(items)) for user_id, items in USER_ITEMS.items()
+    }
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+def test_users_without_history_get_no_added_candidates(
+    data_paths, tmp_path, use_store
+):
+    # User 2's two interactions are both held out, so their history is empty.
+    model = make_model(
+        data_paths,
+        Fake_Batch_Runner(),
+        profile_pooling="mean",
+        profile_store_dir=str(tmp_path / "profiles") if use_store else None,
+    )
+    assert model.expand_candidates({2: [1]}, "emb", n_neighbors=2) == {2: [1]}
+
+    expanded = model.expand_candidates({2: [1], 3: [1]}, "emb", n_neighbors=2)
+    assert expanded[2] == [1]
+    assert expanded[3][0] == 1 and len(expanded[3]) == 3
+    history = model.data.get_N_latest_items(3, 10)
+    assert history and not set(history) & set(expanded[3])
+
+
+def test_persisted_ann_index_is_rebuilt_when_its_inputs_change(data_paths, tmp_path):
+    index_dir = str(tmp_path / "ann")
+
+    def ann_builds(**kwargs):
+        model = make_model(
+            data_paths, Fake_Batch_Runner(), ann_index_dir=index_dir, **kwargs
+        )
+        model.expand_candidates({3: [1]}, "emb", n_neighbors=2)
+        return "ann.build" in model.metrics.timers
+
+    assert ann_builds(ann_lists=2)
+    assert not ann_builds(ann_lists=2)
+    assert ann_builds(ann_lists=3)
+    assert not ann_builds(ann_lists=3)
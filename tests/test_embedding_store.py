@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_store import Embedding_Store
+
+
+def vectors(items, dim=4):
+    return np.array([[item + column / 10 for column in range(dim)] for item in items])
+
+
+class Small_Store(Embedding_Store):
+    MIN_CAPACITY = 4
+
+
+def test_appends_in_place_and_grows_geometrically(tmp_path):
+    store = Small_Store(str(tmp_path), "emb")
+    capacities = []
+    for start in range(0, 40, 3):
+        items = list(range(start + 1, start + 4))
+        store.add(items, vectors(items))
+        assert len(store) == start + 3 <= store.capacity
+        assert os.path.getsize(store.matrix_path) > store.capacity * 4 * 4
+        capacities.append(store.capacity)
+    # One copy per doubling, not one per add.
+    assert sorted(set(capacities)) == [4, 8, 16, 32, 64]
+    np.testing.assert_allclose(store.get([40, 1, 17]), vectors([40, 1, 17]))
+
+
+def test_reader_sees_only_published_rows(tmp_path):
+    writer = Small_Store(str(tmp_path), "emb")
+    writer.add([1, 2], vectors([1, 2]))
+    reader = Small_Store(str(tmp_path), "emb")
+    writer.add([3], vectors([3]))
+
+    assert len(reader) == 2 and 3 not in reader
+    np.testing.assert_allclose(reader.get([2, 1]), vectors([2, 1]))
+
+    reopened = Embedding_Store(str(tmp_path), "emb")
+    assert len(reopened) == 3 and reopened.capacity == 4
+    np.testing.assert_allclose(reopened.get([3]), vectors([3]))
+
+
+def test_add_skips_stored_items_and_checks_dimensions(tmp_path):
+    store = Embedding_Store(str(tmp_path), "emb", dtype="float16")
+    store.add([1, 2], vectors([1, 2]))
+    store.add([2, 3], vectors([20, 3]))
+    assert store.missing([1, 2, 3, 4]) == [4]
+    np.testing.assert_allclose(store.get([2]), vectors([2]), rtol=1e-3)
+    with pytest.raises(ValueError):
+        store.add([5], vectors([5], dim=3))
+    with pytest.raises(KeyError):
+        store.get([4])
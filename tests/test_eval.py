@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from data import Data
+from eval import Evaluation
+from recommendations import Recommendation_Lists
+
+# True items (each user's newest interaction) are 3, 5 and 9. Item 10 has
+# no interactions and -1 is padding; both are skipped when ranking, as
+# filter_items would. User 4 is not in the pairs and always misses.
+RECOMMENDATIONS = {
+    1: [10, 3, 1],  # rank 0
+    2: [1, -1, 2, 5],  # rank 2
+    3: [1, 2, 3, 4, 9],  # rank 4
+    4: [1, 2],
+}
+
+EXPECTED = {
+    1: {"hit_rate": 1 / 4, "ndcg": 1 / 4, "mrr": 1 / 4},
+    3: {"hit_rate": 2 / 4, "ndcg": (1 + 1 / 2) / 4, "mrr": (1 + 1 / 3) / 4},
+    5: {
+        "hit_rate": 3 / 4,
+        "ndcg": (1 + 1 / 2 + 1 / np.log2(6)) / 4,
+        "mrr": (1 + 1 / 3 + 1 / 5) / 4,
+    },
+}
+
+
+@pytest.fixture
+def evaluation(data_paths):
+    return Evaluation(Data(**data_paths))
+
+
+def assert_metrics(metrics):
+    assert set(metrics) == set(EXPECTED)
+    for N, expected in EXPECTED.items():
+        assert metrics[N] == pytest.approx(expected)
+
+
+def test_true_item_ranks(evaluation):
+    ranks = evaluation.true_item_ranks(RECOMMENDATIONS)
+    assert ranks.tolist() == [0, 2, 4, -1]
+
+
+def test_evaluate_against_hand_computed_metrics(evaluation):
+    assert_metrics(evaluation.evaluate(RECOMMENDATIONS, [1, 3, 5]))
+
+
+def test_evaluate_padded_matrix(evaluation):
+    lists = Recommendation_Lists.from_dict(RECOMMENDATIONS)
+    assert lists.items.shape == (4, 5)
+    assert_metrics(evaluation.evaluate(lists, [1, 3, 5]))
+    assert evaluation.evaluate_hit_rate(lists, 3) == pytest.approx(2 / 4)
+
+
+def test_data_metrics_without_cutoff(evaluation):
+    data = evaluation.data
+    users, items = list(RECOMMENDATIONS), list(RECOMMENDATIONS.values())
+    assert data.hit_rate(users, items) == pytest.approx(3 / 4)
+    assert data.ndcg(users, items) == pytest.approx(EXPECTED[5]["ndcg"])
+
+
+def test_empty_recommendations(evaluation):
+    assert evaluation.evaluate({}, [1]) == {
+        1: {"hit_rate": 0.0, "ndcg": 0.0, "mrr": 0.0}
+    }
+
+
+def test_data_without_users(tmp_path):
+    pairs = tmp_path / "pairs.csv"
+    pairs.write_text("user,item,timestamp\n")
+    titles = tmp_path / "titles.csv"
+    titles.write_text("")
+    data = Data(pairs_path=str(pairs), titles_path=str(titles))
+    assert data.get_true_items(np.array([1, 2])).tolist() == [-1, -1]
+    assert Evaluation(data).evaluate({1: [1, 2]}, [1])[1]["hit_rate"] == 0.0
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from data import Data
+from generative import Generative_Model
+from response_cache import Response_Cache
+from transport import Transport
+
+
+class Fake_Chat:
+    """OpenAI chat client stand-in that replies with `reply`."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, model):
+        self.calls += 1
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def make_model(data_paths, tmp_path, reply):
+    model = Generative_Model(
+        name="gpt",
+        source="openai",
+        data=Data(**data_paths),
+        openai_api_key="unused",
+        transport=Transport(requests_per_second=1000),
+        response_cache=Response_Cache(str(tmp_path / "cache.db")),
+    )
+    model.openai_client = Fake_Chat(reply)
+    return model
+
+
+def test_parsed_responses_are_cached(data_paths, tmp_path):
+    model = make_model(data_paths, tmp_path, "9, 7, 8")
+    assert model.reranker_gpt(3, [7, 8, 9], "m") == [9, 7, 8]
+    assert model.reranker_gpt(3, [7, 8, 9], "m") == [9, 7, 8]
+    assert model.openai_client.calls == 1
+    assert model.metrics.counters["response_cache.hits"] == 1
+
+
+def test_unparseable_responses_are_not_cached(data_paths, tmp_path):
+    model = make_model(data_paths, tmp_path, "I cannot rank these items.")
+    assert model.reranker_gpt(3, [7, 8, 9], "m") == [7, 8, 9]
+    assert model.reranker_gpt(3, [7, 8, 9], "m") == [7, 8, 9]
+    assert model.openai_client.calls == 2
+    assert model.metrics.counters["fallback.invalid_response"] == 2
+    assert model.response_cache._count == 0
+
+
+def test_transport_is_the_only_retry_layer(data_paths, server):
+    server.replies.extend([(503, {})] * 10)
+    transport = Transport(
+        requests_per_second=1000, max_retries=1, backoff_base=0.001, timeout=5.0
+    )
+    model = Generative_Model(
+        name="gpt",
+        source="openai",
+        data=Data(**data_paths),
+        openai_api_key="unused",
+        openai_base_url=server.url + "v1",
+        transport=transport,
+    )
+    assert model.openai_client.max_retries == 0
+    assert model.openai_client.timeout == 5.0
+    with pytest.raises(openai.InternalServerError):
+        model.reranker_gpt(3, [7, 8, 9], "m")
+    assert len(server.received) == 2
+    assert transport.requests_sent == 2
+
+
+def test_openai_connection_errors_are_retried(data_paths):
+    transport = Transport(requests_per_second=1000, max_retries=2, backoff_base=0.001)
+    model = Generative_Model(
+        name="gpt",
+        source="openai",
+        data=Data(**data_paths),
+        openai_api_key="unused",
+        # Nothing listens on port 9 of localhost.
+        openai_base_url="http://127.0.0.1:9/v1",
+        transport=transport,
+    )
+    with pytest.raises(openai.APIConnectionError):
+        model.reranker_gpt(3, [7, 8, 9], "m")
+    assert transport.retries == 2
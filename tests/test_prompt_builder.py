@@ -0,0 +1,30 @@
+import time
+
+from data import Data
+from prompt_builder import Prompt_Builder
+
+
+def test_token_counts_add_up_over_prompts_of_one_user(data_paths):
+    builder = Prompt_Builder(Data(**data_paths))
+    first, _ = builder.build(3, [6, 7])
+    second, _ = builder.build(3, [8, 9])
+    assert builder.token_counts[3] == (
+        builder.count_tokens(first) + builder.count_tokens(second)
+    )
+    assert builder.metrics.counters["prompt.tokens"] == builder.token_counts[3]
+
+
+def test_captioning_is_timed_apart_from_lookups(data_paths, tmp_path):
+    data = Data(covers_path=str(tmp_path), **data_paths)
+
+    def slow_cover(item):
+        time.sleep(0.05)
+        return f"cover {item}"
+
+    data.process_cover = slow_cover
+    builder = Prompt_Builder(data)
+    prompt, _ = builder.build(3, [6, 7], include_cover=True)
+    assert "Item_Id: 7. Cover: cover 7" in prompt
+    timers = builder.metrics.timers
+    assert timers["data.caption"].sum >= 0.1
+    assert timers["data.lookup"].sum < 0.05
@@ -0,0 +1,35 @@
+import os
+
+from recommendations import (
+    Recommendation_Lists,
+    is_binary_recommendations,
+    read_recommendations,
+    write_recommendations,
+)
+
+PAIRS = [(1, [3, 2, 1]), (2, [5]), (3, [])]
+
+
+def test_text_npz_and_directory_round_trips(tmp_path):
+    for name in ("lists.txt", "lists.npz", "lists" + os.sep):
+        path = os.path.join(str(tmp_path), name)
+        write_recommendations(path, PAIRS)
+        assert list(read_recommendations(path)) == PAIRS
+
+
+def test_new_directory_needs_a_trailing_separator(tmp_path):
+    directory = str(tmp_path / "out") + os.sep
+    assert is_binary_recommendations(directory)
+    write_recommendations(directory, PAIRS)
+    assert os.path.isfile(os.path.join(directory, "items.npy"))
+
+    # Once it exists, the directory is recognised without the separator.
+    existing = str(tmp_path / "out")
+    assert is_binary_recommendations(existing)
+    assert Recommendation_Lists.load(existing).to_dict() == dict(PAIRS)
+
+    text = str(tmp_path / "new_name")
+    assert not is_binary_recommendations(text)
+    write_recommendations(text, PAIRS)
+    assert os.path.isfile(text)
+    assert list(read_recommendations(text)) == PAIRS
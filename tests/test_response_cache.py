@@ -0,0 +1,36 @@
+from response_cache import Response_Cache
+
+
+def rows(cache):
+    (count,) = cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+    return count
+
+
+def test_put_get_and_replace(tmp_path):
+    cache = Response_Cache(str(tmp_path / "cache.db"))
+    assert cache.get("m", "prompt") is None
+    cache.put("m", "prompt", "1, 2")
+    cache.put("m", "prompt", "2, 1")
+    assert cache.get("m", "prompt") == "2, 1"
+    assert cache.get("m", "prompt", {"max_tokens": 5}) is None
+    assert cache._count == rows(cache) == 1
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_eviction_keeps_the_running_count_exact(tmp_path):
+    cache = Response_Cache(str(tmp_path / "cache.db"), max_entries=10)
+    for index in range(25):
+        cache.put("m", f"prompt {index}", str(index))
+        assert cache._count == rows(cache) <= 10
+    # The most recently used entries survive.
+    assert cache.get("m", "prompt 24") == "24"
+    assert cache.get("m", "prompt 0") is None
+
+
+def test_count_is_restored_on_reopen(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = Response_Cache(path)
+    for index in range(3):
+        cache.put("m", f"prompt {index}", str(index))
+    cache.close()
+    assert Response_Cache(path)._count == 3
@@ -0,0 +1,68 @@
+from stream_parser import Incremental_ID_Parser
+
+
+def parse(deltas, candidates):
+    parser = Incremental_ID_Parser(candidates)
+    for delta in deltas:
+        parser.feed(delta)
+    parser.close()
+    return parser
+
+
+def test_number_split_across_deltas_is_not_cut_short():
+    parser = parse(["[12", "3", "4, 5, 7]"], [123, 5, 7])
+    assert parser.ids == [5, 7]
+    assert parser.ranked_items() == [5, 7, 123]
+
+
+def test_number_split_across_deltas_is_joined():
+    parser = parse(["[1", "23, ", "7", ", 5]"], [123, 5, 7])
+    assert parser.ids == [123, 7, 5]
+
+
+def test_trailing_number_waits_for_next_character():
+    parser = Incremental_ID_Parser([123, 5])
+    assert not parser.feed("5, 123")
+    assert parser.ids == [5]
+    assert parser.feed("]")
+    assert parser.ids == [5, 123]
+
+
+def test_trailing_number_is_accepted_on_close():
+    parser = Incremental_ID_Parser([1, 2])
+    parser.feed("2, 1")
+    assert parser.ids == [2]
+    parser.close()
+    assert parser.ids == [2, 1]
+
+
+def test_counts_in_preamble_are_ignored():
+    parser = parse(["Here are 3 items: 2, 1"], [1, 2, 3])
+    assert parser.ids == [2, 1]
+    assert parser.ranked_items() == [2, 1, 3]
+
+
+def test_preamble_count_split_from_its_word():
+    parser = parse(["Top 3", " ", "picks: 3, 1", ", 2"], [1, 2, 3])
+    assert parser.ids == [3, 1, 2]
+
+
+def test_count_followed_by_colon_is_ignored():
+    parser = parse(["The best 2: 1, 2, 3"], [1, 2, 3])
+    assert parser.ids == [1, 2, 3]
+
+
+def test_newline_and_space_separated_ids():
+    parser = parse(["3\n1 ", "2\n"], [1, 2, 3])
+    assert parser.ids == [3, 1, 2]
+
+
+def test_unknown_and_repeated_ids_are_ignored():
+    parser = parse(["9, 2, 2, 1"], [1, 2])
+    assert parser.ids == [2, 1]
+
+
+def test_done_once_every_candidate_is_delimited():
+    parser = Incremental_ID_Parser([1, 2])
+    assert not parser.feed("2, 1")
+    assert parser.feed(",")
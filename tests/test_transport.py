@@ -0,0 +1,58 @@
+import pytest
+import requests
+
+from transport import Transport
+
+
+def fast_transport(**kwargs):
+    return Transport(
+        requests_per_second=1000, backoff_base=0.001, backoff_max=0.05, **kwargs
+    )
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retryable_status_is_retried(server, status):
+    server.replies.extend([(status, {}), (status, {})])
+    transport = fast_transport()
+    response = transport.get(server.url)
+    assert response.status_code == 200
+    assert response.text == "ok"
+    assert len(server.received) == 3
+    assert transport.retries == 2
+
+
+def test_gives_up_after_max_retries(server):
+    server.replies.extend([(503, {})] * 3)
+    transport = fast_transport(max_retries=2)
+    with pytest.raises(requests.HTTPError) as error:
+        transport.get(server.url)
+    assert error.value.response.status_code == 503
+    assert len(server.received) == 3
+
+
+def test_other_errors_are_not_retried(server):
+    server.replies.append((404, {}))
+    transport = fast_transport()
+    assert transport.get(server.url).status_code == 404
+    assert len(server.received) == 1
+    assert transport.retries == 0
+
+
+def test_retry_after_is_clamped_to_backoff_max(server, monkeypatch):
+    server.replies.append((429, {"Retry-After": "3600"}))
+    transport = fast_transport()
+    sleeps = []
+    monkeypatch.setattr("transport.time.sleep", sleeps.append)
+    assert transport.get(server.url).status_code == 200
+    assert sleeps and max(sleeps) <= transport.backoff_max
+    # Throttling halves the limiter's rate.
+    assert transport.limiter.rate < transport.limiter.max_rate
+
+
+def test_short_retry_after_is_honoured(server, monkeypatch):
+    server.replies.append((503, {"Retry-After": "0.02"}))
+    transport = fast_transport()
+    sleeps = []
+    monkeypatch.setattr("transport.time.sleep", sleeps.append)
+    assert transport.get(server.url).status_code == 200
+    assert sleeps == [0.02]
@@ -0,0 +1,76 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from windowing import windowed_rerank
+
+
+def sorting_reranker(calls):
+    # Ranks higher IDs first and records every window it is shown.
+    def rerank(window):
+        calls.append(list(window))
+        return sorted(window, reverse=True)
+
+    return rerank
+
+
+def shuffled(n, seed=0):
+    items = list(range(n))
+    random.Random(seed).shuffle(items)
+    return items
+
+
+def test_short_list_is_one_call():
+    calls = []
+    assert windowed_rerank([1, 3, 2], sorting_reranker(calls), 5, 2) == [3, 2, 1]
+    assert calls == [[1, 3, 2]]
+
+
+@pytest.mark.parametrize("n, window, stride", [(100, 20, 10), (50, 20, 5), (37, 8, 3)])
+def test_top_items_are_exact_and_every_item_kept(n, window, stride):
+    calls = []
+    items = shuffled(n)
+    ranked = windowed_rerank(items, sorting_reranker(calls), window, stride)
+    assert sorted(ranked) == list(range(n))
+    carry = window - stride
+    assert ranked[:carry] == list(range(n - 1, n - 1 - carry, -1))
+    assert all(len(call) <= window for call in calls)
+    # Every item is shown to the reranker at least once.
+    assert set().union(*map(set, calls)) == set(items)
+
+
+def test_later_rounds_rank_above_earlier_eliminations():
+    calls = []
+    ranked = windowed_rerank(list(range(12)), sorting_reranker(calls), 4, 2)
+    # Round 1 keeps {3, 2}, {7, 6}, {11, 10}; round 2 keeps {7, 6}, {11, 10}.
+    assert ranked[:4] == [11, 10, 7, 6]
+    assert ranked[4:6] == [3, 2]
+    assert ranked[6:] == [1, 5, 9, 0, 4, 8]
+
+
+def test_stride_equal_to_window_interleaves_independent_windows():
+    ranked = windowed_rerank(list(range(6)), sorting_reranker([]), 3, 3)
+    assert ranked == [2, 5, 1, 4, 0, 3]
+
+
+def test_concurrent_rounds_match_sequential():
+    items = shuffled(80, seed=1)
+    with ThreadPoolExecutor(4) as executor:
+        concurrent = windowed_rerank(items, sorting_reranker([]), 10, 4, executor)
+    assert concurrent == windowed_rerank(items, sorting_reranker([]), 10, 4)
+
+
+def test_items_dropped_by_the_reranker_keep_their_window_order():
+    def forgetful(window):
+        return sorted(window, reverse=True)[:1]
+
+    ranked = windowed_rerank(list(range(8)), forgetful, 4, 2)
+    assert sorted(ranked) == list(range(8))
+    assert ranked[0] == 7
+
+
+@pytest.mark.parametrize("stride", [0, -1, 6])
+def test_invalid_stride_is_rejected(stride):
+    with pytest.raises(ValueError):
+        windowed_rerank(list(range(20)), sorting_reranker([]), 5, stride)
@@ -0,0 +1,246 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, Tuple, TypeVar
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+CONNECTION_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    ConnectionError,
+    TimeoutError,
+    # Includes APITimeoutError; the OpenAI clients are built without their
+    # own retries, so these reach the transport.
+    openai.APIConnectionError,
+)
+
+
+class Circuit_Open_Error(requests.ConnectionError):
+    pass
+
+
+def error_status(error: Exception) -> Tuple[Optional[int], Optional[dict]]:
+    # HTTP status and headers of a failed call, for requests, openai and
+    # huggingface_hub errors alike.
+    if isinstance(error, Circuit_Open_Error):
+        return None, None
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    return status, getattr(response, "headers", None)
+
+
+class Token_Bucket:
+    """Token-bucket rate limiter whose rate adapts to provider throttling.
+
+    A 429 halves the rate and pauses all callers for the Retry-After
+    period; every success creeps the rate back towards max_rate.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = 0.1):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(
+                    self._paused_until - now, (1 - self.tokens) / self.rate
+                )
+            time.sleep(wait)
+
+    def throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + retry_after
+                )
+
+    def succeed(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class Circuit_Breaker:
+    """Fails fast after `failure_threshold` consecutive failures, then lets
+    a single trial request through once `reset_timeout` has passed."""
+
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if (
+                time.monotonic() - self._opened_at >= self.reset_timeout
+                and not self._trial_in_flight
+            ):
+                self._trial_in_flight = True
+                return
+        raise Circuit_Open_Error("Circuit breaker is open; refusing request.")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Transport:
+    """Shared HTTP transport for every remote call in the pipeline.
+
+    Keeps a pooled keep-alive session and wraps each request in the rate
+    limiter, jittered exponential backoff on retryable failures, and a
+    circuit breaker. A server's Retry-After is honoured up to backoff_max.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = 10.0,
+        burst: float = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 60.0,
+        pool_size: int = 32,
+        failure_threshold: int = 10,
+        reset_timeout: float = 30.0,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.limiter = Token_Bucket(requests_per_second, burst)
+        self.breaker = Circuit_Breaker(failure_threshold, reset_timeout)
+        self.requests_sent = 0
+        self.retries = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, base * 2^attempt], capped.
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * (2**attempt))
+        )
+
+    def _record_failure(self, status: Optional[int], headers, attempt: int) -> float:
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        if retry_after is not None:
+            # A server asking for hours would otherwise stall every caller.
+            retry_after = min(retry_after, self.backoff_max)
+        if status == 429:
+            # Throttling means the provider is healthy but we are too fast,
+            # so it slows the limiter rather than tripping the breaker.
+            self.limiter.throttle(retry_after)
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return retry_after if retry_after is not None else self._backoff(attempt)
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        # Runs any remote call (including third-party clients) under the
+        # limiter, breaker and retry policy. Errors count as retryable when
+        # they are connection failures or carry a retryable HTTP status.
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            self.limiter.acquire()
+            self.requests_sent += 1
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                status, headers = error_status(error)
+                if status not in RETRY_STATUS_CODES and not isinstance(
+                    error, CONNECTION_ERRORS
+                ):
+                    # Not a provider outage; also releases a half-open trial.
+                    self.breaker.record_success()
+                    raise
+                delay = self._record_failure(status, headers, attempt)
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                self.breaker.record_success()
+                self.limiter.succeed()
+                return result
+
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+
+        def send() -> requests.Response:
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code in RETRY_STATUS_CODES:
+                raise requests.HTTPError(
+                    f"{response.status_code} error for url: {url}", response=response
+                )
+            return response
+
+        return self.call(send)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
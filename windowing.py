@@ -0,0 +1,71 @@
+from concurrent.futures import Executor
+from typing import Callable, List
+
+
+def _rank_window(
+    rerank_window: Callable[[List[int]], List[int]], window: List[int], carry: int
+) -> List[int]:
+    # A window the whole of which is carried forward needs no call; it is
+    # ranked in a later round.
+    if len(window) <= carry:
+        return window
+    ranking = [item for item in dict.fromkeys(rerank_window(window)) if item in window]
+    ranked = set(ranking)
+    return ranking + [item for item in window if item not in ranked]
+
+
+def windowed_rerank(
+    items: List[int],
+    rerank_window: Callable[[List[int]], List[int]],
+    window: int,
+    stride: int,
+    executor: Executor = None,
+) -> List[int]:
+    """Listwise rerank of a long list through windows of at most `window`
+    items, as a tournament.
+
+    Each round splits the surviving items into consecutive windows,
+    reranks them concurrently and carries the top `window - stride` items
+    of every window forward, the same number a back-to-front sliding pass
+    with that stride carries from one window into the next. Once the
+    survivors fit in one window they are reranked together and lead the
+    list. Items eliminated in a later round rank above those eliminated
+    earlier; within a round, by their position in their window, then by
+    window order. The top `window - stride` items are exact for a
+    consistent reranker.
+
+    A sliding pass needs about len(items) / stride sequential calls. Here
+    the calls of a round run concurrently, so wall-clock time grows with
+    the number of rounds, which is logarithmic in len(items).
+    """
+    if not 1 <= stride <= window:
+        raise ValueError(f"Window stride {stride} is not between 1 and {window}.")
+    if len(items) <= window:
+        return rerank_window(items)
+
+    carry = window - stride
+    survivors = list(items)
+    eliminated: List[List[int]] = []
+    while len(survivors) > window:
+        windows = [
+            survivors[start : start + window]
+            for start in range(0, len(survivors), window)
+        ]
+        if executor is None:
+            rankings = [_rank_window(rerank_window, w, carry) for w in windows]
+        else:
+            rankings = list(
+                executor.map(lambda w: _rank_window(rerank_window, w, carry), windows)
+            )
+        survivors = [item for ranking in rankings for item in ranking[:carry]]
+        eliminated.append(
+            [
+                ranking[position]
+                for position in range(carry, window)
+                for ranking in rankings
+                if position < len(ranking)
+            ]
+        )
+
+    head = _rank_window(rerank_window, survivors, 0) if survivors else []
+    return head + [item for round_items in reversed(eliminated) for item in round_items]